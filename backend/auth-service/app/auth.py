@@ -1,24 +1,44 @@
+import hashlib
+import logging
+import os
 import time
 import uuid
 from datetime import datetime, timedelta
 
-import bcrypt
-import requests
 from bson import ObjectId
 from fastapi import HTTPException
 from jose import JWTError, jwt
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
-from .models import PasswordUpdateRequest, PendingUser, UserResponse
+from .cache import TTLCache
+from .hashing import password_hasher
+from .metrics import register_cache
+from .models import PasswordUpdateRequest, PendingUser, UserApprovalRequest, UserApprovalResult, UserResponse
+from .outbox import OUTBOX_COLLECTION, outbox_worker, user_approved_events
 
 
-SECRET_KEY = "your-secret-key"
-ALGORITHM = "HS256"
+# expense-service verifies tokens locally with the same key material.
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+
 ADMIN_EMAIL = "admin@example.com"
+APPROVAL_TRANSACTIONS = os.getenv("APPROVAL_TRANSACTIONS", "1") == "1"
+ILLEGAL_OPERATION = 20
+
+VERIFY_TOKEN_CACHE_SIZE = int(os.getenv("VERIFY_TOKEN_CACHE_SIZE", "10000"))
+VERIFY_TOKEN_CACHE_TTL = float(os.getenv("VERIFY_TOKEN_CACHE_TTL", "60"))
 
+logger = logging.getLogger(__name__)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+# sha256(token) -> (checkedAt, UserResponse), so raw tokens are never kept in memory. An entry
+# lives at most VERIFY_TOKEN_CACHE_TTL and never past the token's own expiry.
+verified_tokens = TTLCache(VERIFY_TOKEN_CACHE_SIZE, VERIFY_TOKEN_CACHE_TTL)
+register_cache("verified_tokens", verified_tokens)
+# userId -> time.monotonic() of the user's last invalidation; entries checked before it are misses.
+# An invalidation only matters for VERIFY_TOKEN_CACHE_TTL, after which older entries have expired.
+_invalidated_at: dict[str, float] = {}
 
 
 def create_access_token(data: dict) -> str:
@@ -26,10 +46,9 @@ def create_access_token(data: dict) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def authenticate_user(email: str, password: str, db: Database) -> UserResponse:
-    user = db.user.find_one({"email": email})
-    print(f"User found: {user}")
-    if not user or not verify_password(password, user["hashedPassword"]):
+async def authenticate_user(email: str, password: str, db: AsyncIOMotorDatabase) -> UserResponse:
+    user = await db.user.find_one({"email": email})
+    if not user or not await password_hasher.verify(password, user["hashedPassword"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     if user.get("deletedAt") is not None:
         raise HTTPException(status_code=401, detail="User is deleted")
@@ -39,7 +58,38 @@ def authenticate_user(email: str, password: str, db: Database) -> UserResponse:
     return UserResponse(email=user["email"], userId=str(user["_id"]), role=role)
 
 
-def verify_token(token: str, db: Database) -> UserResponse:
+def invalidate_user_tokens(user_id: str) -> None:
+    """Stop trusting cached verifications of the user's tokens (password change, deletion)."""
+    now = time.monotonic()
+    if len(_invalidated_at) >= VERIFY_TOKEN_CACHE_SIZE:
+        for stale in [user for user, at in _invalidated_at.items() if at <= now - VERIFY_TOKEN_CACHE_TTL]:
+            del _invalidated_at[stale]
+        if len(_invalidated_at) >= VERIFY_TOKEN_CACHE_SIZE:
+            # Too many recent invalidations to track one by one: distrust everything cached so far.
+            verified_tokens.invalidate_all()
+            _invalidated_at.clear()
+    _invalidated_at[user_id] = now
+
+
+def _still_valid(user_id: str, checked_at: float) -> bool:
+    return checked_at > _invalidated_at.get(user_id, float("-inf"))
+
+
+def _cache_ttl(payload: dict) -> float:
+    expires_at = payload.get("exp")
+    return VERIFY_TOKEN_CACHE_TTL if expires_at is None else min(VERIFY_TOKEN_CACHE_TTL, expires_at - time.time())
+
+
+async def verify_token(token: str, db: AsyncIOMotorDatabase) -> UserResponse:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    cached = verified_tokens.get(key)
+    if cached is not None:
+        checked_at, user = cached
+        if _still_valid(user.userId, checked_at):
+            return user
+        verified_tokens.invalidate(key)
+    # Taken before the lookup, so an invalidation that lands while it is in flight wins.
+    checked_at = time.monotonic()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
@@ -47,34 +97,39 @@ def verify_token(token: str, db: Database) -> UserResponse:
             raise HTTPException(status_code=401, detail="Invalid token")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.user.find_one({"email": email})
+        user = await db.user.find_one({"email": email}, {"deletedAt": 1})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
+        if user.get("deletedAt") is not None:
+            raise HTTPException(status_code=401, detail="User is deleted")
         role = "admin" if email == ADMIN_EMAIL else "user"
-        return UserResponse(email=email, userId=str(user["_id"]), role=role)
+        verified = UserResponse(email=email, userId=str(user["_id"]), role=role)
+        ttl = _cache_ttl(payload)
+        if ttl > 0 and _still_valid(verified.userId, checked_at):
+            verified_tokens.set(key, (checked_at, verified), ttl)
+        return verified
     except JWTError as exc:
         raise HTTPException(status_code=401, detail="Could not validate token") from exc
 
 
-def initiate_password_reset(email: str, db: Database) -> str:
-    user = db.user.find_one({"email": email})
+async def initiate_password_reset(email: str, db: AsyncIOMotorDatabase) -> str:
+    user = await db.user.find_one({"email": email})
     if not user:
         raise HTTPException(status_code=404, detail="Email not found")
     reset_token = str(uuid.uuid4())
     expires_at = datetime.utcnow() + timedelta(hours=1)
     reset_entry = {"userId": str(user["_id"]), "resetToken": reset_token, "expiresAt": expires_at}
-    db.password_resets.insert_one(reset_entry)
+    await db.password_resets.insert_one(reset_entry)
     reset_link = f"http://localhost:5173/reset-password?token={reset_token}"
-    print(f"Password reset link (simulated): {reset_link}")
+    logger.info("Password reset link (simulated)", extra={"userId": str(user["_id"]), "resetLink": reset_link})
     return reset_link
 
 
-def create_pending_user(email: str, password: str, db: Database) -> PendingUser:
-    existing_pending = db.user.find_one({"email": email})
-    existing_user = db.user.find_one({"email": email})
-    if existing_pending or existing_user:
+async def create_pending_user(email: str, password: str, db: AsyncIOMotorDatabase) -> PendingUser:
+    # Checked before hashing so duplicates do not cost a bcrypt round; the unique index catches races.
+    if await db.user.find_one({"email": email}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Email already registered or pending approval")
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    hashed_password = await password_hasher.hash(password)
     pending_user = {
         "email": email,
         "hashedPassword": hashed_password,
@@ -83,41 +138,100 @@ def create_pending_user(email: str, password: str, db: Database) -> PendingUser:
         "groupId": None,
         "verified": False,
     }
-    result = db.user.insert_one(pending_user)
+    try:
+        result = await db.user.insert_one(pending_user)
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail="Email already registered or pending approval") from e
     pending_user["userId"] = str(result.inserted_id)
     return PendingUser(**pending_user)
 
 
-def get_pending_users(db: Database) -> list[PendingUser]:
-    pending_users = db.user.find({"verified": False}).to_list()
-    return [PendingUser(**{**user, "userId": str(user["_id"])}) for user in pending_users]
+async def get_pending_users(
+    db: AsyncIOMotorDatabase, limit: int, cursor: str | None = None
+) -> tuple[list[PendingUser], str | None]:
+    """One page of pending users in signup order, plus the cursor of the next page (None on the last)."""
+    query: dict = {"verified": False}
+    if cursor:
+        if not ObjectId.is_valid(cursor):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(cursor)}
+    # Only the fields the admin list shows; never the password hash.
+    users = await db.user.find(query, {"email": 1, "createdAt": 1}).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(users[limit - 1]["_id"]) if len(users) > limit else None
+    return [PendingUser(**{**user, "userId": str(user["_id"])}) for user in users[:limit]], next_cursor
+
+
+async def _review_in_transaction(db: AsyncIOMotorDatabase, operations: list, events: list[UpdateOne]) -> bool:
+    """Apply the decisions and queue the outbox events atomically; False if transactions are unavailable."""
+    async with await db.client.start_session() as session:
+        try:
+            async with session.start_transaction():
+                await db[OUTBOX_COLLECTION].bulk_write(events, ordered=False, session=session)
+                await db.user.bulk_write(operations, ordered=False, session=session)
+        except OperationFailure as exc:
+            if exc.code == ILLEGAL_OPERATION:
+                return False
+            raise
+    return True
+
+
+async def approve_users(decisions: list[UserApprovalRequest], db: AsyncIOMotorDatabase) -> list[UserApprovalResult]:
+    """Approve or reject many pending users with one read and one bulk_write.
+
+    Profiles are not created here: every approval queues an outbox event that the outbox worker
+    delivers to expense-service, so approving does not depend on expense-service being up.
+    """
+    valid = {decision.userId: decision.approve for decision in decisions if ObjectId.is_valid(decision.userId)}
+    pending = {
+        str(user["_id"])
+        async for user in db.user.find(
+            {"_id": {"$in": [ObjectId(user_id) for user_id in valid]}, "verified": False}, {"_id": 1}
+        )
+    }
+    operations = [
+        UpdateOne({"_id": ObjectId(user_id), "verified": False}, {"$set": {"verified": True}})
+        if valid[user_id]
+        else DeleteOne({"_id": ObjectId(user_id), "verified": False})
+        for user_id in pending
+    ]
+    approved = [user_id for user_id in pending if valid[user_id]]
+    if approved:
+        events = user_approved_events(approved)
+        if not (APPROVAL_TRANSACTIONS and await _review_in_transaction(db, operations, events)):
+            # Event first: the worker holds it back until the user is actually approved.
+            await db[OUTBOX_COLLECTION].bulk_write(events, ordered=False)
+            await db.user.bulk_write(operations, ordered=False)
+        outbox_worker.notify()
+    elif operations:
+        await db.user.bulk_write(operations, ordered=False)
+    for user_id in pending:
+        if not valid[user_id]:
+            invalidate_user_tokens(user_id)
+    logger.info("Users reviewed", extra={"approved": len(approved), "rejected": len(pending) - len(approved)})
+
+    results = []
+    for decision in decisions:
+        if decision.userId not in valid:
+            status = "invalid"
+        elif decision.userId not in pending:
+            status = "not_found"
+        else:
+            status = "approved" if valid[decision.userId] else "rejected"
+        results.append(UserApprovalResult(userId=decision.userId, status=status))
+    return results
+
+
+async def approve_user(user_id: str, approve: bool, db: AsyncIOMotorDatabase) -> None:
+    [result] = await approve_users([UserApprovalRequest(userId=user_id, approve=approve)], db)
+    if result.status in ("invalid", "not_found"):
+        raise HTTPException(status_code=404, detail="Pending user not found")
 
 
-def approve_user(user_id: str, approve: bool, db: Database) -> None:
-    pending_user = db.user.find_one({"_id": ObjectId(user_id), "verified": False})
-    if not pending_user:
-        raise HTTPException(status_code=404, detail="Pending user not found")
-    if approve:
-        db.user.update_one({"_id": ObjectId(user_id)}, {"$set": {"verified": True}})
-        # Notify expense-service to create user profile
-        try:
-            requests.post(
-                "http://127.0.0.1:8001/user/profile",
-                json={"userId": user_id},
-                timeout=5,
-            )
-        except requests.RequestException as e:
-            print(f"Failed to notify expense-service: {e}")
-        print(f"User approved: {pending_user['email']}")
-    else:
-        db.user.delete_one({"_id": ObjectId(user_id)})
-        print(f"User rejected: {pending_user['email']}")
-
-
-def update_password(password_data: PasswordUpdateRequest, user: UserResponse, db: Database) -> None:
-    hashed_password = bcrypt.hashpw(password_data.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-    result = db.user.update_one(
+async def update_password(password_data: PasswordUpdateRequest, user: UserResponse, db: AsyncIOMotorDatabase) -> None:
+    hashed_password = await password_hasher.hash(password_data.password)
+    result = await db.user.update_one(
         {"_id": ObjectId(user.userId)}, {"$set": {"hashedPassword": hashed_password, "updatedAt": int(time.time())}}
     )
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_user_tokens(user.userId)
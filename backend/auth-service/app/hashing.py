@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from .metrics import PASSWORD_HASH_REJECTED, PASSWORD_HASH_SECONDS
+
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", str(PASSWORD_HASH_WORKERS * 4)))
+
+
+class HashingCapacityError(Exception):
+    """Raised when the password hashing queue is full and the request should be shed."""
+
+
+def _hashpw(password: bytes) -> tuple[bytes, float]:
+    started_at = time.time()
+    return bcrypt.hashpw(password, bcrypt.gensalt()), started_at
+
+
+def _checkpw(password: bytes, hashed: bytes) -> tuple[bool, float]:
+    started_at = time.time()
+    return bcrypt.checkpw(password, hashed), started_at
+
+
+class PasswordHasher:
+    """Runs bcrypt in a dedicated process pool with a bounded queue in front of it.
+
+    Only the event loop touches the counters, so they need no locking.
+    """
+
+    def __init__(self, workers: int, queue_size: int) -> None:
+        self.workers = workers
+        self.queue_size = queue_size
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def start(self) -> None:
+        if self._executor is None:
+            # spawn rather than fork: the parent already runs the event loop and driver threads.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._submit("hash", _hashpw, password.encode("utf-8"))
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._submit("verify", _checkpw, password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+    async def _submit[T](self, operation: str, fn: Callable[..., tuple[T, float]], *args: bytes) -> T:
+        if self._pending >= self.capacity:
+            self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise HashingCapacityError
+        self.start()
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        submitted_at = time.time()
+        future = self._executor.submit(fn, *args)
+        # The slot is freed when the job ends, not when the caller stops waiting: a cancelled request
+        # (a client that disconnected) leaves its bcrypt run going, and that run still uses a worker.
+        future.add_done_callback(lambda _: self._release_from(loop))
+        result, started_at = await asyncio.wrap_future(future)
+        finished_at = time.time()
+        wait = max(0.0, started_at - submitted_at)
+        self.completed += 1
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.total_run_seconds += finished_at - started_at
+        PASSWORD_HASH_SECONDS.labels(operation, "queue").observe(wait)
+        PASSWORD_HASH_SECONDS.labels(operation, "run").observe(finished_at - started_at)
+        return result
+
+    def _release(self) -> None:
+        self._pending -= 1
+
+    def _release_from(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Called on the executor's thread; the counters belong to the event loop.
+        with contextlib.suppress(RuntimeError):  # the loop is already closed at shutdown
+            loop.call_soon_threadsafe(self._release)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queueCapacity": self.queue_size,
+            "inFlight": self._pending,
+            "queueDepth": max(0, self._pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avgWaitMs": round(self.total_wait_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+            "maxWaitMs": round(self.max_wait_seconds * 1000, 3),
+            "avgRunMs": round(self.total_run_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+        }
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_SIZE)
@@ -0,0 +1,27 @@
+import os
+
+import httpx
+
+
+_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide client so outbound calls reuse keep-alive connections."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=float(os.getenv("HTTP_CLIENT_TIMEOUT", "5")),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "20")),
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,145 @@
+"""Index declarations for auth-service collections.
+
+Run ``python -m app.indexes`` from ``auth-service/`` to create missing indexes and
+``python -m app.indexes --check-plans`` to also report query shapes that would scan a collection.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .db import close_db, get_db
+
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "user": [
+        # login, /verify-token and signup look users up by email.
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+        # GET /pending-users: equality on verified, keyset pagination on _id.
+        IndexModel([("verified", ASCENDING), ("_id", ASCENDING)], name="verified_id"),
+    ],
+    "outbox": [
+        # One event per user and type, so approving twice never queues a second profile.
+        IndexModel([("type", ASCENDING), ("userId", ASCENDING)], name="type_userId", unique=True),
+        # The outbox worker polls for due pending events, oldest first.
+        IndexModel([("status", ASCENDING), ("nextAttemptAt", ASCENDING)], name="status_nextAttemptAt"),
+    ],
+    "password_resets": [
+        IndexModel([("resetToken", ASCENDING)], name="resetToken", unique=True),
+        # Let MongoDB drop reset entries once they expire.
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Representative filters for every query the endpoints issue; values only need the right type.
+QUERY_SHAPES: list[tuple[str, dict, dict | None]] = [
+    ("user", {"email": "test@example.com"}, None),
+    ("user", {"verified": False, "_id": {"$gt": ObjectId()}}, {"_id": 1}),
+    ("outbox", {"status": "pending", "nextAttemptAt": {"$lte": 0.0}}, {"nextAttemptAt": 1}),
+]
+
+
+# Options ensure_indexes() keeps in step with the declarations.
+_OPTIONS = ("expireAfterSeconds", "partialFilterExpression")
+
+
+def _key_of(spec: dict) -> list[tuple[str, int]]:
+    return list(spec["key"].items()) if isinstance(spec["key"], dict) else list(spec["key"])
+
+
+async def _update_index(db: AsyncIOMotorDatabase, collection: str, model: IndexModel, current: dict) -> None:
+    """Bring an index with the declared key up to date with its declared options."""
+    spec = model.document
+    if current.get("partialFilterExpression") != spec.get("partialFilterExpression"):
+        # A filter cannot be changed in place.
+        await db[collection].drop_index(spec["name"])
+        await db[collection].create_indexes([model])
+    elif current.get("expireAfterSeconds") != spec.get("expireAfterSeconds"):
+        await db.command(
+            "collMod", collection, index={"name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]}
+        )
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, indexes: dict[str, list[IndexModel]] = INDEXES) -> dict:
+    """Create missing indexes, update the options of existing ones, and report key or unique conflicts.
+
+    Indexes whose key or uniqueness differs are never dropped; those conflicts have to be resolved
+    by hand. A changed TTL is applied with ``collMod``; a changed partial filter drops and rebuilds.
+    """
+    report: dict[str, list[str]] = {"created": [], "updated": [], "existing": [], "conflicts": []}
+    for collection, models in indexes.items():
+        existing = await db[collection].index_information()
+        for model in models:
+            spec = model.document
+            qualified = f"{collection}.{spec['name']}"
+            current = existing.get(spec["name"])
+            if current is None:
+                try:
+                    await db[collection].create_indexes([model])
+                except OperationFailure as exc:
+                    report["conflicts"].append(f"{qualified}: {exc}")
+                    continue
+                report["created"].append(qualified)
+            elif _key_of(current) != _key_of(spec) or bool(current.get("unique")) != bool(spec.get("unique")):
+                report["conflicts"].append(f"{qualified}: exists with a different definition {current}")
+            elif any(current.get(option) != spec.get(option) for option in _OPTIONS):
+                try:
+                    await _update_index(db, collection, model, current)
+                except OperationFailure as exc:
+                    report["conflicts"].append(f"{qualified}: {exc}")
+                    continue
+                report["updated"].append(qualified)
+            else:
+                report["existing"].append(qualified)
+    return report
+
+
+def _stages(plan: dict) -> list[str]:
+    stages = [plan.get("stage", "")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += _stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+async def find_collection_scans(
+    db: AsyncIOMotorDatabase, shapes: list[tuple[str, dict, dict | None]] = QUERY_SHAPES
+) -> list[str]:
+    """Explain every declared query shape and return the ones whose winning plan is a COLLSCAN."""
+    scans = []
+    for collection, query_filter, sort in shapes:
+        command: dict = {"find": collection, "filter": query_filter}
+        if sort:
+            command["sort"] = sort
+        explained = await db.command("explain", command, verbosity="queryPlanner")
+        if "COLLSCAN" in _stages(explained["queryPlanner"]["winningPlan"]):
+            scans.append(f"{collection} {query_filter}" + (f" sort={sort}" if sort else ""))
+    return scans
+
+
+async def _main(check_plans: bool) -> int:
+    try:
+        db = get_db()
+        report = await ensure_indexes(db)
+        for status, names in report.items():
+            for name in names:
+                print(f"{status}: {name}")
+        scans = await find_collection_scans(db) if check_plans else []
+        for scan in scans:
+            print(f"collection scan: {scan}")
+    finally:
+        close_db()
+    return 1 if report["conflicts"] or scans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and verify auth-service indexes.")
+    parser.add_argument("--check-plans", action="store_true", help="explain known query shapes and flag COLLSCANs")
+    sys.exit(asyncio.run(_main(parser.parse_args().check_plans)))
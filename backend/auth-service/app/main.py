@@ -1,11 +1,18 @@
+import logging
+import os
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from typing import Annotated
 
-from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response
+from pymongo.errors import PyMongoError
 
 from .auth import (
     ADMIN_EMAIL,
     approve_user,
+    approve_users,
     authenticate_user,
     create_access_token,
     create_pending_user,
@@ -14,7 +21,12 @@ from .auth import (
     update_password,
     verify_token,
 )
-from .db import get_db
+from .db import close_db, connect_db, get_db
+from .hashing import HashingCapacityError, password_hasher
+from .http_client import close_http_client
+from .indexes import ensure_indexes
+from .log import RequestIdMiddleware, configure_logging, shutdown_logging
+from .metrics import MetricsMiddleware, render_metrics
 from .models import (
     BEARER,
     ForgotPasswordRequest,
@@ -23,12 +35,46 @@ from .models import (
     PendingUser,
     SignupRequest,
     TokenResponse,
+    UserApprovalBatchRequest,
     UserApprovalRequest,
+    UserApprovalResult,
     UserResponse,
 )
-
-
-app = FastAPI()
+from .outbox import outbox_worker
+from .profiling import ProfilingMiddleware, list_profiles, profile_path
+
+
+ENSURE_INDEXES = os.getenv("MONGODB_ENSURE_INDEXES", "1") == "1"
+PENDING_USERS_PAGE_SIZE = int(os.getenv("PENDING_USERS_PAGE_SIZE", "100"))
+PENDING_USERS_PAGE_SIZE_MAX = int(os.getenv("PENDING_USERS_PAGE_SIZE_MAX", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    configure_logging()
+    connect_db()
+    if ENSURE_INDEXES:
+        try:
+            report = await ensure_indexes(get_db())
+            for updated in report["updated"]:
+                logger.info("Index options updated: %s", updated)
+            for conflict in report["conflicts"]:
+                logger.warning("Index conflict: %s", conflict)
+        except PyMongoError:
+            logger.exception("Failed to ensure indexes")
+    password_hasher.start()
+    outbox_worker.start(get_db())
+    yield
+    await outbox_worker.stop()
+    password_hasher.shutdown()
+    await close_http_client()
+    close_db()
+    shutdown_logging()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS for frontend
 app.add_middleware(
@@ -37,20 +83,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+
+@app.exception_handler(HashingCapacityError)
+async def hashing_capacity_handler(_: Request, __: HashingCapacityError) -> JSONResponse:
+    # Shed load instead of queueing behind a login storm; /verify-token never hashes.
+    return JSONResponse(
+        status_code=503, content={"detail": "Server is busy, please retry"}, headers={"Retry-After": "1"}
+    )
 
 
-def require_admin(authorization: Annotated[str | None, Header()] = None, db=Depends(get_db)) -> UserResponse:
+async def require_admin(authorization: Annotated[str | None, Header()] = None, db=Depends(get_db)) -> UserResponse:
     if not authorization:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
         scheme, token = authorization.split()
         if scheme.lower() != "bearer":
             raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-        user = verify_token(token, db)
+        user = await verify_token(token, db)
         if user.email != ADMIN_EMAIL:
             raise HTTPException(status_code=403, detail="Admin access required")
-        print(f"User {user.email} is an admin")
         return user
     except Exception as exc:
         raise HTTPException(status_code=401, detail="Invalid credentials") from exc
@@ -58,22 +115,21 @@ def require_admin(authorization: Annotated[str | None, Header()] = None, db=Depe
 
 @app.post("/login", response_model=TokenResponse)
 async def login(request: LoginRequest, db=Depends(get_db)) -> dict:
-    print("Logging in user")
-    user = authenticate_user(request.email, request.password, db)
-    print(f"User {user.email} logged in successfully")
-    access_token = create_access_token({"sub": user.email})
+    user = await authenticate_user(request.email, request.password, db)
+    logger.info("User logged in", extra={"userId": user.userId, "sampled": True})
+    access_token = create_access_token({"sub": user.email, "userId": user.userId, "role": user.role})
     return {"access_token": access_token, "token_type": BEARER}
 
 
 @app.get("/verify-token")
-def verify_token_endpoint(token: str, db=Depends(get_db)) -> UserResponse:
-    return verify_token(token, db)
+async def verify_token_endpoint(token: str, db=Depends(get_db)) -> UserResponse:
+    return await verify_token(token, db)
 
 
 @app.post("/forgot-password")
 async def forgot_password(request: ForgotPasswordRequest, db=Depends(get_db)) -> dict:
     try:
-        initiate_password_reset(request.email, db)
+        await initiate_password_reset(request.email, db)
         return {"message": "A password reset link has been sent to your email."}
     except HTTPException as e:
         raise e
@@ -84,9 +140,9 @@ async def forgot_password(request: ForgotPasswordRequest, db=Depends(get_db)) ->
 @app.post("/signup")
 async def signup(request: SignupRequest, db=Depends(get_db)) -> dict:
     try:
-        create_pending_user(request.email, request.password, db)
+        await create_pending_user(request.email, request.password, db)
         return {"message": "Your registration is pending approval. You’ll be notified once approved."}
-    except HTTPException as e:
+    except (HTTPException, HashingCapacityError) as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process request: {e!r}") from e
@@ -94,17 +150,25 @@ async def signup(request: SignupRequest, db=Depends(get_db)) -> dict:
 
 @app.get("/pending-users")
 async def list_pending_users(
-    _: Annotated[UserResponse, Depends(require_admin)], db=Depends(get_db)
+    _: Annotated[UserResponse, Depends(require_admin)],
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=PENDING_USERS_PAGE_SIZE_MAX)] = PENDING_USERS_PAGE_SIZE,
+    cursor: str | None = None,
+    db=Depends(get_db),
 ) -> list[PendingUser]:
-    return get_pending_users(db)
+    """Pending users in signup order; pass the ``X-Next-Cursor`` header back as ``cursor`` for the next page."""
+    users, next_cursor = await get_pending_users(db, limit, cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return users
 
 
 @app.post("/approve-user")
-def approve_user_endpoint(
+async def approve_user_endpoint(
     request: UserApprovalRequest, _: Annotated[UserResponse, Depends(require_admin)], db=Depends(get_db)
 ) -> dict:
     try:
-        approve_user(request.userId, request.approve, db)
+        await approve_user(request.userId, request.approve, db)
         action = "approved" if request.approve else "rejected"
         return {"message": f"User {action} successfully."}
     except HTTPException as e:
@@ -113,6 +177,13 @@ def approve_user_endpoint(
         raise HTTPException(status_code=500, detail=f"Failed to process request: {e!r}") from e
 
 
+@app.post("/approve-users")
+async def approve_users_endpoint(
+    request: UserApprovalBatchRequest, _: Annotated[UserResponse, Depends(require_admin)], db=Depends(get_db)
+) -> list[UserApprovalResult]:
+    return await approve_users(request.users, db)
+
+
 @app.put("/user/password")
 async def update_user_password(
     password_data: PasswordUpdateRequest, authorization: Annotated[str | None, Header()] = None, db=Depends(get_db)
@@ -123,15 +194,42 @@ async def update_user_password(
         scheme, token = authorization.split()
         if scheme.lower() != "bearer":
             raise HTTPException(status_code=401, detail="Invalid authentication scheme")
-        user = verify_token(token, db)
+        user = await verify_token(token, db)
         if not password_data.password:
             raise HTTPException(status_code=403, detail="Cannot update password for another user")
-        update_password(password_data, user, db)
+        await update_password(password_data, user, db)
         return {"message": "Password updated successfully"}
+    except HashingCapacityError:
+        raise
     except Exception as exc:
         raise HTTPException(status_code=400, detail=f"Failed to update password: {str(exc)}") from exc
 
 
+@app.get("/metrics/password-hashing")
+def password_hashing_stats() -> dict:
+    return password_hasher.stats()
+
+
+@app.get("/admin/profiles")
+async def list_profiles_endpoint(_: Annotated[UserResponse, Depends(require_admin)]) -> list[dict]:
+    """Stored request profiles, newest first; request one with ``X-Profile: 1`` as an admin."""
+    return list_profiles()
+
+
+@app.get("/admin/profiles/{name}")
+async def download_profile(name: str, _: Annotated[UserResponse, Depends(require_admin)]) -> FileResponse:
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    content, media_type = render_metrics()
+    return Response(content, media_type=media_type)
+
+
 @app.get("/health")
 def health_check() -> dict:
     return {"status": "Auth service is up"}
@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Literal
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 
 
 BEARER = "bearer"
@@ -40,7 +41,6 @@ class SignupRequest(BaseModel):
 class PendingUser(BaseModel):
     userId: str
     email: str
-    hashedPassword: str
     createdAt: datetime
 
 
@@ -49,6 +49,15 @@ class UserApprovalRequest(BaseModel):
     approve: bool
 
 
+class UserApprovalBatchRequest(BaseModel):
+    users: list[UserApprovalRequest] = Field(..., min_length=1, max_length=1000)
+
+
+class UserApprovalResult(BaseModel):
+    userId: str
+    status: Literal["approved", "rejected", "not_found", "invalid"]
+
+
 class PasswordUpdateRequest(BaseModel):
     password: str
 
@@ -0,0 +1,183 @@
+"""Outbox for the expense-service profiles of approved users.
+
+Approving a user also writes a ``user.approved`` event to the ``outbox`` collection (in the same
+transaction where MongoDB supports one), so approval never waits on expense-service. The
+``OutboxWorker`` delivers pending events in batches to ``POST /user/profiles``, retrying failed
+deliveries with exponential backoff and parking an event as ``failed`` after
+``OUTBOX_MAX_ATTEMPTS``. Events are unique per user and the endpoint treats existing profiles as
+success, so a redelivery never creates a second profile.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import time
+
+import httpx
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from .http_client import get_http_client
+from .metrics import OUTBOX_DELIVERIES
+
+
+OUTBOX_COLLECTION = "outbox"
+USER_APPROVED = "user.approved"
+USER_PROFILES_URL = os.getenv("USER_PROFILES_URL", "http://127.0.0.1:8001/user/profiles")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "2"))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "600"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+
+logger = logging.getLogger(__name__)
+
+
+def user_approved_events(user_ids: list[str]) -> list[UpdateOne]:
+    """Upserts that queue one event per user; approving a user twice does not queue a second one."""
+    now = time.time()
+    return [
+        UpdateOne(
+            {"type": USER_APPROVED, "userId": user_id},
+            {
+                "$setOnInsert": {
+                    "status": "pending",
+                    "attempts": 0,
+                    "createdAt": now,
+                    "nextAttemptAt": now,
+                }
+            },
+            upsert=True,
+        )
+        for user_id in user_ids
+    ]
+
+
+def _backoff(attempts: int) -> float:
+    # Full jitter, so events that failed together do not retry together.
+    return random.uniform(0, min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2**attempts))
+
+
+async def _claim(db: AsyncIOMotorDatabase) -> list[dict]:
+    """Lease up to a batch of due events; a worker that dies lets the lease run out for another one."""
+    now = time.time()
+    due = {"status": "pending", "nextAttemptAt": {"$lte": now}}
+    candidates = (
+        await db[OUTBOX_COLLECTION]
+        .find(due, {"_id": 1})
+        .sort("nextAttemptAt", 1)
+        .limit(OUTBOX_BATCH_SIZE)
+        .to_list(None)
+    )
+    if not candidates:
+        return []
+    lease = ObjectId()
+    await db[OUTBOX_COLLECTION].update_many(
+        {**due, "_id": {"$in": [event["_id"] for event in candidates]}},
+        {"$set": {"lease": lease, "nextAttemptAt": now + OUTBOX_LEASE_SECONDS}},
+    )
+    return await db[OUTBOX_COLLECTION].find({"lease": lease}).to_list(None)
+
+
+async def _post_profiles(user_ids: list[str]) -> tuple[set[str], str | None]:
+    """The users that have a profile after one batch call, and the error if the call failed."""
+    if not user_ids:
+        return set(), None
+    try:
+        response = await get_http_client().post(
+            USER_PROFILES_URL, json={"profiles": [{"userId": user_id} for user_id in user_ids]}
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as exc:
+        return set(), repr(exc)
+    try:
+        body = response.json()
+        return set(body.get("created", [])) | set(body.get("existing", [])), None
+    except (ValueError, AttributeError, TypeError) as exc:
+        # A 200 that is not the expected JSON (a proxy page, a version mismatch) is a failed delivery.
+        return set(), f"unexpected response body: {exc!r}"
+
+
+async def deliver_batch(db: AsyncIOMotorDatabase) -> int:
+    """Deliver one batch of due events; returns how many were claimed."""
+    events = await _claim(db)
+    if not events:
+        return 0
+    users = {
+        str(user["_id"]): user.get("verified", False)
+        async for user in db.user.find(
+            {"_id": {"$in": [ObjectId(event["userId"]) for event in events]}}, {"verified": 1}
+        )
+    }
+    # Without transactions the event is written just before the approval: a user who is still
+    # pending is retried later, a user who no longer exists is dropped.
+    verified = [event["userId"] for event in events if users.get(event["userId"])]
+    delivered, error = await _post_profiles(verified)
+    done = [event["_id"] for event in events if event["userId"] in delivered or event["userId"] not in users]
+    if done:
+        await db[OUTBOX_COLLECTION].delete_many({"_id": {"$in": done}})
+    retries = []
+    for event in events:
+        if event["_id"] in done:
+            continue
+        attempts = event["attempts"] + 1
+        reason = error or ("not created by expense-service" if users[event["userId"]] else "user not approved yet")
+        update = {"attempts": attempts, "lastError": reason}
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update["status"] = "failed"
+            logger.error("Giving up on outbox event", extra={"userId": event["userId"], "attempts": attempts})
+        else:
+            update["nextAttemptAt"] = time.time() + _backoff(attempts)
+        retries.append(UpdateOne({"_id": event["_id"], "lease": event["lease"]}, {"$set": update}))
+    if retries:
+        await db[OUTBOX_COLLECTION].bulk_write(retries, ordered=False)
+        logger.warning("Outbox delivery failed", extra={"count": len(retries), "error": error})
+    OUTBOX_DELIVERIES.labels("delivered").inc(len(done))
+    OUTBOX_DELIVERIES.labels("retried").inc(len(retries))
+    return len(events)
+
+
+class OutboxWorker:
+    """Background task that drains the outbox, woken early by ``notify()`` after an approval."""
+
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+
+    def start(self, db: AsyncIOMotorDatabase) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(db))
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self, db: AsyncIOMotorDatabase) -> None:
+        failures = 0
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await deliver_batch(db)
+            except Exception:
+                # Anything unexpected must not end the worker: approvals would queue events nobody delivers.
+                failures += 1
+                logger.exception("Outbox delivery failed", extra={"failures": failures})
+                await asyncio.sleep(max(OUTBOX_POLL_SECONDS, _backoff(failures)))
+                continue
+            failures = 0
+            if claimed < OUTBOX_BATCH_SIZE:
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_SECONDS)
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,140 @@
+"""Opt-in profiles of single requests.
+
+A request is profiled when an admin sends ``X-Profile: 1`` (the bearer token must carry the
+``admin`` role) or when it is picked by ``PROFILE_SAMPLE_RATE``. The profile covers the whole
+request, including authentication and MongoDB round-trips, and is written to ``PROFILE_DIR``;
+only the newest ``PROFILE_MAX_FILES`` are kept. The response names the file in ``X-Profile-Id``.
+
+cProfile is used unless ``PROFILE_ENGINE=pyinstrument`` and pyinstrument is installed;
+pyinstrument attributes time across ``await`` correctly and writes an HTML report. Only one
+request is profiled at a time, and cProfile also sees other requests interleaved on the loop.
+"""
+
+import asyncio
+import cProfile
+import os
+import random
+import re
+import tempfile
+import time
+from pathlib import Path
+
+from jose import JWTError, jwt
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .auth import ALGORITHM, SECRET_KEY
+
+
+try:
+    from pyinstrument import Profiler as Pyinstrument
+except ImportError:  # optional dependency
+    Pyinstrument = None
+
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "auth-service-profiles")))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ENGINE = os.getenv("PROFILE_ENGINE", "cprofile")
+# Only names _profile_name() produces, so a shared PROFILE_DIR never loses other files.
+PROFILE_NAME = re.compile(r"^\d{8}T\d{6}-\d{3}-[A-Z]+-[\w-]+\.(prof|html)$")
+
+_active = False
+
+
+def _requested_by_admin(scope: Scope) -> bool:
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") != b"1":
+        return False
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return payload.get("role") == "admin"
+
+
+def _profile_name(scope: Scope, extension: str) -> str:
+    path = re.sub(r"[^\w-]+", "_", scope["path"]).strip("_") or "root"
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{scope['method']}-{path}.{extension}"
+
+
+def _profiles() -> list[Path]:
+    """The profiles in PROFILE_DIR, newest first."""
+    profiles = [path for path in PROFILE_DIR.iterdir() if PROFILE_NAME.match(path.name) and path.is_file()]
+    return sorted(profiles, key=lambda path: path.stat().st_mtime, reverse=True)
+
+
+def _prune() -> None:
+    for stale in _profiles()[PROFILE_MAX_FILES:]:
+        stale.unlink(missing_ok=True)
+
+
+def _save_cprofile(profiler: cProfile.Profile, name: str) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(PROFILE_DIR / name)
+    _prune()
+
+
+def _save_html(html: str, name: str) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    (PROFILE_DIR / name).write_text(html, encoding="utf-8")
+    _prune()
+
+
+def list_profiles() -> list[dict]:
+    if not PROFILE_DIR.is_dir():
+        return []
+    return [
+        {"name": path.name, "size": path.stat().st_size, "createdAt": int(path.stat().st_mtime * 1000)}
+        for path in _profiles()
+    ]
+
+
+def profile_path(name: str) -> Path | None:
+    path = PROFILE_DIR / name
+    return path if PROFILE_NAME.match(name) and path.is_file() else None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        global _active
+        if (
+            scope["type"] != "http"
+            or _active
+            or not (_requested_by_admin(scope) or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE))
+        ):
+            await self.app(scope, receive, send)
+            return
+        use_pyinstrument = PROFILE_ENGINE == "pyinstrument" and Pyinstrument is not None
+        name = _profile_name(scope, "html" if use_pyinstrument else "prof")
+
+        async def send_with_name(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", []).append((b"x-profile-id", name.encode("latin-1")))
+            await send(message)
+
+        _active = True
+        try:
+            if use_pyinstrument:
+                profiler = Pyinstrument(async_mode="enabled")
+                profiler.start()
+                try:
+                    await self.app(scope, receive, send_with_name)
+                finally:
+                    profiler.stop()
+                    await asyncio.to_thread(_save_html, profiler.output_html(), name)
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await self.app(scope, receive, send_with_name)
+                finally:
+                    profiler.disable()
+                    await asyncio.to_thread(_save_cprofile, profiler, name)
+        finally:
+            _active = False
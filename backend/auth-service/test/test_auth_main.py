@@ -1,16 +1,55 @@
+import asyncio
+import contextlib
 import sys
+import threading
+import time
+from collections.abc import AsyncIterator, Generator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from bson import ObjectId
 from fastapi.testclient import TestClient
+from pymongo import UpdateOne
 
 
 # Add backend/auth-service/ to sys.path (parent of app/)
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from app.auth import create_access_token
+from app.auth import ADMIN_EMAIL, create_access_token, invalidate_user_tokens, verified_tokens
+from app.db import get_db
+from app.hashing import HashingCapacityError, PasswordHasher, password_hasher
 from app.main import app
 from app.models import BEARER
+from app.outbox import OUTBOX_COLLECTION, OutboxWorker, _post_profiles, deliver_batch, user_approved_events
+
+
+class AsyncCursor:
+    """In-memory stand-in for a Motor cursor."""
+
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = list(docs)
+
+    def sort(self, *_: Any) -> "AsyncCursor":
+        return self
+
+    def limit(self, length: int) -> "AsyncCursor":
+        self.docs = self.docs[:length]
+        return self
+
+    async def to_list(self, _: int | None) -> list[dict]:
+        return self.docs
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        for doc in self.docs:
+            yield doc
+
+
+@pytest.fixture
+def admin_headers(mock_database: MagicMock) -> dict[str, str]:
+    mock_database.user.find_one = AsyncMock(return_value={"_id": ObjectId(), "email": ADMIN_EMAIL})
+    return {"Authorization": f"Bearer {create_access_token({'sub': ADMIN_EMAIL})}"}
 
 
 @pytest.fixture
@@ -23,6 +62,19 @@ def mock_database() -> MagicMock:
     return MagicMock()
 
 
+# pylint: disable=redefined-outer-name
+@pytest.fixture(autouse=True, scope="function")
+def mock_db(mock_database: MagicMock) -> Generator[MagicMock, None, None]:
+    # Override get_db for all tests automatically
+    def _mock_get_db() -> MagicMock:
+        return mock_database
+
+    app.dependency_overrides[get_db] = _mock_get_db
+    yield mock_database
+    app.dependency_overrides.clear()
+    verified_tokens.clear()
+
+
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
 async def test_login_success(test_client: TestClient, mock_database: MagicMock) -> None:
@@ -31,34 +83,87 @@ async def test_login_success(test_client: TestClient, mock_database: MagicMock)
         "email": "test@example.com",
         "hashedPassword": "$2b$12$gMLXIaKlt2EzJfLnDDY6au4ttQ8nsRTzAd0qFKQ.G908neRVQns7y",  # Hash for "123456"
         "_id": "12345",
+        "verified": True,
     }
-    mock_database.user.find_one.return_value = mock_user
+    mock_database.user.find_one = AsyncMock(return_value=mock_user)
 
-    # Patch get_db to return mock_db
-    with patch("app.main.get_db", return_value=mock_database):
-        response = test_client.post("/login", json={"email": "test@example.com", "password": "123456"})
-        if response.status_code != 200:
-            raise AssertionError(f"Expected status code 200, but got {response.status_code}")
-        data = response.json()
-        if "access_token" not in data:
-            raise AssertionError("Expected 'access_token' in response data")
-        # Validate the token type in the response
-        if data["token_type"] != BEARER:
-            raise AssertionError("Expected 'token_type' to be 'bearer'")
+    response = test_client.post("/login", json={"email": "test@example.com", "password": "123456"})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    data = response.json()
+    if "access_token" not in data:
+        raise AssertionError("Expected 'access_token' in response data")
+    # Validate the token type in the response
+    if data["token_type"] != BEARER:
+        raise AssertionError("Expected 'token_type' to be 'bearer'")
 
 
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
 async def test_login_invalid_credentials(test_client: TestClient, mock_database: MagicMock) -> None:
     # Mock DB response with no user
-    mock_database.user.find_one.return_value = None
+    mock_database.user.find_one = AsyncMock(return_value=None)
 
-    with patch("app.main.get_db", return_value=mock_database):
-        response = test_client.post("/login", json={"email": "test@example.com", "password": "wrongpass"})
-        if response.status_code != 401:
-            raise AssertionError(f"Expected status code 401, but got {response.status_code}")
-        if response.json()["detail"] != "Invalid credentials":
-            raise AssertionError("Expected 'detail' to be 'Invalid credentials'")
+    response = test_client.post("/login", json={"email": "test@example.com", "password": "wrongpass"})
+    if response.status_code != 401:
+        raise AssertionError(f"Expected status code 401, but got {response.status_code}")
+    if response.json()["detail"] != "Invalid credentials":
+        raise AssertionError("Expected 'detail' to be 'Invalid credentials'")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_login_sheds_load_when_hashing_queue_is_full(
+    test_client: TestClient, mock_database: MagicMock, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    mock_database.user.find_one = AsyncMock(
+        return_value={"email": "test@example.com", "hashedPassword": "$2b$12$abc", "_id": "12345", "verified": True}
+    )
+    monkeypatch.setattr(password_hasher, "_pending", password_hasher.capacity)
+    rejected_before = password_hasher.stats()["rejected"]
+
+    response = test_client.post("/login", json={"email": "test@example.com", "password": "123456"})
+    if response.status_code != 503:
+        raise AssertionError(f"Expected status code 503, but got {response.status_code}")
+    if response.headers.get("Retry-After") != "1":
+        raise AssertionError("Expected a Retry-After header")
+    stats = test_client.get("/metrics/password-hashing").json()
+    if stats["rejected"] != rejected_before + 1:
+        raise AssertionError(f"Expected one more rejection, but got {stats['rejected']}")
+    if stats["queueDepth"] != password_hasher.queue_size:
+        raise AssertionError(f"Expected a full queue, but got depth {stats['queueDepth']}")
+
+
+def _blocked_hash(release: threading.Event) -> tuple[bool, float]:
+    release.wait(5)
+    return True, time.time()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_hashing_keeps_its_slot_until_the_job_finishes() -> None:
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    hasher._executor = ThreadPoolExecutor(max_workers=1)  # noqa: SLF001 - no bcrypt processes in tests
+    release = threading.Event()
+    try:
+        request = asyncio.create_task(hasher._submit("verify", _blocked_hash, release))  # noqa: SLF001
+        await asyncio.sleep(0.05)
+        request.cancel()  # the client went away, but the job keeps running
+        with contextlib.suppress(asyncio.CancelledError):
+            await request
+        if hasher.stats()["inFlight"] != 1:
+            raise AssertionError(f"Expected the running job to hold its slot, got {hasher.stats()}")
+        with pytest.raises(HashingCapacityError):
+            await hasher.verify("password", "hash")
+        release.set()
+        for _ in range(100):
+            if hasher.stats()["inFlight"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        if hasher.stats()["inFlight"] != 0:
+            raise AssertionError("Expected the slot back once the job finished")
+    finally:
+        release.set()
+        hasher.shutdown()
 
 
 # pylint: disable=redefined-outer-name
@@ -67,29 +172,88 @@ async def test_verify_token_success(test_client: TestClient, mock_database: Magi
     # Create a valid token
     token = create_access_token({"sub": "test@example.com"})
     mock_user = {"email": "test@example.com", "_id": "67d2478e5592b0e4146b140c"}
-    mock_database.user.find_one.return_value = mock_user
+    mock_database.user.find_one = AsyncMock(return_value=mock_user)
 
-    with patch("app.main.get_db", return_value=mock_database):
+    response = test_client.get("/verify-token", params={"token": token})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    data = response.json()
+    print(data)
+    if data["email"] != "test@example.com":
+        raise AssertionError("Expected 'email' to be 'test@example.com'")
+    if data["userId"] != "67d2478e5592b0e4146b140c":
+        raise AssertionError("Expected 'userId' to be '67d2478e5592b0e4146b140c'")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_verify_token_is_cached_until_invalidated(test_client: TestClient, mock_database: MagicMock) -> None:
+    token = create_access_token({"sub": "test@example.com"})
+    mock_database.user.find_one = AsyncMock(return_value={"_id": "67d2478e5592b0e4146b140c"})
+
+    for _ in range(3):
         response = test_client.get("/verify-token", params={"token": token})
         if response.status_code != 200:
             raise AssertionError(f"Expected status code 200, but got {response.status_code}")
-        data = response.json()
-        print(data)
-        if data["email"] != "test@example.com":
-            raise AssertionError("Expected 'email' to be 'test@example.com'")
-        if data["userId"] != "67d2478e5592b0e4146b140c":
-            raise AssertionError("Expected 'userId' to be '67d2478e5592b0e4146b140c'")
+    if mock_database.user.find_one.await_count != 1:
+        raise AssertionError(f"Expected one lookup, got {mock_database.user.find_one.await_count}")
+    if (verified_tokens.hits, verified_tokens.misses) != (2, 1):
+        raise AssertionError(f"Unexpected cache counters: {verified_tokens.hits} hits, {verified_tokens.misses} misses")
+
+    invalidate_user_tokens("67d2478e5592b0e4146b140c")
+    mock_database.user.find_one = AsyncMock(return_value={"_id": "67d2478e5592b0e4146b140c", "deletedAt": 1742000000})
+    response = test_client.get("/verify-token", params={"token": token})
+    if response.status_code != 401:
+        raise AssertionError(f"Expected a deleted user to be rejected after invalidation, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_verify_token_does_not_cache_a_result_invalidated_during_the_lookup(
+    test_client: TestClient, mock_database: MagicMock
+) -> None:
+    token = create_access_token({"sub": "race@example.com"})
+    user_id = str(ObjectId())
+
+    async def lookup_racing_a_password_change(*_: Any, **__: Any) -> dict:
+        invalidate_user_tokens(user_id)
+        return {"_id": user_id}
+
+    mock_database.user.find_one = AsyncMock(side_effect=lookup_racing_a_password_change)
+    for _ in range(2):
+        if test_client.get("/verify-token", params={"token": token}).status_code != 200:
+            raise AssertionError("Expected the token to verify")
+    if mock_database.user.find_one.await_count != 2:
+        raise AssertionError("A result invalidated while it was looked up must not be cached")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_invalidation_overflow_drops_entries_but_keeps_cache_counters(
+    test_client: TestClient, mock_database: MagicMock
+) -> None:
+    token = create_access_token({"sub": "test@example.com"})
+    mock_database.user.find_one = AsyncMock(return_value={"_id": "67d2478e5592b0e4146b140c"})
+    for _ in range(2):
+        test_client.get("/verify-token", params={"token": token})
+
+    with patch("app.auth.VERIFY_TOKEN_CACHE_SIZE", 2), patch.dict("app.auth._invalidated_at", clear=True):
+        for _ in range(3):
+            invalidate_user_tokens(str(ObjectId()))
+    if len(verified_tokens) != 0:
+        raise AssertionError("Expected too many invalidations to drop every cached verification")
+    if (verified_tokens.hits, verified_tokens.misses) != (1, 1):
+        raise AssertionError(f"Exported counters must not reset: {verified_tokens.hits}, {verified_tokens.misses}")
 
 
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
 async def test_verify_token_invalid(test_client: TestClient, mock_database: MagicMock) -> None:
-    with patch("app.main.get_db", return_value=mock_database):
-        response = test_client.get("/verify-token", params={"token": "invalid-token"})
-        if response.status_code != 401:
-            raise AssertionError(f"Expected status code 401, but got {response.status_code}")
-        if response.json()["detail"] != "Could not validate token":
-            raise AssertionError("Expected 'detail' to be 'Could not validate token'")
+    response = test_client.get("/verify-token", params={"token": "invalid-token"})
+    if response.status_code != 401:
+        raise AssertionError(f"Expected status code 401, but got {response.status_code}")
+    if response.json()["detail"] != "Could not validate token":
+        raise AssertionError("Expected 'detail' to be 'Could not validate token'")
 
 
 # pylint: disable=redefined-outer-name
@@ -100,3 +264,154 @@ async def test_health_check(test_client: TestClient) -> None:
         raise AssertionError(f"Expected status code 200, but got {response.status_code}")
     if response.json()["status"] != "Auth service is up":
         raise AssertionError("Expected 'status' to be 'Auth service is up'")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_pending_users_are_paginated_without_password_hashes(
+    test_client: TestClient, mock_database: MagicMock, admin_headers: dict[str, str]
+) -> None:
+    users = [{"_id": ObjectId(), "email": f"user{i}@example.com", "createdAt": 1742000000000} for i in range(3)]
+    mock_database.user.find = MagicMock(return_value=AsyncCursor(users))
+
+    response = test_client.get("/pending-users", headers=admin_headers, params={"limit": 2})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    if [user["email"] for user in response.json()] != ["user0@example.com", "user1@example.com"]:
+        raise AssertionError(f"Unexpected page: {response.json()}")
+    if response.headers.get("X-Next-Cursor") != str(users[1]["_id"]):
+        raise AssertionError(f"Expected the next cursor, got {response.headers}")
+    query, projection = mock_database.user.find.call_args.args
+    if query != {"verified": False} or "hashedPassword" in projection or "hashedPassword" in response.text:
+        raise AssertionError(f"Password hashes must not be read or returned: {projection}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_approve_users_in_one_batch_and_queue_profiles(
+    test_client: TestClient, mock_database: MagicMock, admin_headers: dict[str, str]
+) -> None:
+    approved, rejected, missing = (str(ObjectId()) for _ in range(3))
+    mock_database.user.find = MagicMock(
+        return_value=AsyncCursor([{"_id": ObjectId(approved)}, {"_id": ObjectId(rejected)}])
+    )
+    mock_database.user.bulk_write = AsyncMock()
+    outbox = mock_database[OUTBOX_COLLECTION]
+    outbox.bulk_write = AsyncMock()
+    with (
+        patch("app.auth.APPROVAL_TRANSACTIONS", False),
+        patch("app.outbox.time.time", return_value=1742000000.0),
+        patch("app.outbox.get_http_client") as mock_http_client,
+    ):
+        expected_events = user_approved_events([approved])
+        response = test_client.post(
+            "/approve-users",
+            headers=admin_headers,
+            json={
+                "users": [
+                    {"userId": approved, "approve": True},
+                    {"userId": rejected, "approve": False},
+                    {"userId": missing, "approve": True},
+                    {"userId": "not-an-id", "approve": True},
+                ]
+            },
+        )
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    statuses = [result["status"] for result in response.json()]
+    if statuses != ["approved", "rejected", "not_found", "invalid"]:
+        raise AssertionError(f"Unexpected results: {statuses}")
+    if len(mock_database.user.bulk_write.call_args.args[0]) != 2:
+        raise AssertionError("Expected one bulk_write with an operation per pending user")
+    if outbox.bulk_write.call_args.args[0] != expected_events:
+        raise AssertionError(f"Expected one outbox event for the approved user: {outbox.bulk_write.call_args}")
+    if mock_http_client.called:
+        raise AssertionError("Approval must not call expense-service")
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_failed_deliveries_and_deletes_delivered_ones() -> None:
+    delivered, unreachable, pending = (ObjectId() for _ in range(3))
+    lease = ObjectId()
+    events = [
+        {"_id": ObjectId(), "userId": str(user_id), "attempts": 0, "lease": lease}
+        for user_id in (delivered, unreachable, pending)
+    ]
+    db = MagicMock()
+    outbox = db[OUTBOX_COLLECTION]
+    outbox.find = MagicMock(side_effect=[AsyncCursor(events), AsyncCursor(events)])
+    outbox.update_many = AsyncMock()
+    outbox.delete_many = AsyncMock()
+    outbox.bulk_write = AsyncMock()
+    db.user.find = MagicMock(
+        return_value=AsyncCursor(
+            [
+                {"_id": delivered, "verified": True},
+                {"_id": unreachable, "verified": True},
+                {"_id": pending, "verified": False},
+            ]
+        )
+    )
+    with (
+        patch("app.outbox.time.time", return_value=1742000000.0),
+        patch("app.outbox._backoff", return_value=10.0),
+        patch("app.outbox.get_http_client") as mock_http_client,
+    ):
+        profiles_response = MagicMock(status_code=200)
+        profiles_response.json.return_value = {"created": [str(delivered)], "existing": []}
+        mock_http_client.return_value.post = AsyncMock(return_value=profiles_response)
+        claimed = await deliver_batch(db)
+
+    if claimed != 3:
+        raise AssertionError(f"Expected 3 claimed events, got {claimed}")
+    sent = mock_http_client.return_value.post.call_args.kwargs["json"]["profiles"]
+    if sent != [{"userId": str(delivered)}, {"userId": str(unreachable)}]:
+        raise AssertionError(f"Only approved users should get a profile: {sent}")
+    if outbox.delete_many.call_args.args[0] != {"_id": {"$in": [events[0]["_id"]]}}:
+        raise AssertionError(f"Expected the delivered event to be deleted: {outbox.delete_many.call_args}")
+    retried = [
+        UpdateOne(
+            {"_id": event["_id"], "lease": lease},
+            {"$set": {"attempts": 1, "lastError": reason, "nextAttemptAt": 1742000010.0}},
+        )
+        for event, reason in zip(events[1:], ["not created by expense-service", "user not approved yet"], strict=True)
+    ]
+    if outbox.bulk_write.call_args.args[0] != retried:
+        raise AssertionError(f"Expected the other events to be rescheduled: {outbox.bulk_write.call_args}")
+
+
+@pytest.mark.asyncio
+async def test_outbox_treats_a_malformed_response_as_a_failed_delivery() -> None:
+    with patch("app.outbox.get_http_client") as mock_http_client:
+        profiles_response = MagicMock(status_code=200)
+        profiles_response.json.side_effect = ValueError("Expecting value")
+        mock_http_client.return_value.post = AsyncMock(return_value=profiles_response)
+        delivered, error = await _post_profiles([str(ObjectId())])
+    if delivered or not error or "unexpected response body" not in error:
+        raise AssertionError(f"Expected a failed delivery, got {delivered} {error}")
+
+
+@pytest.mark.asyncio
+async def test_outbox_worker_survives_unexpected_errors() -> None:
+    worker = OutboxWorker()
+    calls = 0
+
+    async def flaky_batch(_: object) -> int:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            raise RuntimeError("boom")
+        await asyncio.sleep(3600)
+        return 0
+
+    with (
+        patch("app.outbox.deliver_batch", side_effect=flaky_batch),
+        patch("app.outbox.OUTBOX_POLL_SECONDS", 0),
+        patch("app.outbox._backoff", return_value=0),
+    ):
+        worker.start(MagicMock())
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await worker.stop()
+    if calls != 2:
+        raise AssertionError(f"Expected the worker to keep running after an error, got {calls} batches")
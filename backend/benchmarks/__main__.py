@@ -0,0 +1,191 @@
+"""Latency and throughput benchmarks for auth-service and expense-service.
+
+Both apps run in this process behind ``httpx.ASGITransport`` against a local mongod (``--mongodb-uri``)
+or, with ``--in-memory``, against mongomock-motor. Run from ``backend/``::
+
+    python -m benchmarks --expenses 100000 --requests 500 --concurrency 20
+    python -m benchmarks --update-baseline      # record the current numbers
+
+The run exits 1 when a scenario's p95 or throughput is worse than ``baseline.json`` by more than
+``--tolerance``. Baselines are kept per ``--expenses`` size and per backend (mongod or in-memory).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import bcrypt
+import httpx
+
+
+try:
+    from mongomock_motor import AsyncMongoMockClient
+except ImportError:  # optional, only for --in-memory
+    AsyncMongoMockClient = None
+
+from .harness import Result, Service, find_regressions, load_service, run_scenario
+
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+SCENARIOS = ["login", "verify_token", "list_expenses", "summary", "bulk_insert"]
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark"  # noqa: S105 - seeded benchmark account
+CATEGORIES = ["Food", "Rent", "Transport", "Utilities", "Health", "Fun", "Travel", "Gifts", "Pets", "Salary"]
+SEED_CHUNK = 10_000
+BULK_ROWS = 100
+
+
+def _expense(user_id: object, rng: random.Random) -> dict:
+    income = rng.random() < 0.1
+    date = datetime(rng.randint(2023, 2025), rng.randint(1, 12), rng.randint(1, 28))
+    return {
+        "userId": user_id,
+        "groupId": None,
+        "amount": round(rng.uniform(1000, 5000) if income else rng.uniform(1, 200), 2),
+        "category": "Salary" if income else rng.choice(CATEGORIES[:-1]),
+        "date": date.strftime("%Y-%m-%d"),
+        "dateAt": date,
+        "description": "benchmark",
+        "type": "income" if income else "expense",
+        "currency": rng.choice(["USD", "USD", "USD", "EUR"]),
+        "epoch": int(time.time()),
+    }
+
+
+async def seed(db: object, expense: Service, expenses: int) -> None:
+    """Replace the benchmark user and give them ``expenses`` expenses and the matching rollups."""
+    rollup = expense.modules["rollup"]
+    previous = await db.user.find_one({"email": EMAIL})
+    if previous:
+        for collection in ("expense", rollup.ROLLUP_COLLECTION, "category"):
+            await db[collection].delete_many({"userId": previous["_id"]})
+        await db.user.delete_one({"_id": previous["_id"]})
+    hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    user = await db.user.insert_one({"email": EMAIL, "hashedPassword": hashed, "verified": True, "deletedAt": None})
+    rng = random.Random(42)
+    # Summed here and inserted once rather than with apply_rollup or rebuild_rollups: mongomock
+    # supports neither the UpdateOne bulk_write nor $merge, and both modes should seed the same rollups.
+    buckets: dict[tuple, dict] = {}
+    for start in range(0, expenses, SEED_CHUNK):
+        docs = [_expense(user.inserted_id, rng) for _ in range(min(SEED_CHUNK, expenses - start))]
+        await db.expense.insert_many(docs, ordered=False)
+        for doc in docs:
+            key = rollup.rollup_key(doc)
+            bucket = buckets.setdefault(tuple(key.values()), {**key, "total": 0.0, "count": 0})
+            bucket["total"] += doc["amount"]
+            bucket["count"] += 1
+    if buckets:
+        await db[rollup.ROLLUP_COLLECTION].insert_many(list(buckets.values()), ordered=False)
+    print(f"Seeded {expenses} expenses and {len(buckets)} rollups for {EMAIL}")
+
+
+async def run(args: argparse.Namespace) -> list[Result]:
+    # The services read their configuration at import time.
+    if args.mongodb_uri:
+        os.environ["MONGODB_URI"] = args.mongodb_uri
+    os.environ.setdefault("MONGODB_DB", "expense_tracker_bench")
+    if args.in_memory:
+        os.environ["MONGODB_ENSURE_INDEXES"] = "0"
+    expense = load_service("expense-service")
+    auth = load_service("auth-service", keep_importable=True)
+
+    if args.in_memory:
+        if AsyncMongoMockClient is None:
+            sys.exit("--in-memory needs mongomock-motor: pip install mongomock-motor")
+        db = AsyncMongoMockClient()[os.environ["MONGODB_DB"]]
+        for service in (expense, auth):
+            service.app.dependency_overrides[service.modules["db"].get_db] = lambda: db
+            service.modules["main"].get_db = lambda: db
+    else:
+        db = expense.modules["db"].get_db()
+
+    auth_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=auth.app), base_url="http://auth-service")
+    expense_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=expense.app), base_url="http://expense")
+    # expense-service checks unknown users with auth-service; route those calls in-process too.
+    in_process_auth = httpx.AsyncClient(transport=httpx.ASGITransport(app=auth.app))
+    expense.modules["http_client"]._client = in_process_auth  # noqa: SLF001
+
+    async with contextlib.AsyncExitStack() as stack:
+        await stack.enter_async_context(auth.app.router.lifespan_context(auth.app))
+        await stack.enter_async_context(expense.app.router.lifespan_context(expense.app))
+        stack.push_async_callback(auth_client.aclose)
+        stack.push_async_callback(expense_client.aclose)
+        await seed(db, expense, args.expenses)
+
+        login = await auth_client.post("/login", json={"email": EMAIL, "password": PASSWORD})
+        token = login.raise_for_status().json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        rng = random.Random(7)
+        sends = {
+            "login": lambda _: auth_client.post("/login", json={"email": EMAIL, "password": PASSWORD}),
+            "verify_token": lambda _: auth_client.get("/verify-token", params={"token": token}),
+            "list_expenses": lambda _: expense_client.get("/expense", headers=headers, params={"limit": 500}),
+            "summary": lambda _: expense_client.get("/expense/summary", headers=headers),
+            "bulk_insert": lambda _: expense_client.post(
+                "/expense/bulk",
+                headers=headers,
+                json={
+                    "items": [{k: v for k, v in _expense(None, rng).items() if k != "userId"} for _ in range(BULK_ROWS)]
+                },
+            ),
+        }
+        results = []
+        for scenario in args.scenarios:
+            # bcrypt makes every login cost tens of milliseconds; keep that scenario short.
+            requests = max(args.requests // 10, 10) if scenario == "login" else args.requests
+            await run_scenario(scenario, sends[scenario], max(requests // 10, 1), args.concurrency)  # warm-up
+            results.append(await run_scenario(scenario, sends[scenario], requests, args.concurrency))
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[0])
+    parser.add_argument("--mongodb-uri", help="defaults to MONGODB_URI or mongodb://localhost:27017/")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of mongod")
+    parser.add_argument("--expenses", type=int, default=10_000, help="expenses seeded for the benchmark user")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--scenarios", type=lambda value: value.split(","), default=SCENARIOS, help=f"any of {','.join(SCENARIOS)}"
+    )
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.in_memory and "bulk_insert" in args.scenarios:
+        # mongomock's bulk_write does not accept the UpdateOne operations of current PyMongo,
+        # so rollup maintenance (and with it bulk_insert) needs a real mongod.
+        print("Skipping bulk_insert: it needs mongod")
+        args.scenarios = [scenario for scenario in args.scenarios if scenario != "bulk_insert"]
+
+    results = asyncio.run(run(args))
+    print(f"{'scenario':<14}{'requests':>9}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for r in results:
+        print(f"{r.scenario:<14}{r.requests:>9}{r.errors:>8}{r.p50_ms:>10}{r.p95_ms:>10}{r.p99_ms:>10}{r.rps:>10}")
+
+    # In-memory numbers are not comparable with mongod ones, so each backend has its own baselines.
+    key = f"{args.expenses}@{'in-memory' if args.in_memory else 'mongod'}"
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.update_baseline:
+        baseline.update({f"{result.scenario}@{key}": result.to_dict() for result in results})
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    regressions = find_regressions(results, baseline, key, args.tolerance)
+    for regression in regressions:
+        print(f"regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import asyncio
+import importlib
+import itertools
+import statistics
+import sys
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import ModuleType
+
+import httpx
+
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class Service:
+    name: str
+    modules: dict[str, ModuleType]
+
+    @property
+    def app(self):  # noqa: ANN201
+        return self.modules["main"].app
+
+
+def load_service(name: str, keep_importable: bool = False) -> Service:
+    """Import ``backend/<name>/app`` without clashing with the other service's ``app`` package.
+
+    The modules are removed from ``sys.modules`` afterwards; the loaded objects keep working because
+    they hold references to each other. Only one service can stay importable as ``app``
+    (``keep_importable``): auth-service needs it, because its bcrypt worker processes are spawned and
+    pickle ``app.hashing`` functions by name.
+    """
+    service_dir = str(BACKEND_DIR / name)
+    saved = {key: sys.modules.pop(key) for key in list(sys.modules) if key == "app" or key.startswith("app.")}
+    sys.path.insert(0, service_dir)
+    try:
+        importlib.import_module("app.main")
+        modules = {
+            key.removeprefix("app."): sys.modules[key]
+            for key in list(sys.modules)
+            if key == "app" or key.startswith("app.")
+        }
+    finally:
+        sys.path.remove(service_dir)
+    if keep_importable:
+        sys.path.append(service_dir)
+    else:
+        for key in modules:
+            sys.modules.pop(key if key == "app" else f"app.{key}")
+        sys.modules.update(saved)
+    return Service(name, modules)
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int
+    errors: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    rps: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+async def run_scenario(
+    scenario: str, send: Callable[[int], Awaitable[httpx.Response]], requests: int, concurrency: int
+) -> Result:
+    """Issue ``requests`` calls with ``concurrency`` in flight and summarise their latencies."""
+    counter = itertools.count()
+    latencies: list[float] = []
+    errors = 0
+
+    async def worker() -> None:
+        nonlocal errors
+        while (index := next(counter)) < requests:
+            started = time.perf_counter()
+            response = await send(index)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return Result(
+        scenario=scenario,
+        requests=len(latencies),
+        errors=errors,
+        p50_ms=round(cuts[49], 3),
+        p95_ms=round(cuts[94], 3),
+        p99_ms=round(cuts[98], 3),
+        rps=round(len(latencies) / elapsed, 1),
+    )
+
+
+def find_regressions(results: list[Result], baseline: dict[str, dict], key: str, tolerance: float) -> list[str]:
+    """Compare against ``baseline[<scenario>@<key>]``: slower p95 or lower throughput beyond ``tolerance`` fails."""
+    regressions = []
+    for result in results:
+        reference = baseline.get(f"{result.scenario}@{key}")
+        if reference is None:
+            continue
+        if result.errors:
+            regressions.append(f"{result.scenario}: {result.errors} failed requests")
+        if result.p95_ms > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{result.scenario}: p95 {result.p95_ms} ms > baseline {reference['p95_ms']} ms")
+        if result.rps < reference["rps"] * (1 - tolerance):
+            regressions.append(f"{result.scenario}: {result.rps} req/s < baseline {reference['rps']} req/s")
+    return regressions
@@ -1,19 +1,40 @@
+import os
+import time
 from typing import ClassVar
 
-import requests
+import httpx
 from bson import ObjectId
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
 from pydantic import BaseModel, Field, validator
 
+from .cache import TTLCache
+from .http_client import get_http_client
+from .metrics import AUTH_VERIFY_SECONDS, register_cache
+
 
 AUTH_SERVICE_URL = "http://127.0.0.1:8002/verify-token"
+# "local" checks the JWT signature in-process, "remote" asks auth-service on every request.
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local")
+# Must match the key material auth-service signs tokens with.
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="http://127.0.0.1:8001/login")
 
+# userId -> whether auth-service still accepts the account (False once deleted or revoked).
+# Nothing pushes revocations here: a deleted account keeps working for up to AUTH_USER_CACHE_TTL.
+user_status_cache = TTLCache(
+    maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_USER_CACHE_TTL", "60")),
+)
+register_cache("auth_user_status", user_status_cache)
+
 
 class TokenData(BaseModel):
     email: str
     userId: ObjectId = Field(...)
+    role: str = "user"
 
     @validator("userId", pre=True)
     @classmethod
@@ -32,11 +53,66 @@ class TokenData(BaseModel):
         json_encoders: ClassVar[dict] = {ObjectId: str}
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+# The answers that mean auth-service rejects the token or account; anything else is its own failure.
+REJECTED_STATUSES = (401, 404)
+
+
+async def _fetch_remote_user(token: str) -> dict | None:
+    """The user auth-service vouches for, or None if it rejects them; 503 if it cannot answer."""
+    started = time.perf_counter()
     try:
-        response = requests.get(AUTH_SERVICE_URL, params={"token": token}, timeout=5)
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return TokenData(**response.json())
-    except requests.RequestException as exc:
-        raise HTTPException(status_code=401, detail="Could not validate token") from exc
+        response = await get_http_client().get(AUTH_SERVICE_URL, params={"token": token})
+    except httpx.HTTPError as exc:
+        AUTH_VERIFY_SECONDS.labels("error").observe(time.perf_counter() - started)
+        raise HTTPException(status_code=503, detail="Authentication service unavailable") from exc
+    if response.status_code == 200:
+        outcome = "valid"
+    elif response.status_code in REJECTED_STATUSES:
+        outcome = "invalid"
+    else:
+        outcome = "error"
+    AUTH_VERIFY_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+    if outcome == "error":
+        # Not an answer about the account: fail this request, and cache nothing.
+        raise HTTPException(status_code=503, detail="Authentication service unavailable")
+    if outcome == "invalid":
+        return None
+    return response.json()
+
+
+async def verify_token_remote(token: str) -> TokenData:
+    user = await _fetch_remote_user(token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return TokenData(**user)
+
+
+async def verify_token_local(token: str) -> TokenData:
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError as exc:
+        raise HTTPException(status_code=401, detail="Invalid token") from exc
+    email = payload.get("sub")
+    user_id = payload.get("userId")
+    if not isinstance(email, str) or not isinstance(user_id, str):
+        # Tokens issued before the userId claim existed still need the auth-service lookup.
+        return await verify_token_remote(token)
+    active = user_status_cache.get(user_id)
+    if active is None:
+        active = await _fetch_remote_user(token) is not None
+        user_status_cache.set(user_id, active)
+    if not active:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return TokenData(email=email, userId=user_id, role=payload.get("role", "user"))
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> TokenData:
+    if AUTH_VERIFY_MODE == "remote":
+        return await verify_token_remote(token)
+    return await verify_token_local(token)
+
+
+async def require_admin(current_user: TokenData = Depends(get_current_user)) -> TokenData:
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
@@ -0,0 +1,94 @@
+import csv
+import io
+import os
+from typing import Any
+
+from bson import ObjectId
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from .groups import user_groups
+from .models import BulkImportResponse, BulkRowResult, ExpenseCreate
+from .rollup import apply_rollup
+from .sync import next_version, now_ms
+
+
+BULK_CHUNK_SIZE = int(os.getenv("EXPENSE_BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ROWS = int(os.getenv("EXPENSE_BULK_MAX_ROWS", "10000"))
+DUPLICATE_KEY = 11000
+
+
+def parse_csv_rows(body: bytes) -> list[dict[str, Any]]:
+    """Read CSV rows with an ``amount,category,date,description,type,currency`` header."""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError as exc:
+        raise HTTPException(status_code=400, detail="CSV body must be UTF-8") from exc
+    # Blank optional cells fall back to the model defaults.
+    return [{key: value for key, value in row.items() if value != ""} for row in csv.DictReader(io.StringIO(text))]
+
+
+def _format_errors(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+
+async def import_expenses(
+    db: AsyncIOMotorDatabase, user_id: ObjectId, items: list[dict[str, Any]], idempotency_key: str | None
+) -> BulkImportResponse:
+    """Validate every row, then insert the valid ones with unordered ``insert_many`` in chunks.
+
+    With an idempotency key each row is stored with ``importKey = "<key>:<row>"``; the unique
+    (userId, importKey) index turns rows a retried upload already wrote into ``duplicate`` results.
+    """
+    if len(items) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows per import")
+    results: list[BulkRowResult] = []
+    pending: list[tuple[int, dict]] = []
+    member_of = await user_groups(db, user_id) if any(item.get("groupId") for item in items) else frozenset()
+    for row, item in enumerate(items):
+        try:
+            expense = ExpenseCreate.model_validate(item)
+        except ValidationError as exc:
+            results.append(BulkRowResult(row=row, status="invalid", error=_format_errors(exc)))
+            continue
+        if expense.groupId and ObjectId(expense.groupId) not in member_of:
+            results.append(BulkRowResult(row=row, status="invalid", error="groupId: not a member of this group"))
+            continue
+        doc = {**expense.to_document(), "userId": user_id}
+        if idempotency_key:
+            doc["importKey"] = f"{idempotency_key}:{row}"
+        pending.append((row, doc))
+
+    for start in range(0, len(pending), BULK_CHUNK_SIZE):
+        chunk = pending[start : start + BULK_CHUNK_SIZE]
+        version = await next_version(db, user_id)
+        epoch = now_ms()
+        for _, doc in chunk:
+            doc["version"] = version
+            doc["epoch"] = epoch
+        write_errors: dict[int, dict] = {}
+        try:
+            await db.expense.insert_many([doc for _, doc in chunk], ordered=False)
+        except BulkWriteError as exc:
+            write_errors = {error["index"]: error for error in exc.details.get("writeErrors", [])}
+        inserted = []
+        for index, (row, doc) in enumerate(chunk):
+            error = write_errors.get(index)
+            if error is None:
+                inserted.append(doc)
+                results.append(BulkRowResult(row=row, status="created", id=str(doc["_id"])))
+            elif error.get("code") == DUPLICATE_KEY:
+                results.append(BulkRowResult(row=row, status="duplicate"))
+            else:
+                results.append(BulkRowResult(row=row, status="failed", error=error.get("errmsg")))
+        await apply_rollup(db, added=inserted)
+
+    results.sort(key=lambda result: result.row)
+    return BulkImportResponse(
+        created=sum(result.status == "created" for result in results),
+        duplicates=sum(result.status == "duplicate" for result in results),
+        errors=sum(result.status in ("invalid", "failed") for result in results),
+        results=results,
+    )
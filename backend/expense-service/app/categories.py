@@ -0,0 +1,393 @@
+"""Category reads and writes.
+
+``GET /categories`` is served from a cache: each worker keeps the universal list and every user's
+own list in a TTLCache, and category writes invalidate the affected entry. A user's list is stored
+with the data version it was read under (category writes bump it with ``touch_user``) and only
+served to reads of that same version, so a write on one worker is never answered from another
+worker's older copy. When
+``CATEGORY_CACHE_REDIS_URL`` is set (and the optional ``redis`` package is installed),
+invalidations are also published over Redis pub/sub so every worker drops its copy; otherwise
+other workers catch up once the TTL expires.
+
+Renames claim the category document with a conditional update, so two renames (or a rename and a
+delete) of the same category cannot interleave. Small renames re-tag the expenses in a
+multi-document transaction when the deployment supports one; larger ones, or any rename on a
+standalone server, run as a ``category_job`` whose progress is readable while it works.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections.abc import Coroutine
+from typing import Any
+
+from bson import ObjectId
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+from .cache import TTLCache
+from .etag import touch_user
+from .metrics import register_cache
+from .models import CategoryJob
+from .rollup import apply_rollup, rename_rollup_category
+from .sync import next_version, now_ms
+
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional dependency
+    aioredis = None
+
+
+CATEGORY_CACHE_SIZE = int(os.getenv("CATEGORY_CACHE_SIZE", "10000"))
+CATEGORY_CACHE_TTL = float(os.getenv("CATEGORY_CACHE_TTL", "60"))
+UNIVERSAL_CATEGORY_CACHE_TTL = float(os.getenv("UNIVERSAL_CATEGORY_CACHE_TTL", "600"))
+CATEGORY_CACHE_REDIS_URL = os.getenv("CATEGORY_CACHE_REDIS_URL")
+CATEGORY_CACHE_CHANNEL = os.getenv("CATEGORY_CACHE_CHANNEL", "expense:category-invalidate")
+
+CATEGORY_RENAME_SYNC_LIMIT = int(os.getenv("CATEGORY_RENAME_SYNC_LIMIT", "1000"))
+CATEGORY_RENAME_BATCH_SIZE = int(os.getenv("CATEGORY_RENAME_BATCH_SIZE", "200"))
+CATEGORY_RENAME_TRANSACTIONS = os.getenv("CATEGORY_RENAME_TRANSACTIONS", "1") == "1"
+CATEGORY_JOB_LEASE_SECONDS = int(os.getenv("CATEGORY_JOB_LEASE_SECONDS", "60"))
+CATEGORY_JOB_SWEEP_SECONDS = float(os.getenv("CATEGORY_JOB_SWEEP_SECONDS", "30"))
+CATEGORY_JOB_RETRY_SECONDS = float(os.getenv("CATEGORY_JOB_RETRY_SECONDS", "10"))
+CATEGORY_JOB_MAX_ATTEMPTS = int(os.getenv("CATEGORY_JOB_MAX_ATTEMPTS", "5"))
+CATEGORY_JOBS = "category_job"
+
+logger = logging.getLogger(__name__)
+
+UNIVERSAL = "universal"
+# Raised by servers that are not replica set members when a transaction is started.
+ILLEGAL_OPERATION = 20
+RENAME_FIELDS = {"_id": 1, "userId": 1, "amount": 1, "date": 1, "dateAt": 1, "category": 1, "type": 1, "currency": 1}
+
+
+def _to_dict(category: dict) -> dict[str, Any]:
+    return {"name": category["name"], "userId": str(category["userId"]) if category.get("userId") else None}
+
+
+class CategoryCache:
+    def __init__(self, maxsize: int, ttl: float, universal_ttl: float, redis_url: str | None = None) -> None:
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.universal_ttl = universal_ttl
+        self.redis_url = redis_url
+        self._redis: Any = None
+        self._listener: asyncio.Task | None = None
+        # Bumped by every invalidation: a lookup that overlapped one is served but not cached,
+        # since its query may have read the list from before the change.
+        self._generation = 0
+
+    async def user_categories(self, db: AsyncIOMotorDatabase, user_id: ObjectId, version: int) -> list[dict[str, Any]]:
+        """The user's own categories, as of data ``version`` or later."""
+        key = str(user_id)
+        cached = self.local.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        generation = self._generation
+        categories = [_to_dict(category) async for category in db.category.find({"userId": user_id}, {"_id": 0})]
+        if generation == self._generation:
+            self.local.set(key, (version, categories))
+        return categories
+
+    async def universal_categories(self, db: AsyncIOMotorDatabase) -> list[dict[str, Any]]:
+        categories = self.local.get(UNIVERSAL)
+        if categories is None:
+            generation = self._generation
+            query = {"userId": {"$exists": False}}
+            categories = [_to_dict(category) async for category in db.category.find(query, {"_id": 0})]
+            if generation == self._generation:
+                self.local.set(UNIVERSAL, categories, ttl=self.universal_ttl)
+        return categories
+
+    async def invalidate(self, user_id: ObjectId | None = None) -> None:
+        """Drop a user's list (or the universal list) here and, with Redis, on every other worker."""
+        key = str(user_id) if user_id else UNIVERSAL
+        self._drop(key)
+        if self._redis is not None:
+            await self._redis.publish(CATEGORY_CACHE_CHANNEL, key)
+
+    async def start(self) -> None:
+        if not self.redis_url:
+            return
+        if aioredis is None:
+            logger.warning("CATEGORY_CACHE_REDIS_URL is set but redis is not installed; using the local cache only")
+            return
+        self._redis = aioredis.from_url(self.redis_url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(CATEGORY_CACHE_CHANNEL)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub: Any) -> None:
+        async for message in pubsub.listen():
+            if message.get("type") == "message":
+                key = message["data"]
+                self._drop(key.decode() if isinstance(key, bytes) else key)
+
+    def _drop(self, key: str) -> None:
+        self._generation += 1
+        self.local.invalidate(key)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._listener
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+category_cache = CategoryCache(
+    CATEGORY_CACHE_SIZE, CATEGORY_CACHE_TTL, UNIVERSAL_CATEGORY_CACHE_TTL, CATEGORY_CACHE_REDIS_URL
+)
+register_cache("categories", category_cache.local)
+
+
+_running_jobs: set[asyncio.Task] = set()
+
+
+def _job_to_model(job: dict) -> CategoryJob:
+    return CategoryJob(
+        id=str(job["_id"]),
+        oldName=job["oldName"],
+        newName=job["newName"],
+        status=job["status"],
+        total=job["total"],
+        done=job["done"],
+        error=job.get("error"),
+    )
+
+
+async def _claim_failed(db: AsyncIOMotorDatabase, user_id: ObjectId, name: str) -> HTTPException:
+    if await db.category.find_one({"name": name, "userId": user_id}, {"_id": 1}):
+        return HTTPException(status_code=409, detail="Category is being renamed, try again later")
+    return HTTPException(status_code=404, detail="Category not found or not owned by user")
+
+
+async def _rename_in_transaction(db: AsyncIOMotorDatabase, user_id: ObjectId, old_name: str, new_name: str) -> bool:
+    """Rename the category and re-tag its expenses atomically; False if transactions are unavailable."""
+    async with await db.client.start_session() as session:
+        try:
+            async with session.start_transaction():
+                renamed = await db.category.update_one(
+                    {"name": old_name, "userId": user_id, "renameJob": {"$exists": False}},
+                    {"$set": {"name": new_name}},
+                    session=session,
+                )
+                if renamed.matched_count == 0:
+                    raise await _claim_failed(db, user_id, old_name)
+                version = await next_version(db, user_id, session=session)
+                await db.expense.update_many(
+                    {"category": old_name, "userId": user_id},
+                    {"$set": {"category": new_name, "epoch": now_ms(), "version": version}},
+                    session=session,
+                )
+                await rename_rollup_category(db, user_id, old_name, new_name, session=session)
+        except OperationFailure as exc:
+            if exc.code == ILLEGAL_OPERATION:
+                return False
+            raise
+    return True
+
+
+async def _start_rename_job(
+    db: AsyncIOMotorDatabase, user_id: ObjectId, old_name: str, new_name: str, total: int
+) -> dict:
+    job_id = ObjectId()
+    # The category takes its new name straight away; renameJob blocks other renames and deletes until done.
+    claimed = await db.category.update_one(
+        {"name": old_name, "userId": user_id, "renameJob": {"$exists": False}},
+        {"$set": {"name": new_name, "renameJob": job_id}},
+    )
+    if claimed.matched_count == 0:
+        raise await _claim_failed(db, user_id, old_name)
+    now = time.time()
+    job = {
+        "_id": job_id,
+        "userId": user_id,
+        "oldName": old_name,
+        "newName": new_name,
+        "status": "running",
+        "total": total,
+        "done": 0,
+        "createdAt": now,
+        "leaseUntil": now + CATEGORY_JOB_LEASE_SECONDS,
+    }
+    await db[CATEGORY_JOBS].insert_one(job)
+    return job
+
+
+async def _retag(
+    db: AsyncIOMotorDatabase, expense_id: ObjectId, old_name: str, new_name: str, version: int
+) -> dict | None:
+    return await db.expense.find_one_and_update(
+        {"_id": expense_id, "category": old_name},
+        {"$set": {"category": new_name, "epoch": now_ms(), "version": version}},
+        projection=RENAME_FIELDS,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+async def _record_failure(db: AsyncIOMotorDatabase, job: dict, exc: PyMongoError) -> None:
+    """Retry the job after CATEGORY_JOB_RETRY_SECONDS; after CATEGORY_JOB_MAX_ATTEMPTS give up and free the category."""
+    attempts = job.get("attempts", 0) + 1
+    if attempts < CATEGORY_JOB_MAX_ATTEMPTS:
+        await db[CATEGORY_JOBS].update_one(
+            {"_id": job["_id"]},
+            {"$set": {"error": str(exc), "attempts": attempts, "leaseUntil": time.time() + CATEGORY_JOB_RETRY_SECONDS}},
+        )
+        return
+    # The expenses not re-tagged yet keep the old name; renaming or deleting the category is allowed again.
+    await db.category.update_one({"userId": job["userId"], "renameJob": job["_id"]}, {"$unset": {"renameJob": ""}})
+    await db[CATEGORY_JOBS].update_one(
+        {"_id": job["_id"]}, {"$set": {"status": "failed", "error": str(exc), "attempts": attempts}}
+    )
+
+
+async def run_rename_job(db: AsyncIOMotorDatabase, job: dict) -> None:
+    """Re-tag the job's expenses batch by batch, keeping the rollups exact, then release the category.
+
+    Each expense is moved with its own conditional update so the rollup delta uses the values it
+    had at that moment, even while the user keeps editing. Safe to re-run after a crash.
+    """
+    user_id, old_name, new_name = job["userId"], job["oldName"], job["newName"]
+    query = {"userId": user_id, "category": old_name}
+    try:
+        while True:
+            batch = await db.expense.find(query, {"_id": 1}).limit(CATEGORY_RENAME_BATCH_SIZE).to_list(None)
+            if not batch:
+                break
+            version = await next_version(db, user_id)
+            previous = [
+                doc
+                for doc in await asyncio.gather(*(_retag(db, doc["_id"], old_name, new_name, version) for doc in batch))
+                if doc is not None
+            ]
+            await apply_rollup(db, removed=previous, added=[{**doc, "category": new_name} for doc in previous])
+            await db[CATEGORY_JOBS].update_one(
+                {"_id": job["_id"]},
+                {"$inc": {"done": len(previous)}, "$set": {"leaseUntil": time.time() + CATEGORY_JOB_LEASE_SECONDS}},
+            )
+            await touch_user(db, user_id)
+        await db.category.update_one({"userId": user_id, "renameJob": job["_id"]}, {"$unset": {"renameJob": ""}})
+        await db[CATEGORY_JOBS].update_one({"_id": job["_id"]}, {"$set": {"status": "done"}})
+    except asyncio.CancelledError:
+        # Shutting down: let the next sweep (here or on another worker) take the job without waiting out the lease.
+        with contextlib.suppress(PyMongoError):
+            await db[CATEGORY_JOBS].update_one({"_id": job["_id"]}, {"$set": {"leaseUntil": 0}})
+        raise
+    except PyMongoError as exc:
+        logger.exception("Category rename job failed", extra={"jobId": str(job["_id"])})
+        with contextlib.suppress(PyMongoError):
+            await _record_failure(db, job, exc)
+        raise
+    finally:
+        await category_cache.invalidate(user_id)
+        await touch_user(db, user_id)
+
+
+async def _run_logged(db: AsyncIOMotorDatabase, job: dict) -> None:
+    # run_rename_job has logged and recorded the failure; the next sweep retries the job.
+    with contextlib.suppress(PyMongoError):
+        await run_rename_job(db, job)
+
+
+def _track(coroutine: Coroutine[Any, Any, None]) -> None:
+    task = asyncio.create_task(coroutine)
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+
+
+def _run_in_background(db: AsyncIOMotorDatabase, job: dict) -> None:
+    _track(_run_logged(db, job))
+
+
+async def rename_category(
+    db: AsyncIOMotorDatabase, user_id: ObjectId, old_name: str, new_name: str
+) -> CategoryJob | None:
+    """Rename a category and its expenses; returns the job when the rename continues in the background."""
+    if old_name == new_name:
+        # Re-tagging to the same name would never drain the rename query.
+        raise HTTPException(status_code=400, detail="New category name already exists")
+    total = await db.expense.count_documents({"userId": user_id, "category": old_name})
+    try:
+        if total <= CATEGORY_RENAME_SYNC_LIMIT:
+            if CATEGORY_RENAME_TRANSACTIONS and await _rename_in_transaction(db, user_id, old_name, new_name):
+                await category_cache.invalidate(user_id)
+                await touch_user(db, user_id)
+                return None
+            job = await _start_rename_job(db, user_id, old_name, new_name, total)
+            try:
+                await run_rename_job(db, job)
+            except PyMongoError as exc:
+                raise HTTPException(
+                    status_code=503, detail=f"Category rename interrupted, it will be retried as job {job['_id']}"
+                ) from exc
+            return None
+        job = await _start_rename_job(db, user_id, old_name, new_name, total)
+    except DuplicateKeyError as exc:
+        raise HTTPException(status_code=400, detail="New category name already exists") from exc
+    await category_cache.invalidate(user_id)
+    await touch_user(db, user_id)
+    _run_in_background(db, job)
+    return _job_to_model(job)
+
+
+async def get_rename_job(db: AsyncIOMotorDatabase, user_id: ObjectId, job_id: str) -> CategoryJob:
+    job = (
+        await db[CATEGORY_JOBS].find_one({"_id": ObjectId(job_id), "userId": user_id})
+        if ObjectId.is_valid(job_id)
+        else None
+    )
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_to_model(job)
+
+
+async def resume_rename_jobs(db: AsyncIOMotorDatabase) -> None:
+    """Pick up running jobs whose worker stopped renewing the lease (restart, crash, scale-down)."""
+    while True:
+        now = time.time()
+        job = await db[CATEGORY_JOBS].find_one_and_update(
+            {"status": "running", "leaseUntil": {"$lt": now}},
+            {"$set": {"leaseUntil": now + CATEGORY_JOB_LEASE_SECONDS}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            return
+        _run_in_background(db, job)
+
+
+async def _sweep_rename_jobs(db: AsyncIOMotorDatabase) -> None:
+    while True:
+        try:
+            await resume_rename_jobs(db)
+        except PyMongoError:
+            logger.exception("Failed to resume category rename jobs")
+        await asyncio.sleep(CATEGORY_JOB_SWEEP_SECONDS)
+
+
+def start_rename_jobs(db: AsyncIOMotorDatabase) -> None:
+    """Resume abandoned or failed rename jobs now and every CATEGORY_JOB_SWEEP_SECONDS until shutdown."""
+    _track(_sweep_rename_jobs(db))
+
+
+async def cancel_rename_jobs() -> None:
+    for task in list(_running_jobs):
+        task.cancel()
+    await asyncio.gather(*_running_jobs, return_exceptions=True)
+
+
+async def delete_category(db: AsyncIOMotorDatabase, user_id: ObjectId, name: str) -> None:
+    if await db.expense.find_one({"category": name, "userId": user_id}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Cannot delete category used in records")
+    deleted = await db.category.delete_one({"name": name, "userId": user_id, "renameJob": {"$exists": False}})
+    if deleted.deleted_count == 0:
+        raise await _claim_failed(db, user_id, name)
+    await category_cache.invalidate(user_id)
+    await touch_user(db, user_id)
@@ -0,0 +1,52 @@
+"""Typed expense dates.
+
+Expenses keep the ``date`` string the client sent and, next to it, ``dateAt``: the same wall-clock
+date and time as a BSON date. Offsets are dropped rather than converted, so ``dateAt`` always
+falls on the calendar day (and month) the string names and the month buckets stay as they were.
+Range filters and sorting use ``dateAt``; run ``python -m app.migrate_dates`` to backfill it.
+"""
+
+import re
+from datetime import datetime
+
+from fastapi import HTTPException
+
+
+_YEAR = re.compile(r"\d{4}")
+_MONTH = re.compile(r"\d{4}-\d{2}")
+
+
+def parse_expense_date(value: str) -> datetime:
+    """``YYYY-MM-DD`` or an ISO-8601 date-time; raises ValueError for anything else."""
+    parsed = datetime.fromisoformat(value.strip())
+    return parsed.replace(tzinfo=None)
+
+
+def _period(bound: str) -> tuple[datetime, datetime]:
+    """The first instant of the year, month, day or instant ``bound`` names, and of the next one."""
+    bound = bound.strip()
+    if _YEAR.fullmatch(bound):
+        start = datetime(int(bound), 1, 1)
+        return start, start.replace(year=start.year + 1)
+    if _MONTH.fullmatch(bound):
+        year, month = map(int, bound.split("-"))
+        start = datetime(year, month, 1)
+        return start, datetime(year + month // 12, month % 12 + 1, 1)
+    start = parse_expense_date(bound)
+    if "T" not in bound and " " not in bound:
+        return start, datetime.fromordinal(start.toordinal() + 1)
+    return start, start
+
+
+def date_range(date_gte: str | None, date_lte: str | None) -> dict:
+    """``dateAt`` bounds for inclusive ``date_gte``/``date_lte`` given as a year, month, day or date-time."""
+    bounds: dict = {}
+    try:
+        if date_gte:
+            bounds["$gte"] = _period(date_gte)[0]
+        if date_lte:
+            start, end = _period(date_lte)
+            bounds.update({"$lte": start} if start == end else {"$lt": end})
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="date_gte and date_lte must be ISO-8601 dates") from exc
+    return bounds
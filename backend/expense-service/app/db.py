@@ -1,9 +1,42 @@
 import os
 
-from pymongo import MongoClient
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 
+from .metrics import mongo_listeners
 
-def get_db() -> Database:
-    client: MongoClient = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"))
-    return client["expense_tracker"]
+
+DB_NAME = os.getenv("MONGODB_DB", "expense_tracker")
+
+_client: AsyncIOMotorClient | None = None
+
+
+def _client_options() -> dict:
+    return {
+        "maxPoolSize": int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGODB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+        "connectTimeoutMS": int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000")),
+        "readPreference": os.getenv("MONGODB_READ_PREFERENCE", "primary"),
+        "event_listeners": mongo_listeners(),
+    }
+
+
+def connect_db() -> AsyncIOMotorClient:
+    """Create the process-wide client; its connection pool is shared by every request."""
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017/"), **_client_options())
+    return _client
+
+
+def close_db() -> None:
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def get_db() -> AsyncIOMotorDatabase:
+    return connect_db()[DB_NAME]
@@ -0,0 +1,95 @@
+"""Conditional requests: GETs keyed on the user's data version, and If-Match on expense updates.
+
+The data version is the user's sync counter in ``expense_sequence``. Expense writes take their
+``version`` from it anyway; category and profile writes end with ``touch_user``, which bumps it
+the same way. Read endpoints depend on ``data_version_etag``: it reads the counter with one
+``_id`` lookup and answers a matching ``If-None-Match`` with 304 before the endpoint runs its query.
+
+Expense writes bump the counter before they commit, so a read right after a bump may not see the
+write yet. For ``EXPENSE_SYNC_LAG_MS`` after a bump reads get no ETag at all: nothing can be
+cached under a version whose write is still in flight, and a 304 never hides a committed change.
+
+A single expense's ETag is its own sync ``version``; ``PUT /expense/{id}`` with ``If-Match``
+only applies if the expense still has that version, and answers 412 otherwise.
+"""
+
+from typing import Annotated
+
+from bson import ObjectId
+from fastapi import Depends, Header, HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from .auth import TokenData, get_current_user
+from .db import get_db
+from .sync import EXPENSE_SYNC_LAG_MS, SEQUENCE_COLLECTION, now_ms, version_bump
+
+
+# Browsers cache per URL, not per user: revalidate every time and keep it out of shared caches.
+CACHE_CONTROL = "private, no-cache"
+
+
+class NotModified(Exception):
+    def __init__(self, etag: str) -> None:
+        super().__init__(etag)
+        self.etag = etag
+
+
+async def data_version(db: AsyncIOMotorDatabase, user_id: ObjectId) -> tuple[int, int]:
+    """The user's counter and when it was last bumped, in ms."""
+    counter = await db[SEQUENCE_COLLECTION].find_one({"_id": user_id}, {"version": 1, "versionAt": 1})
+    return (counter.get("version", 0), counter.get("versionAt", 0)) if counter else (0, 0)
+
+
+async def touch_user(db: AsyncIOMotorDatabase, user_id: ObjectId) -> None:
+    """Invalidate the user's ETags after a write that did not take an expense version."""
+    await db[SEQUENCE_COLLECTION].update_one({"_id": user_id}, version_bump(), upsert=True)
+
+
+async def touch_users(db: AsyncIOMotorDatabase, user_ids: list[ObjectId]) -> None:
+    if user_ids:
+        await db[SEQUENCE_COLLECTION].bulk_write(
+            [UpdateOne({"_id": user_id}, version_bump(), upsert=True) for user_id in user_ids],
+            ordered=False,
+        )
+
+
+def cache_headers(etag: str | None) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL} if etag else {"Cache-Control": CACHE_CONTROL}
+
+
+def version_etag(user_id: ObjectId, version: int, version_at: int, if_none_match: str | None) -> str | None:
+    """The ETag for ``version``, or None while a write that bumped the counter may still be committing."""
+    if now_ms() - version_at < EXPENSE_SYNC_LAG_MS:
+        return None
+    # The user id keeps one user's cached copy from validating for the next user of the browser.
+    etag = f'W/"{user_id}-{version}"'
+    if if_none_match and (if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))):
+        raise NotModified(etag)
+    return etag
+
+
+async def data_version_etag(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> str | None:
+    """The read's ETag from the user's current data version; see ``version_etag``."""
+    version, version_at = await data_version(db, current_user.userId)
+    return version_etag(current_user.userId, version, version_at, if_none_match)
+
+
+def expense_etag(expense: dict) -> str:
+    # Expenses written before versions existed count as version 0.
+    return f'"{expense.get("version") or 0}"'
+
+
+def version_precondition(if_match: str | None) -> dict:
+    """The filter an ``If-Match: "<version>"`` header adds to a write; empty without one (or for ``*``)."""
+    if if_match is None or if_match.strip() == "*":
+        return {}
+    try:
+        version = int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail="If-Match must be an expense ETag") from exc
+    return {"version": {"$in": [None, 0]} if version == 0 else version}
@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+import os
+from collections.abc import AsyncIterator
+
+from motor.motor_asyncio import AsyncIOMotorCursor
+
+from .query import expense_to_dict
+
+
+# Documents pulled from MongoDB per getMore, and rows written per chunk sent to the client.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPENSE_EXPORT_BATCH_SIZE", "1000"))
+EXPORT_FLUSH_ROWS = int(os.getenv("EXPENSE_EXPORT_FLUSH_ROWS", "500"))
+CSV_COLUMNS = ["id", "date", "amount", "currency", "type", "category", "description", "groupId", "epoch"]
+
+
+async def _rows(cursor: AsyncIOMotorCursor) -> AsyncIterator[dict]:
+    try:
+        async for doc in cursor:
+            yield expense_to_dict(doc)
+    finally:
+        # Release the server-side cursor if the client disconnects mid-export.
+        await cursor.close()
+
+
+async def stream_ndjson(cursor: AsyncIOMotorCursor) -> AsyncIterator[bytes]:
+    lines: list[str] = []
+    async for row in _rows(cursor):
+        lines.append(json.dumps(row, separators=(",", ":")))
+        if len(lines) >= EXPORT_FLUSH_ROWS:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines.clear()
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+async def stream_csv(cursor: AsyncIOMotorCursor) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    # Send the header straight away so the download starts before the first batch arrives.
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    rows = 0
+    async for row in _rows(cursor):
+        writer.writerow(row)
+        rows += 1
+        if rows % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,120 @@
+"""Group ledgers: expenses shared by the members of a family or household.
+
+A ``group`` document lists its members in ``users``; members join with the group's
+``inviteCode``. An expense written with a ``groupId`` still belongs to the member who wrote it
+(only they can change or delete it) and is readable by every member. Group reads match on
+``groupId`` with the ``groupId_dateAt`` index, so a group ledger is one query however many
+members it has.
+
+Membership is checked against a per-worker TTLCache of each user's group ids, so authorizing a
+group read or write usually costs no query. Joining, leaving and creating a group invalidate the
+user's entry on the worker that handled them; other workers catch up within
+``GROUP_MEMBERSHIP_CACHE_TTL`` seconds.
+"""
+
+import os
+import secrets
+import time
+from typing import Annotated
+
+from bson import ObjectId
+from fastapi import Depends, HTTPException
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from .auth import TokenData, get_current_user
+from .cache import TTLCache
+from .db import get_db
+from .metrics import register_cache
+from .models import Group
+
+
+GROUP_MEMBERSHIP_CACHE_SIZE = int(os.getenv("GROUP_MEMBERSHIP_CACHE_SIZE", "10000"))
+GROUP_MEMBERSHIP_CACHE_TTL = float(os.getenv("GROUP_MEMBERSHIP_CACHE_TTL", "30"))
+
+# userId -> frozenset of the ids of the groups the user belongs to.
+group_membership = TTLCache(GROUP_MEMBERSHIP_CACHE_SIZE, GROUP_MEMBERSHIP_CACHE_TTL)
+register_cache("group_membership", group_membership)
+
+
+def group_to_model(doc: dict) -> Group:
+    return Group(
+        id=str(doc["_id"]),
+        name=doc["name"],
+        owner=str(doc["owner"]),
+        users=[str(user_id) for user_id in doc.get("users", [])],
+        inviteCode=doc["inviteCode"],
+        createdAt=doc["createdAt"],
+    )
+
+
+async def user_groups(db: AsyncIOMotorDatabase, user_id: ObjectId) -> frozenset[ObjectId]:
+    groups = group_membership.get(user_id)
+    if groups is None:
+        groups = frozenset(
+            [doc["_id"] async for doc in db.group.find({"users": user_id, "deletedAt": None}, {"_id": 1})]
+        )
+        group_membership.set(user_id, groups)
+    return groups
+
+
+async def resolve_group_id(db: AsyncIOMotorDatabase, user_id: ObjectId, group_id: str | None) -> ObjectId | None:
+    """The ObjectId of ``group_id`` if the user may write to it; 403 if they are not a member."""
+    if group_id is None:
+        return None
+    if not ObjectId.is_valid(group_id) or ObjectId(group_id) not in await user_groups(db, user_id):
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    return ObjectId(group_id)
+
+
+async def group_member(
+    group_id: str,
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> ObjectId:
+    """Path dependency: the group id, once the current user is known to be a member."""
+    if not ObjectId.is_valid(group_id) or ObjectId(group_id) not in await user_groups(db, current_user.userId):
+        # Same answer for groups that exist and ones that do not.
+        raise HTTPException(status_code=404, detail="Group not found")
+    return ObjectId(group_id)
+
+
+async def create_group(db: AsyncIOMotorDatabase, user_id: ObjectId, name: str) -> Group:
+    group = {
+        "name": name,
+        "owner": user_id,
+        "users": [user_id],
+        "inviteCode": secrets.token_urlsafe(12),
+        "createdAt": int(time.time() * 1000),
+        "deletedAt": None,
+    }
+    result = await db.group.insert_one(group)
+    group["_id"] = result.inserted_id
+    group_membership.invalidate(user_id)
+    return group_to_model(group)
+
+
+async def list_groups(db: AsyncIOMotorDatabase, user_id: ObjectId) -> list[Group]:
+    return [group_to_model(doc) async for doc in db.group.find({"users": user_id, "deletedAt": None}).sort("_id", 1)]
+
+
+async def join_group(db: AsyncIOMotorDatabase, user_id: ObjectId, invite_code: str) -> Group:
+    group = await db.group.find_one_and_update(
+        {"inviteCode": invite_code, "deletedAt": None},
+        {"$addToSet": {"users": user_id}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if group is None:
+        raise HTTPException(status_code=404, detail="Invalid invite code")
+    group_membership.invalidate(user_id)
+    return group_to_model(group)
+
+
+async def leave_group(db: AsyncIOMotorDatabase, user_id: ObjectId, group_id: ObjectId) -> None:
+    # The owner stays, so a group always has someone who created it; their expenses keep the groupId.
+    result = await db.group.update_one(
+        {"_id": group_id, "users": user_id, "owner": {"$ne": user_id}}, {"$pull": {"users": user_id}}
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=400, detail="The group owner cannot leave the group")
+    group_membership.invalidate(user_id)
@@ -0,0 +1,226 @@
+"""Index declarations for expense-service collections.
+
+Run ``python -m app.indexes`` from ``expense-service/`` to create missing indexes and
+``python -m app.indexes --check-plans`` to also report query shapes that would scan a collection.
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .db import close_db, get_db
+from .query import EXPENSE_SORT
+from .sync import CHANGES_SORT, EXPENSE_TOMBSTONE_TTL_DAYS
+
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "expense": [
+        # GET /expense: equality on userId, range and keyset sort on (dateAt, _id).
+        IndexModel([("userId", ASCENDING), ("dateAt", DESCENDING), ("_id", DESCENDING)], name="userId_dateAt"),
+        # GET /expense?category=, category rename/delete checks.
+        IndexModel(
+            [("userId", ASCENDING), ("category", ASCENDING), ("dateAt", DESCENDING), ("_id", DESCENDING)],
+            name="userId_category_dateAt",
+        ),
+        # GET /expense?type=
+        IndexModel(
+            [("userId", ASCENDING), ("type", ASCENDING), ("dateAt", DESCENDING), ("_id", DESCENDING)],
+            name="userId_type_dateAt",
+        ),
+        # GET /groups/{id}/expense: one range scan per group, not a $in over its members.
+        IndexModel([("groupId", ASCENDING), ("dateAt", DESCENDING), ("_id", DESCENDING)], name="groupId_dateAt"),
+        # GET /expense/changes: a user's writes in (version, _id) order.
+        IndexModel([("userId", ASCENDING), ("version", ASCENDING), ("_id", ASCENDING)], name="userId_version"),
+        # Idempotent bulk imports: a retried upload cannot insert the same row twice.
+        IndexModel(
+            [("userId", ASCENDING), ("importKey", ASCENDING)],
+            name="userId_importKey",
+            unique=True,
+            partialFilterExpression={"importKey": {"$exists": True}},
+        ),
+    ],
+    "expense_tombstone": [
+        IndexModel([("userId", ASCENDING), ("version", ASCENDING), ("_id", ASCENDING)], name="userId_version"),
+        # Deletes are reported for EXPENSE_TOMBSTONE_TTL_DAYS; older sync cursors get a 410.
+        IndexModel(
+            [("deletedAt", ASCENDING)], name="deletedAt_ttl", expireAfterSeconds=EXPENSE_TOMBSTONE_TTL_DAYS * 86400
+        ),
+    ],
+    "group": [
+        # Membership lookups: the groups a user belongs to.
+        IndexModel([("users", ASCENDING)], name="users"),
+        IndexModel([("inviteCode", ASCENDING)], name="inviteCode", unique=True),
+    ],
+    "category": [
+        IndexModel([("userId", ASCENDING), ("name", ASCENDING)], name="userId_name", unique=True),
+    ],
+    "category_job": [
+        # Startup scan for rename jobs whose worker went away.
+        IndexModel([("status", ASCENDING), ("leaseUntil", ASCENDING)], name="status_leaseUntil"),
+    ],
+    "expense_rollup": [
+        IndexModel(
+            [
+                ("userId", ASCENDING),
+                ("month", ASCENDING),
+                ("category", ASCENDING),
+                ("type", ASCENDING),
+                ("currency", ASCENDING),
+            ],
+            name="rollup_key",
+            unique=True,
+        ),
+    ],
+    "user_profile": [
+        IndexModel([("userId", ASCENDING)], name="userId", unique=True),
+    ],
+}
+
+EXPENSE_SORT_SPEC = dict(EXPENSE_SORT)
+_JAN, _JUNE, _NEXT_JAN = datetime(2025, 1, 1), datetime(2025, 6, 1), datetime(2026, 1, 1)
+
+# Representative filters for every query the endpoints issue; values only need the right type.
+QUERY_SHAPES: list[tuple[str, dict, dict | None]] = [
+    ("expense", {"userId": ObjectId()}, EXPENSE_SORT_SPEC),
+    ("expense", {"userId": ObjectId(), "dateAt": {"$gte": _JAN, "$lt": _NEXT_JAN}}, EXPENSE_SORT_SPEC),
+    ("expense", {"userId": ObjectId(), "category": "Groceries", "dateAt": {"$gte": _JAN}}, EXPENSE_SORT_SPEC),
+    ("expense", {"userId": ObjectId(), "type": "expense", "dateAt": {"$lt": _NEXT_JAN}}, EXPENSE_SORT_SPEC),
+    (
+        "expense",
+        {
+            "userId": ObjectId(),
+            "$or": [
+                {"dateAt": {"$lt": _JUNE}},
+                {"dateAt": _JUNE, "_id": {"$lt": ObjectId()}},
+                {"dateAt": None},
+            ],
+        },
+        EXPENSE_SORT_SPEC,
+    ),
+    ("expense", {"userId": ObjectId()}, dict(CHANGES_SORT)),
+    (
+        "expense",
+        {"userId": ObjectId(), "$or": [{"version": {"$gt": 7}}, {"version": 7, "_id": {"$gt": ObjectId()}}]},
+        dict(CHANGES_SORT),
+    ),
+    (
+        "expense_tombstone",
+        {"userId": ObjectId(), "$or": [{"version": {"$gt": 7}}, {"version": 7, "_id": {"$gt": ObjectId()}}]},
+        dict(CHANGES_SORT),
+    ),
+    ("expense", {"groupId": ObjectId(), "dateAt": {"$gte": _JAN, "$lt": _NEXT_JAN}}, EXPENSE_SORT_SPEC),
+    ("group", {"users": ObjectId(), "deletedAt": None}, None),
+    ("group", {"inviteCode": "invite", "deletedAt": None}, None),
+    ("category", {"userId": ObjectId(), "name": "Groceries"}, None),
+    ("category", {"userId": {"$exists": False}}, None),
+    ("user_profile", {"userId": ObjectId()}, None),
+    ("category_job", {"status": "running", "leaseUntil": {"$lt": 0}}, None),
+    ("expense_rollup", {"userId": ObjectId(), "month": {"$gte": "2025-01"}, "count": {"$gt": 0}}, None),
+]
+
+
+# Options ensure_indexes() keeps in step with the declarations.
+_OPTIONS = ("expireAfterSeconds", "partialFilterExpression")
+
+
+def _key_of(spec: dict) -> list[tuple[str, int]]:
+    return list(spec["key"].items()) if isinstance(spec["key"], dict) else list(spec["key"])
+
+
+async def _update_index(db: AsyncIOMotorDatabase, collection: str, model: IndexModel, current: dict) -> None:
+    """Bring an index with the declared key up to date with its declared options."""
+    spec = model.document
+    if current.get("partialFilterExpression") != spec.get("partialFilterExpression"):
+        # A filter cannot be changed in place.
+        await db[collection].drop_index(spec["name"])
+        await db[collection].create_indexes([model])
+    elif current.get("expireAfterSeconds") != spec.get("expireAfterSeconds"):
+        await db.command(
+            "collMod", collection, index={"name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]}
+        )
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase, indexes: dict[str, list[IndexModel]] = INDEXES) -> dict:
+    """Create missing indexes, update the options of existing ones, and report key or unique conflicts.
+
+    Indexes whose key or uniqueness differs are never dropped; those conflicts have to be resolved
+    by hand. A changed TTL is applied with ``collMod``; a changed partial filter drops and rebuilds.
+    """
+    report: dict[str, list[str]] = {"created": [], "updated": [], "existing": [], "conflicts": []}
+    for collection, models in indexes.items():
+        existing = await db[collection].index_information()
+        for model in models:
+            spec = model.document
+            qualified = f"{collection}.{spec['name']}"
+            current = existing.get(spec["name"])
+            if current is None:
+                try:
+                    await db[collection].create_indexes([model])
+                except OperationFailure as exc:
+                    report["conflicts"].append(f"{qualified}: {exc}")
+                    continue
+                report["created"].append(qualified)
+            elif _key_of(current) != _key_of(spec) or bool(current.get("unique")) != bool(spec.get("unique")):
+                report["conflicts"].append(f"{qualified}: exists with a different definition {current}")
+            elif any(current.get(option) != spec.get(option) for option in _OPTIONS):
+                try:
+                    await _update_index(db, collection, model, current)
+                except OperationFailure as exc:
+                    report["conflicts"].append(f"{qualified}: {exc}")
+                    continue
+                report["updated"].append(qualified)
+            else:
+                report["existing"].append(qualified)
+    return report
+
+
+def _stages(plan: dict) -> list[str]:
+    stages = [plan.get("stage", "")]
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages += _stages(plan[child_key])
+    for child in plan.get("inputStages", []):
+        stages += _stages(child)
+    return stages
+
+
+async def find_collection_scans(
+    db: AsyncIOMotorDatabase, shapes: list[tuple[str, dict, dict | None]] = QUERY_SHAPES
+) -> list[str]:
+    """Explain every declared query shape and return the ones whose winning plan is a COLLSCAN."""
+    scans = []
+    for collection, query_filter, sort in shapes:
+        command: dict = {"find": collection, "filter": query_filter}
+        if sort:
+            command["sort"] = sort
+        explained = await db.command("explain", command, verbosity="queryPlanner")
+        if "COLLSCAN" in _stages(explained["queryPlanner"]["winningPlan"]):
+            scans.append(f"{collection} {query_filter}" + (f" sort={sort}" if sort else ""))
+    return scans
+
+
+async def _main(check_plans: bool) -> int:
+    try:
+        db = get_db()
+        report = await ensure_indexes(db)
+        for status, names in report.items():
+            for name in names:
+                print(f"{status}: {name}")
+        scans = await find_collection_scans(db) if check_plans else []
+        for scan in scans:
+            print(f"collection scan: {scan}")
+    finally:
+        close_db()
+    return 1 if report["conflicts"] or scans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and verify expense-service indexes.")
+    parser.add_argument("--check-plans", action="store_true", help="explain known query shapes and flag COLLSCANs")
+    sys.exit(asyncio.run(_main(parser.parse_args().check_plans)))
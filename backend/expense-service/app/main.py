@@ -1,17 +1,108 @@
+import logging
+import os
 import time
-from typing import Annotated, Any
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from typing import Annotated, Any, Literal
 
 from bson import ObjectId
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo.database import Database
+from fastapi.responses import FileResponse, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 
-from .auth import TokenData, get_current_user
-from .db import get_db
-from .models import Category, Expense, ExpenseCreate, UserProfile, UserProfileUpdate
+from .auth import TokenData, get_current_user, require_admin
+from .bulk import DUPLICATE_KEY, import_expenses, parse_csv_rows
+from .categories import (
+    cancel_rename_jobs,
+    category_cache,
+    delete_category,
+    get_rename_job,
+    rename_category,
+    start_rename_jobs,
+)
+from .db import close_db, connect_db, get_db
+from .etag import (
+    CACHE_CONTROL,
+    NotModified,
+    cache_headers,
+    data_version,
+    data_version_etag,
+    expense_etag,
+    touch_user,
+    touch_users,
+    version_etag,
+    version_precondition,
+)
+from .export import EXPORT_BATCH_SIZE, stream_csv, stream_ndjson
+from .groups import create_group, group_member, join_group, leave_group, list_groups, resolve_group_id
+from .http_client import close_http_client
+from .indexes import ensure_indexes
+from .log import RequestIdMiddleware, configure_logging, shutdown_logging
+from .metrics import MetricsMiddleware, render_metrics
+from .models import (
+    BulkImportRequest,
+    BulkImportResponse,
+    Category,
+    CategoryJob,
+    Expense,
+    ExpenseCreate,
+    ExpenseSummary,
+    Group,
+    GroupCreate,
+    GroupJoin,
+    UserProfile,
+    UserProfileBatch,
+    UserProfileUpdate,
+)
+from .profiling import ProfilingMiddleware, list_profiles, profile_path
+from .query import EXPENSE_SORT, ExpenseFilters, apply_cursor, encode_cursor, expense_to_dict, parse_fields
+from .responses import MongoJSONResponse
+from .rollup import ROLLUP_COLLECTION, apply_rollup
+from .summary import (
+    SUMMARY_DIMENSIONS,
+    build_rollup_summary_pipeline,
+    build_summary_pipeline,
+    can_use_rollup,
+    parse_group_by,
+    to_summary,
+)
+from .sync import get_changes, next_version, now_ms, record_deletes
+
+
+ENSURE_INDEXES = os.getenv("MONGODB_ENSURE_INDEXES", "1") == "1"
+EXPENSE_PAGE_SIZE = int(os.getenv("EXPENSE_PAGE_SIZE", "500"))
+EXPENSE_PAGE_SIZE_MAX = int(os.getenv("EXPENSE_PAGE_SIZE_MAX", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    configure_logging()
+    connect_db()
+    if ENSURE_INDEXES:
+        try:
+            report = await ensure_indexes(get_db())
+            for updated in report["updated"]:
+                logger.info("Index options updated: %s", updated)
+            for conflict in report["conflicts"]:
+                logger.warning("Index conflict: %s", conflict)
+        except PyMongoError:
+            logger.exception("Failed to ensure indexes")
+    await category_cache.start()
+    start_rename_jobs(get_db())
+    yield
+    await cancel_rename_jobs()
+    await category_cache.close()
+    await close_http_client()
+    close_db()
+    shutdown_logging()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,190 +110,388 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Request-ID", "X-Profile-Id", "ETag"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(_: Request, exc: NotModified) -> Response:
+    return Response(status_code=304, headers={"ETag": exc.etag, "Cache-Control": CACHE_CONTROL})
 
 
 @app.post("/expense")
-def create_expense(
+async def create_expense(
     expense: ExpenseCreate,
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
 ) -> Expense:
-    expense_dict = expense.model_dump()
+    expense_dict = expense.to_document()
     expense_dict["userId"] = current_user.userId
-    expense_dict["groupId"] = None
-    expense_dict["epoch"] = int(time.time())
-    result = db.expense.insert_one(expense_dict)
-    expense_dict["id"] = str(result.inserted_id)
-    expense_dict["userId"] = str(expense_dict["userId"])
-    return Expense(**expense_dict)
+    expense_dict["groupId"] = await resolve_group_id(db, current_user.userId, expense.groupId)
+    expense_dict["version"] = await next_version(db, current_user.userId)
+    expense_dict["epoch"] = now_ms()
+    result = await db.expense.insert_one(expense_dict)
+    await apply_rollup(db, added=[expense_dict])
+    expense_dict["_id"] = result.inserted_id
+    return Expense(**expense_to_dict(expense_dict))
+
+
+@app.post("/expense/bulk")
+async def create_expenses_bulk(
+    request: BulkImportRequest,
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    idempotency_key: Annotated[str | None, Header()] = None,
+) -> BulkImportResponse:
+    """Import many expenses at once; each row gets its own result instead of failing the whole batch."""
+    return await import_expenses(db, current_user.userId, request.items, idempotency_key)
+
+
+@app.post("/expense/bulk/csv")
+async def create_expenses_bulk_csv(
+    request: Request,
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    idempotency_key: Annotated[str | None, Header()] = None,
+) -> BulkImportResponse:
+    """Same as /expense/bulk, with the rows sent as a ``text/csv`` request body."""
+    items = parse_csv_rows(await request.body())
+    return await import_expenses(db, current_user.userId, items, idempotency_key)
 
 
 @app.get("/expense")
-def get_expenses(
-    current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
-    date_gte: str | None = None,
-    date_lte: str | None = None,
-    category: str | None = None,
-    type: str | None = None,
-) -> list[Expense]:
-    query: dict = {"userId": current_user.userId}
-    if date_gte:
-        query["date"] = query.get("date", {})
-        query["date"].update({"$gte": date_gte})
-    if date_lte:
-        query["date"] = query.get("date", {})
-        query["date"].update({"$lte": date_lte})
-    if category:
-        query["category"] = category
-    if type:
-        query["type"] = type
-    expenses = db.expense.find(query)
-    return [
-        Expense(
-            id=str(exp["_id"]),
-            userId=str(exp["userId"]),
-            groupId=exp.get("groupId"),
-            amount=exp["amount"],
-            category=exp["category"],
-            date=exp["date"],
-            description=exp.get("description"),
-            type=exp["type"],
-            currency=exp["currency"],
-            epoch=exp["epoch"],
+async def get_expenses(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    filters: Annotated[ExpenseFilters, Depends()],
+    etag: Annotated[str | None, Depends(data_version_etag)],
+    limit: Annotated[int, Query(ge=1, le=EXPENSE_PAGE_SIZE_MAX)] = EXPENSE_PAGE_SIZE,
+    cursor: str | None = None,
+    fields: str | None = None,
+) -> MongoJSONResponse:
+    """Return one page of expenses, newest first.
+
+    When more rows exist, the ``X-Next-Cursor`` response header carries the ``cursor`` for the next page.
+    The rows are serialized by orjson as built, without a second pass through pydantic.
+    """
+    query = filters.to_query(current_user.userId)
+    if cursor:
+        query = apply_cursor(query, cursor)
+    projection = parse_fields(fields)
+    # One extra row tells us whether there is a next page without a count query.
+    docs = await db.expense.find(query, projection).sort(EXPENSE_SORT).limit(limit + 1).to_list(limit + 1)
+    headers = cache_headers(etag)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return MongoJSONResponse([expense_to_dict(doc, projection) for doc in docs], headers=headers)
+
+
+@app.get("/expense/export")
+async def export_expenses(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    filters: Annotated[ExpenseFilters, Depends()],
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+) -> StreamingResponse:
+    """Stream every matching expense straight from the cursor, so memory use does not grow with history."""
+    cursor = db.expense.find(filters.to_query(current_user.userId)).sort(EXPENSE_SORT).batch_size(EXPORT_BATCH_SIZE)
+    if export_format == "csv":
+        return StreamingResponse(
+            stream_csv(cursor),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="expenses.csv"'},
         )
-        for exp in expenses
-    ]
+    return StreamingResponse(stream_ndjson(cursor), media_type="application/x-ndjson")
+
+
+@app.get("/expense/changes")
+async def get_expense_changes(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    since: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=EXPENSE_PAGE_SIZE_MAX)] = EXPENSE_PAGE_SIZE,
+) -> MongoJSONResponse:
+    """Expenses changed and ids deleted after ``since``, the ``next`` cursor of the previous sync.
+
+    Without ``since`` every expense is returned, as the starting point of a local cache. Keep
+    calling with ``next`` while ``hasMore`` is true; 410 means the cursor is too old to be trusted.
+    """
+    return MongoJSONResponse(await get_changes(db, current_user.userId, since, limit))
+
+
+@app.get("/expense/summary")
+async def get_expense_summary(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    filters: Annotated[ExpenseFilters, Depends()],
+    etag: Annotated[str | None, Depends(data_version_etag)],
+    response: Response,
+    group_by: str = ",".join(SUMMARY_DIMENSIONS),
+) -> list[ExpenseSummary]:
+    """Totals per month/category/type/currency, computed by MongoDB instead of the client.
+
+    Whole-month requests are served from the expense_rollup collection; ``date_gte``/``date_lte``
+    given as ``YYYY-MM`` select whole months, any other date bound aggregates the raw expenses.
+    """
+    dimensions = parse_group_by(group_by)
+    response.headers.update(cache_headers(etag))
+    if can_use_rollup(filters):
+        pipeline = build_rollup_summary_pipeline(current_user.userId, filters, dimensions)
+        rows = db[ROLLUP_COLLECTION].aggregate(pipeline)
+    else:
+        rows = db.expense.aggregate(build_summary_pipeline(filters.to_query(current_user.userId), dimensions))
+    return [to_summary(row) async for row in rows]
 
 
 @app.put("/expense/{expense_id}")
-def update_expense(
+async def update_expense(
     expense_id: str,
     expense: ExpenseCreate,
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> Expense:
-    expense_dict = expense.model_dump()
-    expense_dict["userId"] = current_user.userId
-    expense_dict["groupId"] = None
-    expense_dict["epoch"] = int(time.time() * 1000)
-    result = db.expense.update_one({"_id": ObjectId(expense_id), "userId": current_user.userId}, {"$set": expense_dict})
-    if not result.modified_count:
+    """Replace an expense with one find_one_and_update, next to the version counter and rollup writes.
+
+    With ``If-Match`` set to the expense's ETag (its ``version``) the update only applies if nobody
+    changed the expense since; otherwise the response is 412 and the client should reload it.
+    """
+    if not ObjectId.is_valid(expense_id):
         raise HTTPException(status_code=404, detail="Expense not found or not owned by user")
-    updated_expense = db.expense.find_one({"_id": ObjectId(expense_id)}) or {}
-    return Expense(
-        id=str(updated_expense.get("_id")),
-        userId=str(updated_expense["userId"]),
-        groupId=updated_expense.get("groupId"),
-        amount=float(updated_expense.get("amount", 0.0)),
-        category=updated_expense.get("category", ""),
-        date=updated_expense.get("date", ""),
-        description=updated_expense.get("description"),
-        type=updated_expense.get("type", ""),
-        currency=updated_expense.get("currency", "USD"),
-        epoch=int(updated_expense.get("epoch", int(time.time() * 1000))),
+    query = {"_id": ObjectId(expense_id), "userId": current_user.userId}
+    precondition = version_precondition(if_match)
+    expense_dict = expense.to_document()
+    expense_dict["userId"] = current_user.userId
+    expense_dict["groupId"] = await resolve_group_id(db, current_user.userId, expense.groupId)
+    expense_dict["version"] = await next_version(db, current_user.userId)
+    expense_dict["epoch"] = now_ms()
+    # BEFORE feeds the rollup delta; the stored document is exactly previous + $set, so no read-back.
+    previous = await db.expense.find_one_and_update(
+        {**query, **precondition}, {"$set": expense_dict}, return_document=ReturnDocument.BEFORE
     )
+    if previous is None:
+        if precondition and await db.expense.find_one(query, {"_id": 1}):
+            raise HTTPException(status_code=412, detail="Expense was changed by someone else")
+        raise HTTPException(status_code=404, detail="Expense not found or not owned by user")
+    updated = {**previous, **expense_dict}
+    await apply_rollup(db, removed=[previous], added=[updated])
+    response.headers["ETag"] = expense_etag(updated)
+    return Expense(**expense_to_dict(updated))
 
 
 @app.delete("/expense/{expense_id}")
-def delete_expense(
+async def delete_expense(
     expense_id: str,
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
 ) -> dict[str, str]:
-    result = db.expense.delete_one({"_id": ObjectId(expense_id), "userId": current_user.userId})
-    if result.deleted_count == 0:
+    deleted = await db.expense.find_one_and_delete({"_id": ObjectId(expense_id), "userId": current_user.userId})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Expense not found or not owned by user")
+    await apply_rollup(db, removed=[deleted])
+    await record_deletes(db, current_user.userId, [deleted["_id"]])
     return {"message": "Expense deleted successfully"}
 
 
+@app.post("/groups")
+async def create_group_endpoint(
+    group: GroupCreate,
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> Group:
+    """Create a group ledger; share its ``inviteCode`` so others can join."""
+    return await create_group(db, current_user.userId, group.name)
+
+
+@app.get("/groups")
+async def list_groups_endpoint(
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> list[Group]:
+    return await list_groups(db, current_user.userId)
+
+
+@app.post("/groups/join")
+async def join_group_endpoint(
+    join: GroupJoin,
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> Group:
+    return await join_group(db, current_user.userId, join.inviteCode)
+
+
+@app.post("/groups/{group_id}/leave")
+async def leave_group_endpoint(
+    group_id: Annotated[ObjectId, Depends(group_member)],
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> dict[str, str]:
+    await leave_group(db, current_user.userId, group_id)
+    return {"message": "Left the group"}
+
+
+@app.get("/groups/{group_id}/expense")
+async def get_group_expenses(
+    group_id: Annotated[ObjectId, Depends(group_member)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    filters: Annotated[ExpenseFilters, Depends()],
+    limit: Annotated[int, Query(ge=1, le=EXPENSE_PAGE_SIZE_MAX)] = EXPENSE_PAGE_SIZE,
+    cursor: str | None = None,
+    fields: str | None = None,
+) -> MongoJSONResponse:
+    """One page of the group's expenses from every member, newest first; paged like ``GET /expense``."""
+    query = filters.to_group_query(group_id)
+    if cursor:
+        query = apply_cursor(query, cursor)
+    projection = parse_fields(fields)
+    docs = await db.expense.find(query, projection).sort(EXPENSE_SORT).limit(limit + 1).to_list(limit + 1)
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1])
+    return MongoJSONResponse([expense_to_dict(doc, projection) for doc in docs], headers=headers)
+
+
+@app.get("/groups/{group_id}/expense/summary")
+async def get_group_expense_summary(
+    group_id: Annotated[ObjectId, Depends(group_member)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    filters: Annotated[ExpenseFilters, Depends()],
+    group_by: str = ",".join(SUMMARY_DIMENSIONS),
+) -> list[ExpenseSummary]:
+    """Totals of the group's expenses; rollups are per user, so this aggregates the raw expenses."""
+    dimensions = parse_group_by(group_by)
+    rows = db.expense.aggregate(build_summary_pipeline(filters.to_group_query(group_id), dimensions))
+    return [to_summary(row) async for row in rows]
+
+
 @app.post("/categories")
-def create_category(
+async def create_category(
     category: Category,
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
     current_user: Annotated[TokenData, Depends(get_current_user)],
 ) -> Category:
-    existing = db.category.find_one({"name": category.name, "userId": current_user.userId})
-    if existing:
-        raise HTTPException(status_code=400, detail="Category already exists for this user")
-    db.category.insert_one({"name": category.name, "userId": current_user.userId})
+    try:
+        await db.category.insert_one({"name": category.name, "userId": current_user.userId})
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail="Category already exists for this user") from e
+    await category_cache.invalidate(current_user.userId)
+    await touch_user(db, current_user.userId)
     return category
 
 
 @app.get("/categories")
-def list_categories(
-    db: Annotated[Database, Depends(get_db)],
+async def list_categories(
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
     current_user: Annotated[TokenData, Depends(get_current_user)],
     show_universal: bool = False,
-) -> list[dict]:
-    user_query = {"userId": current_user.userId}
-    user_categories = db.category.find(user_query).to_list(None)
-    universal_categories = []
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> MongoJSONResponse:
+    version, version_at = await data_version(db, current_user.userId)
     if show_universal:
-        universal_query = {"userId": {"$exists": False}}
-        universal_categories = db.category.find(universal_query).to_list(None)
-    all_categories = user_categories + universal_categories
-    return [
-        {"name": cat["name"], "userId": str(cat.get("userId")) if cat.get("userId") else None} for cat in all_categories
-    ]
+        # Universal categories are not versioned, so that list cannot be revalidated with an ETag.
+        categories = await category_cache.user_categories(db, current_user.userId, version)
+        return MongoJSONResponse(categories + await category_cache.universal_categories(db))
+    etag = version_etag(current_user.userId, version, version_at, if_none_match)
+    categories = await category_cache.user_categories(db, current_user.userId, version)
+    return MongoJSONResponse(categories, headers=cache_headers(etag))
 
 
 @app.put("/categories/{name}")
-def update_category(
+async def update_category(
     name: str,
     category: Category,
-    db: Annotated[Database, Depends(get_db)],
+    response: Response,
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
     current_user: Annotated[TokenData, Depends(get_current_user)],
-) -> Category:
-    existing = db.category.find_one({"name": name, "userId": current_user.userId})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Category not found or not owned by user")
-    if db.category.find_one({"name": category.name, "userId": current_user.userId}):
-        raise HTTPException(status_code=400, detail="New category name already exists")
-    db.category.update_one({"name": name, "userId": current_user.userId}, {"$set": {"name": category.name}})
-    db.expense.update_many({"category": name, "userId": current_user.userId}, {"$set": {"category": category.name}})
-    return category
+) -> Category | CategoryJob:
+    """Rename a category and re-tag its expenses.
+
+    Large renames continue in the background: the response is 202 with a job to poll at
+    ``GET /categories/jobs/{id}``.
+    """
+    job = await rename_category(db, current_user.userId, name, category.name)
+    if job is None:
+        return category
+    response.status_code = 202
+    return job
+
+
+@app.get("/categories/jobs/{job_id}")
+async def get_category_job(
+    job_id: str,
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    current_user: Annotated[TokenData, Depends(get_current_user)],
+) -> CategoryJob:
+    return await get_rename_job(db, current_user.userId, job_id)
 
 
 @app.delete("/categories/{name}")
-def delete_category(
+async def delete_category_endpoint(
     name: str,
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
     current_user: Annotated[TokenData, Depends(get_current_user)],
 ) -> dict[str, str]:
-    existing = db.category.find_one({"name": name, "userId": current_user.userId})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Category not found or not owned by user")
-    if db.expense.find_one({"category": name, "userId": current_user.userId}):
-        raise HTTPException(status_code=400, detail="Cannot delete category used in records")
-    db.category.delete_one({"name": name, "userId": current_user.userId})
+    await delete_category(db, current_user.userId, name)
     return {"message": "Category deleted successfully"}
 
 
 @app.post("/user/profile")
-def create_user_profile(
+async def create_user_profile(
     user_data: UserProfile,
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
 ) -> dict[str, str]:
-    existing = db.user_profile.find_one({"userId": user_data.userId})
-    if existing:
-        raise HTTPException(status_code=400, detail="User profile already exists")
     profile = user_data.model_dump()
     profile["userId"] = user_data.userId
     profile["updatedAt"] = int(time.time() * 1000)
-    db.user_profile.insert_one(profile)
+    try:
+        await db.user_profile.insert_one(profile)
+    except DuplicateKeyError as e:
+        raise HTTPException(status_code=400, detail="User profile already exists") from e
+    await touch_user(db, user_data.userId)
     return {"message": "User profile created successfully"}
 
 
+@app.post("/user/profiles")
+async def create_user_profiles(
+    batch: UserProfileBatch,
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+) -> dict[str, list[str]]:
+    """Create many profiles in one insert (batch approvals in auth-service); existing ones are left as they are."""
+    updated_at = int(time.time() * 1000)
+    profiles = [{**profile.model_dump(), "updatedAt": updated_at} for profile in batch.profiles]
+    existing: set[int] = set()
+    if profiles:
+        try:
+            await db.user_profile.insert_many(profiles, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+            existing = {error["index"] for error in errors}
+    await touch_users(db, [profile["userId"] for index, profile in enumerate(profiles) if index not in existing])
+    return {
+        "created": [str(profile["userId"]) for index, profile in enumerate(profiles) if index not in existing],
+        "existing": [str(profiles[index]["userId"]) for index in sorted(existing)],
+    }
+
+
 @app.get("/user")
-def get_user(
+async def get_user(
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
+    etag: Annotated[str | None, Depends(data_version_etag)],
+    response: Response,
 ) -> dict[Any, Any]:
-    profile = db.user_profile.find_one({"userId": current_user.userId})
+    profile = await db.user_profile.find_one({"userId": current_user.userId})
     if not profile:
         raise HTTPException(status_code=404, detail="User profile not found")
+    response.headers.update(cache_headers(etag))
     # Fetch email from auth-service using TokenData
     email = current_user.email
     profile_dict = {}
@@ -217,21 +506,42 @@ def get_user(
 
 
 @app.put("/user")
-def update_user(
+async def update_user(
     update_data: UserProfileUpdate,
     current_user: Annotated[TokenData, Depends(get_current_user)],
-    db: Annotated[Database, Depends(get_db)],
+    db: Annotated[AsyncIOMotorDatabase, Depends(get_db)],
 ) -> dict[str, str]:
     update_fields = update_data.model_dump(exclude_unset=True)
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
     update_fields["updatedAt"] = int(time.time() * 1000)
-    result = db.user_profile.update_one({"userId": current_user.userId}, {"$set": update_fields})
+    result = await db.user_profile.update_one({"userId": current_user.userId}, {"$set": update_fields})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User profile not found")
+    await touch_user(db, current_user.userId)
     return {"message": "User profile updated successfully"}
 
 
+@app.get("/admin/profiles")
+async def list_profiles_endpoint(_: Annotated[TokenData, Depends(require_admin)]) -> list[dict]:
+    """Stored request profiles, newest first; request one with ``X-Profile: 1`` as an admin."""
+    return list_profiles()
+
+
+@app.get("/admin/profiles/{name}")
+async def download_profile(name: str, _: Annotated[TokenData, Depends(require_admin)]) -> FileResponse:
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=name)
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    content, media_type = render_metrics()
+    return Response(content, media_type=media_type)
+
+
 @app.get("/health")
 def health_check() -> dict[str, str]:
     return {"status": "Expense service is up"}
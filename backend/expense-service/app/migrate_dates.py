@@ -0,0 +1,99 @@
+"""Backfill ``dateAt`` on expenses written before it existed.
+
+Run ``python -m app.migrate_dates`` from ``expense-service/``. Expenses are read in ``_id`` order,
+``--batch-size`` at a time, and each batch is written with one ``bulk_write``; only expenses still
+missing ``dateAt`` are selected, so an interrupted run is resumed by running it again. Each update
+is guarded by the ``date`` it was parsed from, so an expense edited mid-run keeps the ``dateAt``
+its edit wrote. Expenses whose ``date`` does not parse are listed and left alone.
+
+Once every expense has ``dateAt``, ``--drop-string-indexes`` removes the old ``date`` indexes.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from .dates import parse_expense_date
+from .db import close_db, get_db
+
+
+STRING_DATE_INDEXES = ("userId_date", "userId_category_date", "userId_type_date")
+INDEX_NOT_FOUND = 27
+
+
+async def backfill_dates(
+    db: AsyncIOMotorDatabase, batch_size: int = 1000, user_id: ObjectId | None = None
+) -> tuple[int, list[ObjectId]]:
+    """Set ``dateAt`` on every expense missing it; returns the number updated and the unparsable ids."""
+    query: dict = {"dateAt": {"$exists": False}}
+    if user_id is not None:
+        query["userId"] = user_id
+    updated, invalid = 0, []
+    last_id = None
+    while True:
+        batch_query = {**query, "_id": {"$gt": last_id}} if last_id else query
+        batch = await db.expense.find(batch_query, {"date": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return updated, invalid
+        last_id = batch[-1]["_id"]
+        operations = []
+        for doc in batch:
+            try:
+                date_at = parse_expense_date(doc["date"])
+            except (KeyError, TypeError, ValueError):
+                invalid.append(doc["_id"])
+                continue
+            operations.append(
+                UpdateOne(
+                    {"_id": doc["_id"], "date": doc["date"], "dateAt": {"$exists": False}},
+                    {"$set": {"dateAt": date_at}},
+                )
+            )
+        if operations:
+            result = await db.expense.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+
+async def drop_string_date_indexes(db: AsyncIOMotorDatabase) -> list[str]:
+    dropped = []
+    for name in STRING_DATE_INDEXES:
+        try:
+            await db.expense.drop_index(name)
+        except OperationFailure as exc:
+            if exc.code != INDEX_NOT_FOUND:
+                raise
+            continue
+        dropped.append(name)
+    return dropped
+
+
+async def _main(batch_size: int, user_id: str | None, drop_string_indexes: bool) -> int:
+    try:
+        db = get_db()
+        updated, invalid = await backfill_dates(db, batch_size, ObjectId(user_id) if user_id else None)
+        for expense_id in invalid:
+            print(f"unparsable date: expense {expense_id}")
+        print(f"{updated} expenses backfilled, {len(invalid)} skipped")
+        if drop_string_indexes:
+            if invalid or await db.expense.find_one({"dateAt": {"$exists": False}}, {"_id": 1}):
+                print("Not dropping the date indexes: some expenses still have no dateAt")
+                return 1
+            for name in await drop_string_date_indexes(db):
+                print(f"dropped expense.{name}")
+        return 1 if invalid else 0
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill expense.dateAt from the date strings.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="expenses per bulk_write")
+    parser.add_argument("--user-id", help="only this user's expenses")
+    parser.add_argument("--drop-string-indexes", action="store_true", help="drop the old date indexes when done")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args.batch_size, args.user_id, args.drop_string_indexes)))
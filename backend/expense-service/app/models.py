@@ -1,8 +1,10 @@
-from typing import ClassVar
+from typing import Any, ClassVar, Literal
 
 from bson import ObjectId
 from pydantic import BaseModel, Field, validator
 
+from .dates import parse_expense_date
+
 
 class ExpenseCreate(BaseModel):
     amount: float
@@ -11,12 +13,64 @@ class ExpenseCreate(BaseModel):
     description: str | None = None
     type: str
     currency: str = "USD"
+    groupId: str | None = None
+
+    @validator("date")
+    @classmethod
+    def validate_date(cls, value: str) -> str:
+        try:
+            parse_expense_date(value)
+        except ValueError:
+            raise ValueError("date must be YYYY-MM-DD or an ISO-8601 date-time") from None
+        return value.strip()
+
+    @validator("groupId")
+    @classmethod
+    def validate_group_id(cls, value: str | None) -> str | None:
+        if value is not None and not ObjectId.is_valid(value):
+            raise ValueError("groupId must be a valid ObjectId string")
+        return value
+
+    def to_document(self) -> dict[str, Any]:
+        """The stored fields, with ``dateAt`` derived from ``date`` and ``groupId`` as an ObjectId."""
+        return {
+            **self.model_dump(),
+            "dateAt": parse_expense_date(self.date),
+            "groupId": ObjectId(self.groupId) if self.groupId else None,
+        }
 
 
 class Category(BaseModel):
     name: str
 
 
+class Group(BaseModel):
+    id: str
+    name: str
+    owner: str
+    users: list[str]
+    inviteCode: str
+    createdAt: int
+
+
+class GroupCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+
+
+class GroupJoin(BaseModel):
+    inviteCode: str
+
+
+class CategoryJob(BaseModel):
+    id: str
+    oldName: str
+    newName: str
+    status: Literal["running", "done", "failed"]
+    total: int
+    done: int
+    error: str | None = None
+
+
 class Expense(BaseModel):
     id: str
     userId: str
@@ -28,11 +82,39 @@ class Expense(BaseModel):
     type: str
     currency: str
     epoch: int
+    version: int | None = None
 
     class Config:
         json_encoders: ClassVar[dict] = {ObjectId: str}
 
 
+class ExpenseSummary(BaseModel):
+    month: str | None = None
+    category: str | None = None
+    type: str | None = None
+    currency: str | None = None
+    total: float
+    count: int
+
+
+class BulkRowResult(BaseModel):
+    row: int
+    status: Literal["created", "duplicate", "invalid", "failed"]
+    id: str | None = None
+    error: str | None = None
+
+
+class BulkImportRequest(BaseModel):
+    items: list[dict[str, Any]]
+
+
+class BulkImportResponse(BaseModel):
+    created: int
+    duplicates: int
+    errors: int
+    results: list[BulkRowResult]
+
+
 class UserProfile(BaseModel):
     userId: ObjectId = Field(...)
     name: str | None = None
@@ -59,6 +141,10 @@ class UserProfile(BaseModel):
         json_encoders: ClassVar[dict] = {ObjectId: str}
 
 
+class UserProfileBatch(BaseModel):
+    profiles: list[UserProfile] = Field(..., max_length=1000)
+
+
 class UserProfileUpdate(BaseModel):
     name: str | None = None
     image: str | None = None
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Any
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+
+from .dates import date_range
+from .models import Expense
+
+
+# Stable listing order, served by the userId_*_dateAt indexes.
+EXPENSE_SORT = [("dateAt", -1), ("_id", -1)]
+EXPENSE_FIELDS = frozenset(Expense.model_fields) - {"id"}
+
+
+@dataclass
+class ExpenseFilters:
+    """Query parameters shared by the endpoints that read a user's expenses."""
+
+    date_gte: str | None = None
+    date_lte: str | None = None
+    category: str | None = None
+    type: str | None = None
+
+    def to_query(self, user_id: ObjectId) -> dict:
+        return self._apply({"userId": user_id})
+
+    def to_group_query(self, group_id: ObjectId) -> dict:
+        return self._apply({"groupId": group_id})
+
+    def _apply(self, query: dict) -> dict:
+        if self.date_gte or self.date_lte:
+            query["dateAt"] = date_range(self.date_gte, self.date_lte)
+        if self.category:
+            query["category"] = self.category
+        if self.type:
+            query["type"] = self.type
+        return query
+
+
+def encode_cursor(doc: dict) -> str:
+    date_at = doc.get("dateAt")
+    millis = int(date_at.replace(tzinfo=UTC).timestamp() * 1000) if date_at else None
+    raw = json.dumps([millis, str(doc["_id"])], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        millis, expense_id = json.loads(raw)
+        date_at = None if millis is None else datetime.fromtimestamp(int(millis) / 1000, UTC).replace(tzinfo=None)
+        return date_at, ObjectId(expense_id)
+    except (binascii.Error, ValueError, TypeError, OverflowError, InvalidId) as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def apply_cursor(query: dict, cursor: str) -> dict:
+    """Restrict ``query`` to the rows that sort after ``cursor`` in EXPENSE_SORT order.
+
+    Expenses not backfilled with ``dateAt`` yet sort last, as null.
+    """
+    date_at, expense_id = decode_cursor(cursor)
+    if date_at is None:
+        return {**query, "dateAt": None, "_id": {"$lt": expense_id}}
+    after = [{"dateAt": {"$lt": date_at}}, {"dateAt": date_at, "_id": {"$lt": expense_id}}]
+    if "dateAt" not in query:
+        after.append({"dateAt": None})
+    return {**query, "$or": after}
+
+
+def parse_fields(fields: str | None) -> dict | None:
+    """Turn ``fields=amount,category`` into a Mongo projection, or None for every field."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - EXPENSE_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    # dateAt is always needed to build the next cursor.
+    return dict.fromkeys(requested | {"dateAt"}, 1)
+
+
+def expense_to_dict(doc: dict, projection: dict | None = None) -> dict[str, Any]:
+    expense = {
+        "id": str(doc["_id"]),
+        "userId": str(doc["userId"]) if "userId" in doc else None,
+        "groupId": str(doc["groupId"]) if doc.get("groupId") else None,
+        "amount": doc.get("amount"),
+        "category": doc.get("category"),
+        "date": doc.get("date"),
+        "description": doc.get("description"),
+        "type": doc.get("type"),
+        "currency": doc.get("currency"),
+        "epoch": doc.get("epoch"),
+        "version": doc.get("version"),
+    }
+    if projection is None:
+        return expense
+    return {key: value for key, value in expense.items() if key == "id" or key in projection}
@@ -0,0 +1,185 @@
+"""Per-user monthly rollups of expenses, kept in step with every expense write.
+
+Each ``expense_rollup`` document holds the total and count for one
+(userId, month, category, type, currency) key. Writes adjust it with ``$inc``,
+so summary reads cost O(months) instead of O(expenses).
+
+Run ``python -m app.rollup verify`` from ``expense-service/`` to compare the
+rollups with the raw expenses, and ``python -m app.rollup rebuild`` to recompute them.
+Both accept ``--user-id`` to limit the work to one user.
+"""
+
+import argparse
+import asyncio
+import sys
+from collections.abc import Iterable
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import DeleteMany, UpdateOne
+
+from .db import close_db, get_db
+
+
+ROLLUP_COLLECTION = "expense_rollup"
+ROLLUP_KEY_FIELDS = ("userId", "month", "category", "type", "currency")
+
+# Must agree with rollup_key(); $merge rejects null "on" fields.
+_KEY_EXPRESSIONS = {
+    "userId": "$userId",
+    "month": {
+        "$ifNull": [
+            {"$dateToString": {"format": "%Y-%m", "date": "$dateAt"}},
+            {"$substrCP": [{"$ifNull": ["$date", ""]}, 0, 7]},
+        ]
+    },
+    "category": {"$ifNull": ["$category", ""]},
+    "type": {"$ifNull": ["$type", ""]},
+    "currency": {"$ifNull": ["$currency", "USD"]},
+}
+
+
+def rollup_key(expense: dict) -> dict:
+    return {
+        "userId": expense["userId"],
+        # Expenses not backfilled with dateAt yet fall back to the prefix of their date string.
+        "month": expense["dateAt"].strftime("%Y-%m") if expense.get("dateAt") else (expense.get("date") or "")[:7],
+        "category": expense.get("category") or "",
+        "type": expense.get("type") or "",
+        "currency": expense.get("currency") or "USD",
+    }
+
+
+def rollup_updates(removed: Iterable[dict] = (), added: Iterable[dict] = ()) -> list[UpdateOne]:
+    """Net ``$inc`` updates for expenses leaving (``removed``) and entering (``added``) their buckets."""
+    deltas: dict[tuple, list] = {}
+    for sign, expenses in ((-1, removed), (1, added)):
+        for expense in expenses:
+            key = rollup_key(expense)
+            delta = deltas.setdefault(tuple(key.values()), [key, 0.0, 0])
+            delta[1] += sign * float(expense.get("amount") or 0.0)
+            delta[2] += sign
+    return [
+        UpdateOne(key, {"$inc": {"total": total, "count": count}}, upsert=True)
+        for key, total, count in deltas.values()
+        if total or count
+    ]
+
+
+async def apply_rollup(db: AsyncIOMotorDatabase, removed: Iterable[dict] = (), added: Iterable[dict] = ()) -> None:
+    updates = rollup_updates(removed, added)
+    if updates:
+        await db[ROLLUP_COLLECTION].bulk_write(updates, ordered=False)
+
+
+async def rename_rollup_category(
+    db: AsyncIOMotorDatabase,
+    user_id: ObjectId,
+    old_name: str,
+    new_name: str,
+    session: AsyncIOMotorClientSession | None = None,
+) -> None:
+    """Fold the buckets of a renamed category into the buckets of its new name."""
+    if old_name == new_name:
+        # Folding a bucket into itself would double it and then delete it.
+        return
+    buckets = await db[ROLLUP_COLLECTION].find({"userId": user_id, "category": old_name}, session=session).to_list(None)
+    if not buckets:
+        return
+    operations: list = [
+        UpdateOne(
+            {**{field: bucket[field] for field in ROLLUP_KEY_FIELDS}, "category": new_name},
+            {"$inc": {"total": bucket["total"], "count": bucket["count"]}},
+            upsert=True,
+        )
+        for bucket in buckets
+    ]
+    operations.append(DeleteMany({"userId": user_id, "category": old_name}))
+    await db[ROLLUP_COLLECTION].bulk_write(operations, ordered=True, session=session)
+
+
+def build_rollup_pipeline(expense_match: dict) -> list[dict]:
+    """Recompute rollup documents from raw expenses matching ``expense_match``."""
+    return [
+        {"$match": expense_match},
+        {
+            "$group": {
+                "_id": _KEY_EXPRESSIONS,
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                **{field: f"$_id.{field}" for field in ROLLUP_KEY_FIELDS},
+                "total": 1,
+                "count": 1,
+            }
+        },
+    ]
+
+
+async def rebuild_rollups(db: AsyncIOMotorDatabase, user_id: ObjectId | None = None) -> None:
+    scope = {"userId": user_id} if user_id else {}
+    await db[ROLLUP_COLLECTION].delete_many(scope)
+    pipeline = build_rollup_pipeline(scope)
+    pipeline.append(
+        {
+            "$merge": {
+                "into": ROLLUP_COLLECTION,
+                "on": list(ROLLUP_KEY_FIELDS),
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        }
+    )
+    await db.expense.aggregate(pipeline).to_list(None)
+
+
+async def verify_rollups(db: AsyncIOMotorDatabase, user_id: ObjectId | None = None) -> list[str]:
+    """Return a line for every bucket whose stored total or count differs from the raw expenses."""
+    scope = {"userId": user_id} if user_id else {}
+    expected = {
+        tuple(row[field] for field in ROLLUP_KEY_FIELDS): row
+        async for row in db.expense.aggregate(build_rollup_pipeline(scope))
+    }
+    stored = {
+        tuple(row[field] for field in ROLLUP_KEY_FIELDS): row
+        async for row in db[ROLLUP_COLLECTION].find({**scope, "count": {"$ne": 0}})
+    }
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys(), key=str):
+        want, have = expected.get(key), stored.get(key)
+        want_total, want_count = (want["total"], want["count"]) if want else (0.0, 0)
+        have_total, have_count = (have["total"], have["count"]) if have else (0.0, 0)
+        if want_count != have_count or abs(want_total - have_total) > 1e-6:
+            mismatches.append(
+                f"{key}: expected total={want_total} count={want_count}, stored total={have_total} count={have_count}"
+            )
+    return mismatches
+
+
+async def _main(command: str, user_id: str | None) -> int:
+    scope = ObjectId(user_id) if user_id else None
+    try:
+        db = get_db()
+        if command == "rebuild":
+            await rebuild_rollups(db, scope)
+            print("Rollups rebuilt")
+            return 0
+        mismatches = await verify_rollups(db, scope)
+        for mismatch in mismatches:
+            print(f"mismatch: {mismatch}")
+        print(f"{len(mismatches)} mismatched buckets")
+        return 1 if mismatches else 0
+    finally:
+        close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify or rebuild the expense_rollup collection.")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    parser.add_argument("--user-id", help="only this user's rollups")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_main(args.command, args.user_id)))
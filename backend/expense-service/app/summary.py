@@ -0,0 +1,74 @@
+import re
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from .models import ExpenseSummary
+from .query import ExpenseFilters
+
+
+SUMMARY_DIMENSIONS = ("month", "category", "type", "currency")
+_MONTH = re.compile(r"\d{4}-\d{2}")
+
+_GROUP_KEYS = {
+    "month": {"$dateToString": {"format": "%Y-%m", "date": "$dateAt"}},
+    "category": "$category",
+    "type": "$type",
+    "currency": "$currency",
+}
+
+
+def parse_group_by(group_by: str) -> list[str]:
+    dimensions = [dimension.strip() for dimension in group_by.split(",") if dimension.strip()]
+    unknown = set(dimensions) - set(SUMMARY_DIMENSIONS)
+    if unknown or not dimensions:
+        raise HTTPException(status_code=400, detail=f"group_by must be a subset of {', '.join(SUMMARY_DIMENSIONS)}")
+    return [dimension for dimension in SUMMARY_DIMENSIONS if dimension in dimensions]
+
+
+def build_summary_pipeline(query: dict, dimensions: list[str]) -> list[dict]:
+    return [
+        {"$match": query},
+        {"$project": {"_id": 0, "dateAt": 1, "category": 1, "type": 1, "currency": 1, "amount": 1}},
+        {
+            "$group": {
+                "_id": {dimension: _GROUP_KEYS[dimension] for dimension in dimensions},
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+            }
+        },
+        {"$sort": {f"_id.{dimension}": 1 for dimension in dimensions}},
+    ]
+
+
+def can_use_rollup(filters: ExpenseFilters) -> bool:
+    """Rollups answer whole-month questions: no date bounds, or bounds given as ``YYYY-MM``."""
+    return all(bound is None or _MONTH.fullmatch(bound) for bound in (filters.date_gte, filters.date_lte))
+
+
+def build_rollup_summary_pipeline(user_id: ObjectId, filters: ExpenseFilters, dimensions: list[str]) -> list[dict]:
+    match: dict = {"userId": user_id, "count": {"$gt": 0}}
+    if filters.date_gte:
+        match.setdefault("month", {})["$gte"] = filters.date_gte
+    if filters.date_lte:
+        match.setdefault("month", {})["$lte"] = filters.date_lte
+    if filters.category:
+        match["category"] = filters.category
+    if filters.type:
+        match["type"] = filters.type
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {dimension: f"${dimension}" for dimension in dimensions},
+                "total": {"$sum": "$total"},
+                "count": {"$sum": "$count"},
+            }
+        },
+        {"$sort": {f"_id.{dimension}": 1 for dimension in dimensions}},
+    ]
+
+
+def to_summary(row: dict) -> ExpenseSummary:
+    # Rollup totals are float $inc sums; drop the representation noise they accumulate.
+    return ExpenseSummary(**row["_id"], total=round(row["total"], 6), count=row["count"])
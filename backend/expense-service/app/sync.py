@@ -0,0 +1,144 @@
+"""Change feed behind ``GET /expense/changes``.
+
+Every expense write takes the next value of the user's counter in ``expense_sequence`` and stores
+it as the expense's ``version``; a delete leaves a tombstone with its own version in
+``expense_tombstone``. A client keeps the ``next`` cursor of its last sync and asks for what
+changed after it, in (version, _id) order, so a sync costs O(changes) rather than O(history).
+
+Tombstones expire after ``EXPENSE_TOMBSTONE_TTL_DAYS``; a cursor older than that could have
+missed deletes and is answered with 410, after which the client syncs again from scratch.
+Expenses written before versions existed have none and are returned by that first full sync.
+
+A version is taken before its write commits, so writes of one user (a bulk import next to an
+edit, a background category rename) can commit out of version order. Every write also stamps
+``epoch`` after taking its version, and ``next`` only moves past changes stamped more than
+``EXPENSE_SYNC_LAG_MS`` ago: a write still in flight then has a higher version than the cursor.
+Newer changes are returned straight away and again by the next sync.
+"""
+
+import base64
+import binascii
+import json
+import os
+import time
+from datetime import UTC, datetime
+from typing import Any
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from .query import expense_to_dict
+
+
+SEQUENCE_COLLECTION = "expense_sequence"
+TOMBSTONE_COLLECTION = "expense_tombstone"
+EXPENSE_TOMBSTONE_TTL_DAYS = int(os.getenv("EXPENSE_TOMBSTONE_TTL_DAYS", "30"))
+CHANGES_SORT = [("version", 1), ("_id", 1)]
+# How long a write may take to commit after taking its version.
+EXPENSE_SYNC_LAG_MS = int(os.getenv("EXPENSE_SYNC_LAG_MS", "10000"))
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def version_bump() -> dict:
+    """The counter update of every write: the next version, and when it was taken (``versionAt``)."""
+    return {"$inc": {"version": 1}, "$set": {"versionAt": now_ms()}}
+
+
+async def next_version(
+    db: AsyncIOMotorDatabase, user_id: ObjectId, session: AsyncIOMotorClientSession | None = None
+) -> int:
+    counter = await db[SEQUENCE_COLLECTION].find_one_and_update(
+        {"_id": user_id},
+        version_bump(),
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+        session=session,
+    )
+    return counter["version"]
+
+
+async def record_deletes(db: AsyncIOMotorDatabase, user_id: ObjectId, expense_ids: list[ObjectId]) -> None:
+    if not expense_ids:
+        return
+    version = await next_version(db, user_id)
+    deleted_at = datetime.now(UTC)
+    epoch = now_ms()
+    await db[TOMBSTONE_COLLECTION].insert_many(
+        [
+            {"_id": expense_id, "userId": user_id, "version": version, "epoch": epoch, "deletedAt": deleted_at}
+            for expense_id in expense_ids
+        ],
+        ordered=False,
+    )
+
+
+def encode_since(version: int, last_id: ObjectId | None) -> str:
+    raw = json.dumps([version, str(last_id) if last_id else None, now_ms()], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_since(since: str) -> tuple[int, ObjectId | None]:
+    try:
+        raw = base64.urlsafe_b64decode(since + "=" * (-len(since) % 4))
+        version, last_id, issued_at = json.loads(raw)
+        position = int(version), ObjectId(last_id) if last_id else None
+        issued_at = int(issued_at)
+    except (binascii.Error, ValueError, TypeError, InvalidId) as exc:
+        raise HTTPException(status_code=400, detail="Invalid since cursor") from exc
+    if now_ms() - issued_at > EXPENSE_TOMBSTONE_TTL_DAYS * 86_400_000:
+        raise HTTPException(status_code=410, detail="Sync cursor expired, sync again without since")
+    return position
+
+
+def _after(user_id: ObjectId, version: int, last_id: ObjectId | None) -> dict:
+    # Unversioned (legacy) expenses sort first, as version null; they count as version 0.
+    same_version = {"$in": [None, 0]} if version == 0 else version
+    tie = {"version": same_version, "_id": {"$gt": last_id}} if last_id else None
+    return {"userId": user_id, "$or": [{"version": {"$gt": version}}, *([tie] if tie else [])]}
+
+
+async def get_changes(db: AsyncIOMotorDatabase, user_id: ObjectId, since: str | None, limit: int) -> dict[str, Any]:
+    """Up to ``limit`` changes after ``since`` (everything when omitted), oldest first."""
+    if since:
+        version, last_id = decode_since(since)
+        query = _after(user_id, version, last_id)
+        tombstones = (
+            await db[TOMBSTONE_COLLECTION]
+            .find(query, {"version": 1, "epoch": 1})
+            .sort(CHANGES_SORT)
+            .limit(limit + 1)
+            .to_list(limit + 1)
+        )
+    else:
+        # A full sync starts from an empty cache, so earlier deletes do not matter.
+        version, last_id = 0, None
+        query = {"userId": user_id}
+        tombstones = []
+    expenses = await db.expense.find(query).sort(CHANGES_SORT).limit(limit + 1).to_list(limit + 1)
+
+    merged = sorted(
+        [(doc.get("version") or 0, doc["_id"], doc, False) for doc in expenses]
+        + [(doc["version"], doc["_id"], doc, True) for doc in tombstones],
+        key=lambda change: change[:2],
+    )
+    page = merged[:limit]
+    start = version, last_id
+    # Writes without an epoch predate versions or ms epochs and count as settled.
+    settled = now_ms() - EXPENSE_SYNC_LAG_MS
+    for change_version, change_id, doc, _ in page:
+        if (doc.get("epoch") or 0) > settled:
+            break
+        version, last_id = change_version, change_id
+    return {
+        "changed": [expense_to_dict(doc) for _, _, doc, deleted in page if not deleted],
+        "deleted": [str(expense_id) for _, expense_id, _, deleted in page if deleted],
+        "next": encode_since(version, last_id),
+        # A page held back entirely by the lag is not worth asking for again straight away.
+        "hasMore": len(merged) > limit and (version, last_id) != start,
+    }
@@ -1,17 +1,66 @@
+import csv
+import io
+import json
+import logging
 import sys
-from collections.abc import Generator
+import time
+from collections.abc import AsyncIterator, Generator
 from datetime import datetime
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
+from bson import ObjectId
 from fastapi.testclient import TestClient
+from jose import jwt
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, DuplicateKeyError
 
 
 # Add backend/expense-service/ to sys.path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
+from app.auth import ALGORITHM, SECRET_KEY, user_status_cache
+from app.categories import CATEGORY_JOB_RETRY_SECONDS, category_cache
+from app.db import close_db, connect_db, get_db
+from app.groups import group_membership
+from app.indexes import INDEXES, ensure_indexes
+from app.log import ContextFilter, JsonFormatter, request_id_var
 from app.main import app
-from app.db import get_db
+from app.migrate_dates import backfill_dates
+from app.rollup import rename_rollup_category
+from app.sync import EXPENSE_TOMBSTONE_TTL_DAYS, decode_since, encode_since, now_ms
+
+
+USER_ID = "67d2478e5592b0e4146b140c"
+
+
+class AsyncCursor:
+    """In-memory stand-in for a Motor cursor."""
+
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = list(docs)
+        self.closed = False
+
+    def sort(self, *_: Any, **__: Any) -> "AsyncCursor":
+        return self
+
+    def limit(self, length: int) -> "AsyncCursor":
+        self.docs = self.docs[:length] if length else self.docs
+        return self
+
+    def batch_size(self, _: int) -> "AsyncCursor":
+        return self
+
+    async def close(self) -> None:
+        self.closed = True
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        return self.docs[:length] if length else list(self.docs)
+
+    async def __aiter__(self) -> AsyncIterator[dict]:
+        for doc in self.docs:
+            yield doc
 
 
 @pytest.fixture
@@ -21,7 +70,14 @@ def test_client() -> TestClient:
 
 @pytest.fixture
 def mock_database() -> MagicMock:
-    return MagicMock()
+    database = MagicMock()
+    database["expense_rollup"].bulk_write = AsyncMock()
+    database["expense_sequence"].find_one_and_update = AsyncMock(return_value={"version": 1})
+    database["expense_sequence"].find_one = AsyncMock(
+        return_value={"_id": ObjectId(USER_ID), "version": 3, "versionAt": 1742000000000}
+    )
+    database["expense_sequence"].update_one = AsyncMock()
+    return database
 
 
 # pylint: disable=redefined-outer-name
@@ -36,25 +92,45 @@ def mock_db(mock_database: MagicMock) -> Generator[MagicMock, None, None]:
     app.dependency_overrides.clear()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches() -> Generator[None, None, None]:
+    user_status_cache.clear()
+    category_cache.local.clear()
+    group_membership.clear()
+    yield
+    user_status_cache.clear()
+    category_cache.local.clear()
+    group_membership.clear()
+
+
 @pytest.fixture
-def mock_auth_service() -> Generator[MagicMock, None, None]:
-    with patch("app.auth.requests.get") as mock_get:
+def auth_headers() -> dict[str, str]:
+    token = jwt.encode({"sub": "test@example.com", "userId": USER_ID, "role": "user"}, SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def mock_auth_service() -> Generator[AsyncMock, None, None]:
+    with patch("app.auth.get_http_client") as mock_http_client:
         mock_response = MagicMock()
         mock_response.status_code = 200
-        mock_response.json.return_value = {"email": "test@example.com", "userId": "123456"}
-        mock_get.return_value = mock_response
+        mock_response.json.return_value = {"email": "test@example.com", "userId": USER_ID}
+        mock_get = AsyncMock(return_value=mock_response)
+        mock_http_client.return_value.get = mock_get
         yield mock_get
 
 
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
-async def test_create_expense_success(test_client: TestClient, mock_database: MagicMock) -> None:
+async def test_create_expense_success(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
     # Mock DB insert
-    mock_database.expense.insert_one.return_value = None
+    mock_database.expense.insert_one = AsyncMock(return_value=MagicMock(inserted_id="67d2478e5592b0e4146b1400"))
 
     response = test_client.post(
         "/expense",
-        headers={"Authorization": "Bearer fake-token"},
+        headers=auth_headers,
         json={
             "amount": 50.00,
             "category": "Groceries",
@@ -75,18 +151,114 @@ async def test_create_expense_success(test_client: TestClient, mock_database: Ma
         raise ValueError(f"Expected currency to be 'USD', but got {data['currency']}")
     if "userId" not in data:
         raise KeyError("Expected 'userId' in response data.")
-    if data["userId"] != "123456":
-        raise ValueError(f"Expected 'userId' to be '123456', but got {data['userId']}")
+    if data["userId"] != USER_ID:
+        raise ValueError(f"Expected 'userId' to be '{USER_ID}', but got {data['userId']}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_expense_dates_are_validated_stored_and_filtered_as_dates(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    expense = {"amount": 5.0, "category": "Food", "type": "expense", "currency": "USD"}
+
+    response = test_client.post("/expense", headers=auth_headers, json={**expense, "date": "15/03/2025"})
+    if response.status_code != 422:
+        raise AssertionError(f"Expected 422 for a non-ISO date, got {response.status_code}")
+    response = test_client.post("/expense", headers=auth_headers, json={**expense, "date": "2025-03-15T23:30:00+05:00"})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, got {response.status_code}")
+    stored = mock_database.expense.insert_one.call_args.args[0]
+    # The wall clock the client sent, so the expense stays on the 15th.
+    if stored["dateAt"] != datetime(2025, 3, 15, 23, 30) or stored["date"] != "2025-03-15T23:30:00+05:00":
+        raise AssertionError(f"Unexpected stored dates: {stored}")
+
+    mock_database.expense.find.return_value = AsyncCursor([])
+    response = test_client.get(
+        "/expense", headers=auth_headers, params={"date_gte": "2025-02", "date_lte": "2025-03-15"}
+    )
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, got {response.status_code}")
+    query = mock_database.expense.find.call_args.args[0]
+    if query["dateAt"] != {"$gte": datetime(2025, 2, 1), "$lt": datetime(2025, 3, 16)}:
+        raise AssertionError(f"Unexpected date bounds: {query}")
+    response = test_client.get("/expense", headers=auth_headers, params={"date_gte": "March"})
+    if response.status_code != 400:
+        raise AssertionError(f"Expected 400 for a bad bound, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_backfill_dates_resumes_by_id_and_skips_bad_dates(mock_database: MagicMock) -> None:
+    docs = [{"_id": ObjectId(), "date": date} for date in ("2025-01-02", "bad", "2025-01-03T08:00:00Z")]
+    mock_database.expense.find.side_effect = [AsyncCursor(docs[:2]), AsyncCursor(docs[2:]), AsyncCursor([])]
+    mock_database.expense.bulk_write = AsyncMock(return_value=MagicMock(modified_count=1))
+
+    updated, invalid = await backfill_dates(mock_database, batch_size=2)
+    if updated != 2 or invalid != [docs[1]["_id"]]:
+        raise AssertionError(f"Unexpected backfill result: {updated}, {invalid}")
+    second_query = mock_database.expense.find.call_args_list[1].args[0]
+    if second_query["_id"] != {"$gt": docs[1]["_id"]} or second_query["dateAt"] != {"$exists": False}:
+        raise AssertionError(f"Backfill did not resume after the last id: {second_query}")
+    [first_update] = mock_database.expense.bulk_write.call_args_list[0].args[0]
+    expected = UpdateOne(
+        {"_id": docs[0]["_id"], "date": "2025-01-02", "dateAt": {"$exists": False}},
+        {"$set": {"dateAt": datetime(2025, 1, 2)}},
+    )
+    if first_update != expected:
+        raise AssertionError(f"Unexpected backfill update: {first_update}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_bulk_import_reports_each_row(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    def insert_many(docs: list[dict], ordered: bool) -> None:
+        for doc in docs:
+            doc["_id"] = ObjectId()
+        # Row 2 was stored by an earlier attempt with the same idempotency key.
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key"}]})
+
+    mock_database.expense.insert_many = AsyncMock(side_effect=insert_many)
+    response = test_client.post(
+        "/expense/bulk/csv",
+        headers={**auth_headers, "Idempotency-Key": "march", "Content-Type": "text/csv"},
+        content=(
+            "amount,category,date,description,type,currency\n"
+            "12.5,Food,2025-03-01,Lunch,expense,\n"
+            "oops,Food,2025-03-02,,expense,USD\n"
+            "30,Salary,2025-03-03,,income,USD\n"
+        ),
+    )
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    data = response.json()
+    statuses = [row["status"] for row in data["results"]]
+    if statuses != ["created", "invalid", "duplicate"] or (data["created"], data["duplicates"], data["errors"]) != (
+        1,
+        1,
+        1,
+    ):
+        raise AssertionError(f"Unexpected import result: {data}")
+    docs = mock_database.expense.insert_many.call_args.args[0]
+    if [doc["importKey"] for doc in docs] != ["march:0", "march:2"] or docs[0]["currency"] != "USD":
+        raise AssertionError(f"Unexpected documents: {docs}")
+    # Only the row that was actually inserted counts towards the rollups.
+    updates = mock_database["expense_rollup"].bulk_write.call_args.args[0]
+    if len(updates) != 1:
+        raise AssertionError(f"Expected one rollup update, got {updates}")
 
 
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
 async def test_create_expense_unauthorized(test_client: TestClient) -> None:
-    with patch("app.auth.requests.get") as mock_get:
+    with patch("app.auth.get_http_client") as mock_http_client:
         mock_response = MagicMock()
         mock_response.status_code = 401
         mock_response.json.return_value = {"detail": "Invalid token"}
-        mock_get.return_value = mock_response
+        mock_http_client.return_value.get = AsyncMock(return_value=mock_response)
 
         response = test_client.post(
             "/expense",
@@ -108,25 +280,27 @@ async def test_create_expense_unauthorized(test_client: TestClient) -> None:
 
 # pylint: disable=redefined-outer-name
 @pytest.mark.asyncio
-async def test_get_expenses_success(test_client: TestClient, mock_database: MagicMock) -> None:
+async def test_get_expenses_success(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
     # Mock DB find
     mock_expenses = [
         {
             "_id": "1",
-            "userId": "123456",
+            "userId": USER_ID,
             "groupId": None,
             "amount": 50.0,
             "category": "Groceries",
-            "date": datetime(2025, 3, 15, 10, 0, 0),
+            "date": "2025-03-15T10:00:00Z",
             "description": "Weekly shopping",
             "type": "expense",
             "currency": "USD",
             "epoch": 1741832400,
         }
     ]
-    mock_database.expense.find.return_value = mock_expenses
+    mock_database.expense.find.return_value = AsyncCursor(mock_expenses)
 
-    response = test_client.get("/expense", headers={"Authorization": "Bearer fake-token"})
+    response = test_client.get("/expense", headers=auth_headers)
     if response.status_code != 200:
         raise AssertionError(f"Expected status code 200, but got {response.status_code}")
     data = response.json()
@@ -134,8 +308,721 @@ async def test_get_expenses_success(test_client: TestClient, mock_database: Magi
         raise ValueError(f"Expected data length to be 1, but got {len(data)}")
     if data[0]["amount"] != 50.0:
         raise ValueError(f"Expected amount to be 50.0, but got {data[0]['amount']}")
-    if data[0]["userId"] != "123456":
-        raise ValueError(f"Expected 'userId' to be '123456', but got {data[0]['userId']}")
+    if data[0]["userId"] != USER_ID:
+        raise ValueError(f"Expected 'userId' to be '{USER_ID}', but got {data[0]['userId']}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_get_expenses_paginates_with_cursor(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_expenses = [
+        {
+            "_id": ObjectId(),
+            "userId": USER_ID,
+            "amount": float(i),
+            "category": "Food",
+            "date": f"2025-03-{20 - i}",
+            "dateAt": datetime(2025, 3, 20 - i),
+        }
+        for i in range(3)
+    ]
+    mock_database.expense.find.return_value = AsyncCursor(mock_expenses)
+
+    response = test_client.get("/expense", headers=auth_headers, params={"limit": 2, "fields": "amount,category"})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    data = response.json()
+    if len(data) != 2:
+        raise AssertionError(f"Expected a page of 2, but got {len(data)}")
+    if "description" in data[0] or data[0]["amount"] != 0.0:
+        raise AssertionError(f"Expected only projected fields, but got {data[0]}")
+    next_cursor = response.headers.get("X-Next-Cursor")
+    if not next_cursor:
+        raise AssertionError("Expected an X-Next-Cursor header")
+
+    mock_database.expense.find.return_value = AsyncCursor([])
+    response = test_client.get("/expense", headers=auth_headers, params={"limit": 2, "cursor": next_cursor})
+    if response.status_code != 200 or "X-Next-Cursor" in response.headers:
+        raise AssertionError(f"Expected a final page, but got {response.status_code} {response.headers}")
+    query = mock_database.expense.find.call_args.args[0]
+    expected_or = [
+        {"dateAt": {"$lt": datetime(2025, 3, 19)}},
+        {"dateAt": datetime(2025, 3, 19), "_id": {"$lt": mock_expenses[1]["_id"]}},
+        {"dateAt": None},
+    ]
+    if query["$or"] != expected_or:
+        raise AssertionError(f"Expected a keyset filter after the last row, but got {query}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_get_expenses_rejects_bad_cursor_and_fields(
+    test_client: TestClient, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    for params in ({"cursor": "not-a-cursor"}, {"fields": "amount,hashedPassword"}):
+        response = test_client.get("/expense", headers=auth_headers, params=params)
+        if response.status_code != 400:
+            raise AssertionError(f"Expected status code 400 for {params}, but got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_reads_answer_if_none_match_without_querying(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.find.return_value = AsyncCursor([])
+    response = test_client.get("/expense", headers=auth_headers)
+    etag = response.headers.get("ETag")
+    if response.status_code != 200 or etag != f'W/"{USER_ID}-3"':
+        raise AssertionError(f"Expected an ETag from the data version, got {response.status_code} {etag}")
+
+    mock_database.expense.find.reset_mock()
+    for path in ("/expense", "/categories", "/user"):
+        response = test_client.get(path, headers={**auth_headers, "If-None-Match": etag})
+        if response.status_code != 304 or response.content or response.headers.get("ETag") != etag:
+            raise AssertionError(f"Expected 304 for {path}, got {response.status_code} {response.headers}")
+    if mock_database.expense.find.called:
+        raise AssertionError("A 304 must be answered before the expense query")
+    mock_database.category.find = MagicMock(return_value=AsyncCursor([]))
+    response = test_client.get("/categories?show_universal=true", headers={**auth_headers, "If-None-Match": etag})
+    if response.status_code != 200 or "ETag" in response.headers:
+        raise AssertionError(f"Universal categories are unversioned and must not revalidate: {response.headers}")
+
+    mock_database.expense.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    test_client.post(
+        "/expense",
+        headers=auth_headers,
+        json={"amount": 1.0, "category": "Food", "date": "2025-03-01", "type": "expense"},
+    )
+    # The version the write takes is its data version bump; no separate counter write.
+    bumped = mock_database["expense_sequence"].find_one_and_update.call_args.args
+    if bumped[0] != {"_id": ObjectId(USER_ID)} or bumped[1]["$inc"] != {"version": 1}:
+        raise AssertionError(f"Expected the write to bump the data version, got {bumped}")
+    if mock_database["expense_sequence"].update_one.called:
+        raise AssertionError("An expense write should bump the counter once, not touch it again")
+
+    # Right after a bump the write may still be committing: no validator, so nothing stale is cached.
+    mock_database["expense_sequence"].find_one.return_value = {"version": 4, "versionAt": now_ms()}
+    response = test_client.get("/expense", headers={**auth_headers, "If-None-Match": 'W/"x"'})
+    if response.status_code != 200 or "ETag" in response.headers:
+        raise AssertionError(f"Expected no ETag within the lag window, got {response.headers}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_cached_categories_are_not_served_under_a_newer_version(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.category.find = MagicMock(return_value=AsyncCursor([{"name": "Food", "userId": ObjectId(USER_ID)}]))
+    response = test_client.get("/categories", headers=auth_headers)
+    if response.json() != [{"name": "Food", "userId": USER_ID}] or response.headers.get("ETag") != f'W/"{USER_ID}-3"':
+        raise AssertionError(f"Unexpected first read: {response.json()} {response.headers}")
+
+    # A write on another worker: this worker's cache was never invalidated, but the version moved on.
+    mock_database.category.find = MagicMock(return_value=AsyncCursor([{"name": "Rent", "userId": ObjectId(USER_ID)}]))
+    mock_database["expense_sequence"].find_one.return_value = {"version": 4, "versionAt": 1742000000000}
+    response = test_client.get("/categories", headers=auth_headers)
+    if response.json() != [{"name": "Rent", "userId": USER_ID}] or response.headers.get("ETag") != f'W/"{USER_ID}-4"':
+        raise AssertionError(
+            f"Expected the version-4 list under the version-4 ETag: {response.json()} {response.headers}"
+        )
+    test_client.get("/categories", headers=auth_headers)
+    if mock_database.category.find.call_count != 1:
+        raise AssertionError("Expected the version-4 list to be cached")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_category_lookup_racing_an_invalidation_is_not_cached(mock_database: MagicMock) -> None:
+    class RacingCursor(AsyncCursor):
+        async def __aiter__(self) -> AsyncIterator[dict]:
+            # The list is read, then a write invalidates it before the lookup stores it.
+            for doc in self.docs:
+                yield doc
+            await category_cache.invalidate(None)
+
+    mock_database.category.find = MagicMock(return_value=RacingCursor([{"name": "Food"}]))
+    categories = await category_cache.universal_categories(mock_database)
+    if categories != [{"name": "Food", "userId": None}]:
+        raise AssertionError(f"Expected the racing lookup to still answer, got {categories}")
+    await category_cache.universal_categories(mock_database)
+    if mock_database.category.find.call_count != 2:
+        raise AssertionError("A list read across an invalidation must not be cached")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_expense_changes_merge_upserts_and_tombstones(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    edited, deleted, later = ObjectId(), ObjectId(), ObjectId()
+    mock_database.expense.find.return_value = AsyncCursor(
+        [
+            {"_id": edited, "userId": USER_ID, "amount": 5.0, "date": "2025-03-01", "version": 4},
+            {"_id": later, "userId": USER_ID, "amount": 6.0, "date": "2025-03-02", "version": 6},
+        ]
+    )
+    mock_database["expense_tombstone"].find.return_value = AsyncCursor([{"_id": deleted, "version": 5}])
+    since = encode_since(3, ObjectId())
+
+    response = test_client.get("/expense/changes", headers=auth_headers, params={"since": since, "limit": 2})
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    data = response.json()
+    if [expense["id"] for expense in data["changed"]] != [str(edited)] or data["deleted"] != [str(deleted)]:
+        raise AssertionError(f"Expected the two oldest changes, got {data}")
+    if not data["hasMore"] or decode_since(data["next"]) != (5, deleted):
+        raise AssertionError(f"Expected a cursor after the tombstone, got {data}")
+    query = mock_database.expense.find.call_args.args[0]
+    if query["$or"][0] != {"version": {"$gt": 3}}:
+        raise AssertionError(f"Expected a (version, _id) keyset filter, got {query}")
+
+    # A change written within the lag may have lower versions still in flight: sent, but not passed by next.
+    recent = {"_id": later, "userId": USER_ID, "amount": 6.0, "date": "2025-03-02", "version": 6, "epoch": now_ms()}
+    mock_database.expense.find.return_value = AsyncCursor([recent])
+    mock_database["expense_tombstone"].find.return_value = AsyncCursor([])
+    response = test_client.get("/expense/changes", headers=auth_headers, params={"since": data["next"]})
+    data = response.json()
+    if [expense["id"] for expense in data["changed"]] != [str(later)] or decode_since(data["next"]) != (5, deleted):
+        raise AssertionError(f"Expected the recent change without moving the cursor, got {data}")
+
+    with patch("app.sync.now_ms", return_value=now_ms() + 31 * 86_400_000):
+        response = test_client.get("/expense/changes", headers=auth_headers, params={"since": since})
+    if response.status_code != 410:
+        raise AssertionError(f"Expected 410 for a cursor older than the tombstones, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_group_ledger_reads_by_group_id_with_cached_membership(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    group_id, member_id = ObjectId(), ObjectId()
+    mock_database.group.find.return_value = AsyncCursor([{"_id": group_id}])
+    mock_database.expense.insert_one = AsyncMock(return_value=MagicMock(inserted_id=ObjectId()))
+    expense = {"amount": 80.0, "category": "Food", "date": "2025-03-02", "type": "expense", "groupId": str(group_id)}
+
+    response = test_client.post("/expense", headers=auth_headers, json=expense)
+    if response.status_code != 200 or response.json()["groupId"] != str(group_id):
+        raise AssertionError(f"Unexpected create response: {response.status_code} {response.text}")
+    if mock_database.expense.insert_one.call_args.args[0]["groupId"] != group_id:
+        raise AssertionError("The expense was not stored with the groupId")
+
+    shared = [{"_id": ObjectId(), "userId": member_id, "groupId": group_id, "amount": 20.0, "category": "Food"}]
+    mock_database.expense.find.return_value = AsyncCursor(shared)
+    response = test_client.get(f"/groups/{group_id}/expense", headers=auth_headers, params={"date_gte": "2025-03"})
+    if response.status_code != 200 or response.json()[0]["userId"] != str(member_id):
+        raise AssertionError(f"Unexpected group expenses: {response.status_code} {response.text}")
+    query = mock_database.expense.find.call_args.args[0]
+    if query != {"groupId": group_id, "dateAt": {"$gte": datetime(2025, 3, 1)}}:
+        raise AssertionError(f"Group reads should match on groupId alone: {query}")
+    # Both requests were authorized from one membership lookup.
+    if mock_database.group.find.call_count != 1:
+        raise AssertionError(f"Expected one membership query, got {mock_database.group.find.call_count}")
+
+    response = test_client.get(f"/groups/{ObjectId()}/expense", headers=auth_headers)
+    if response.status_code != 404:
+        raise AssertionError(f"Expected 404 for another group, got {response.status_code}")
+    response = test_client.post("/expense", headers=auth_headers, json={**expense, "groupId": str(ObjectId())})
+    if response.status_code != 403:
+        raise AssertionError(f"Expected 403 writing to another group, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_join_group_by_invite_code_refreshes_membership(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    group_id = ObjectId()
+    mock_database.group.find.return_value = AsyncCursor([])
+    if test_client.get(f"/groups/{group_id}/expense", headers=auth_headers).status_code != 404:
+        raise AssertionError("Expected 404 before joining")
+
+    group = {
+        "_id": group_id,
+        "name": "Home",
+        "owner": ObjectId(),
+        "users": [ObjectId(USER_ID)],
+        "inviteCode": "abc",
+        "createdAt": 1,
+    }
+    mock_database.group.find_one_and_update = AsyncMock(return_value=group)
+    response = test_client.post("/groups/join", headers=auth_headers, json={"inviteCode": "abc"})
+    if response.status_code != 200 or response.json()["users"] != [USER_ID]:
+        raise AssertionError(f"Unexpected join response: {response.status_code} {response.text}")
+    if mock_database.group.find_one_and_update.call_args.args[1] != {"$addToSet": {"users": ObjectId(USER_ID)}}:
+        raise AssertionError("Join should add the user to the group")
+
+    mock_database.group.find.return_value = AsyncCursor([{"_id": group_id}])
+    mock_database.expense.find.return_value = AsyncCursor([])
+    if test_client.get(f"/groups/{group_id}/expense", headers=auth_headers).status_code != 200:
+        raise AssertionError("Joining should invalidate the cached membership")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_export_expenses_streams_ndjson_and_csv(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_expenses = [
+        {
+            "_id": ObjectId(),
+            "userId": USER_ID,
+            "amount": 5.0,
+            "category": "Food",
+            "date": "2025-03-02",
+            "type": "expense",
+        },
+        {
+            "_id": ObjectId(),
+            "userId": USER_ID,
+            "amount": 7.5,
+            "category": "Food",
+            "date": "2025-03-01",
+            "type": "expense",
+        },
+    ]
+
+    cursor = AsyncCursor(mock_expenses)
+    mock_database.expense.find.return_value = cursor
+    response = test_client.get("/expense/export", headers=auth_headers, params={"category": "Food"})
+    if response.status_code != 200 or not response.headers["content-type"].startswith("application/x-ndjson"):
+        raise AssertionError(f"Expected an NDJSON stream, but got {response.status_code} {response.headers}")
+    lines = response.text.strip().split("\n")
+    if len(lines) != 2 or json.loads(lines[1])["amount"] != 7.5:
+        raise AssertionError(f"Unexpected NDJSON body: {response.text}")
+    if mock_database.expense.find.call_args.args[0]["category"] != "Food" or not cursor.closed:
+        raise AssertionError("Expected the filters to be applied and the cursor to be closed")
+
+    mock_database.expense.find.return_value = AsyncCursor(mock_expenses)
+    response = test_client.get("/expense/export", headers=auth_headers, params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    if response.status_code != 200 or [row["amount"] for row in rows] != ["5.0", "7.5"]:
+        raise AssertionError(f"Unexpected CSV body: {response.text}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_expense_summary_aggregates_server_side(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.aggregate.return_value = AsyncCursor(
+        [{"_id": {"month": "2025-03", "currency": "USD"}, "total": 57.5, "count": 2}]
+    )
+
+    response = test_client.get(
+        "/expense/summary",
+        headers=auth_headers,
+        params={"group_by": "currency,month", "type": "expense", "date_gte": "2025-03-10"},
+    )
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    if response.json() != [
+        {"month": "2025-03", "category": None, "type": None, "currency": "USD", "total": 57.5, "count": 2}
+    ]:
+        raise AssertionError(f"Unexpected summary: {response.json()}")
+    pipeline = mock_database.expense.aggregate.call_args.args[0]
+    if pipeline[0]["$match"]["type"] != "expense" or list(pipeline[2]["$group"]["_id"]) != ["month", "currency"]:
+        raise AssertionError(f"Unexpected pipeline: {pipeline}")
+
+    response = test_client.get("/expense/summary", headers=auth_headers, params={"group_by": "userId"})
+    if response.status_code != 400:
+        raise AssertionError(f"Expected status code 400, but got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_expense_summary_reads_rollups_for_whole_months(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database["expense_rollup"].aggregate.return_value = AsyncCursor(
+        [{"_id": {"month": "2025-03"}, "total": 0.1 + 0.2, "count": 2}]
+    )
+
+    response = test_client.get(
+        "/expense/summary", headers=auth_headers, params={"group_by": "month", "date_gte": "2025-01"}
+    )
+    if response.status_code != 200 or response.json()[0]["total"] != 0.3:
+        raise AssertionError(f"Unexpected rollup summary: {response.status_code} {response.json()}")
+    mock_database.expense.aggregate.assert_not_called()
+    match = mock_database["expense_rollup"].aggregate.call_args.args[0][0]["$match"]
+    if match["month"] != {"$gte": "2025-01"}:
+        raise AssertionError(f"Expected a month-bounded rollup match, but got {match}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_expense_writes_maintain_rollups(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    expense_id = ObjectId()
+    previous = {
+        "_id": expense_id,
+        "userId": ObjectId(USER_ID),
+        "amount": 10.0,
+        "category": "Food",
+        "date": "2025-02-27",
+        "type": "expense",
+        "currency": "USD",
+        "epoch": 1,
+    }
+    mock_database.expense.find_one_and_update = AsyncMock(return_value=previous)
+    mock_database.expense.find_one = AsyncMock()
+
+    response = test_client.put(
+        f"/expense/{expense_id}",
+        headers=auth_headers,
+        json={"amount": 12.0, "category": "Food", "date": "2025-03-01", "type": "expense", "currency": "USD"},
+    )
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    if response.json()["amount"] != 12.0 or mock_database.expense.find_one.called:
+        raise AssertionError(f"Expected the updated expense without a read-back, got {response.json()}")
+    bucket = {"userId": ObjectId(USER_ID), "category": "Food", "type": "expense", "currency": "USD"}
+    expected = [
+        UpdateOne({**bucket, "month": "2025-02"}, {"$inc": {"total": -10.0, "count": -1}}, upsert=True),
+        UpdateOne({**bucket, "month": "2025-03"}, {"$inc": {"total": 12.0, "count": 1}}, upsert=True),
+    ]
+    updates = mock_database["expense_rollup"].bulk_write.call_args.args[0]
+    if updates != expected:
+        raise AssertionError(f"Expected the expense to move between monthly buckets, got {updates}")
+
+    mock_database.expense.find_one_and_delete = AsyncMock(return_value=None)
+    response = test_client.delete(f"/expense/{expense_id}", headers=auth_headers)
+    if response.status_code != 404:
+        raise AssertionError(f"Expected status code 404, but got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_update_expense_with_if_match_detects_concurrent_edits(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    expense_id = ObjectId()
+    body = {"amount": 3.0, "category": "Food", "date": "2025-03-01", "type": "expense", "currency": "USD"}
+    previous = {**body, "_id": expense_id, "userId": ObjectId(USER_ID), "epoch": 1, "version": 7}
+    mock_database.expense.find_one_and_update = AsyncMock(return_value=previous)
+
+    response = test_client.put(f"/expense/{expense_id}", headers={**auth_headers, "If-Match": '"7"'}, json=body)
+    if response.status_code != 200 or response.headers.get("ETag") != '"1"':
+        raise AssertionError(f"Expected the update with the new version as ETag, got {response.headers}")
+    query = mock_database.expense.find_one_and_update.call_args.args[0]
+    if query != {"_id": expense_id, "userId": ObjectId(USER_ID), "version": 7}:
+        raise AssertionError(f"Expected the version precondition in the filter, got {query}")
+
+    mock_database.expense.find_one_and_update = AsyncMock(return_value=None)
+    mock_database.expense.find_one = AsyncMock(return_value={"_id": expense_id})
+    response = test_client.put(f"/expense/{expense_id}", headers={**auth_headers, "If-Match": '"7"'}, json=body)
+    if response.status_code != 412:
+        raise AssertionError(f"Expected 412 for a stale version, got {response.status_code}")
+    mock_database.expense.find_one = AsyncMock(return_value=None)
+    response = test_client.put(f"/expense/{expense_id}", headers={**auth_headers, "If-Match": '"7"'}, json=body)
+    if response.status_code != 404:
+        raise AssertionError(f"Expected 404 for a missing expense, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_local_token_verification_caches_user_status(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.find.return_value = AsyncCursor([])
+
+    for _ in range(3):
+        response = test_client.get("/expense", headers=auth_headers)
+        if response.status_code != 200:
+            raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    if mock_auth_service.call_count != 1:
+        raise AssertionError(f"Expected one auth-service lookup, but got {mock_auth_service.call_count}")
+
+    mock_auth_service.return_value.status_code = 401
+    user_status_cache.clear()  # AUTH_USER_CACHE_TTL has run out
+    response = test_client.get("/expense", headers=auth_headers)
+    if response.status_code != 401:
+        raise AssertionError(f"Expected status code 401 once the cached status expired, but got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_auth_service_failures_are_not_cached_as_inactive(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.find.return_value = AsyncCursor([])
+    mock_auth_service.return_value.status_code = 503
+    response = test_client.get("/expense", headers=auth_headers)
+    if response.status_code != 503:
+        raise AssertionError(f"Expected 503 while auth-service fails, got {response.status_code}")
+
+    mock_auth_service.return_value.status_code = 200
+    response = test_client.get("/expense", headers=auth_headers)
+    if response.status_code != 200 or mock_auth_service.call_count != 2:
+        raise AssertionError(f"Expected a fresh lookup once auth-service recovers, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_local_token_verification_rejects_bad_signature(
+    test_client: TestClient, mock_auth_service: AsyncMock
+) -> None:
+    token = jwt.encode({"sub": "test@example.com", "userId": USER_ID}, "wrong-key", algorithm=ALGORITHM)
+
+    response = test_client.get("/expense", headers={"Authorization": f"Bearer {token}"})
+    if response.status_code != 401:
+        raise AssertionError(f"Expected status code 401, but got {response.status_code}")
+    if mock_auth_service.called:
+        raise AssertionError("Expected no auth-service call for a forged token")
+
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_creates_missing_and_reports_conflicts(mock_database: MagicMock) -> None:
+    existing = {
+        "expense": {"userId_dateAt": {"key": [("userId", 1), ("dateAt", -1), ("_id", -1)]}},
+        "category": {"userId_name": {"key": [("userId", 1), ("name", 1)]}},  # declared unique
+        "expense_tombstone": {"deletedAt_ttl": {"key": [("deletedAt", 1)], "expireAfterSeconds": 86400}},
+    }
+    collections: dict[str, MagicMock] = {}
+    for name in INDEXES:
+        collection = MagicMock()
+        collection.index_information = AsyncMock(return_value=existing.get(name, {}))
+        collection.create_indexes = AsyncMock()
+        collections[name] = collection
+    mock_database.__getitem__.side_effect = collections.__getitem__
+    mock_database.command = AsyncMock()
+
+    report = await ensure_indexes(mock_database)
+
+    if report["existing"] != ["expense.userId_dateAt"]:
+        raise AssertionError(f"Unexpected existing indexes: {report['existing']}")
+    if "expense.userId_category_dateAt" not in report["created"] or "user_profile.userId" not in report["created"]:
+        raise AssertionError(f"Expected missing indexes to be created, got {report['created']}")
+    if len(report["conflicts"]) != 1 or not report["conflicts"][0].startswith("category.userId_name"):
+        raise AssertionError(f"Expected the non-unique category index to conflict, got {report['conflicts']}")
+    collections["category"].create_indexes.assert_not_called()
+    if report["updated"] != ["expense_tombstone.deletedAt_ttl"]:
+        raise AssertionError(f"Expected the changed TTL to be updated, got {report['updated']}")
+    mock_database.command.assert_awaited_once_with(
+        "collMod",
+        "expense_tombstone",
+        index={"name": "deletedAt_ttl", "expireAfterSeconds": EXPENSE_TOMBSTONE_TTL_DAYS * 86400},
+    )
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_list_categories_is_cached_until_a_category_write(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    user_categories = [{"name": "Pets", "userId": ObjectId(USER_ID)}]
+    mock_database.category.find = MagicMock(
+        side_effect=lambda query, *_: AsyncCursor(
+            user_categories if "$exists" not in str(query) else [{"name": "Food"}]
+        )
+    )
+    mock_database.category.insert_one = AsyncMock(side_effect=user_categories.append)
+
+    for _ in range(2):
+        response = test_client.get("/categories", headers=auth_headers, params={"show_universal": True})
+        if response.json() != [{"name": "Pets", "userId": USER_ID}, {"name": "Food", "userId": None}]:
+            raise AssertionError(f"Unexpected categories: {response.json()}")
+    if mock_database.category.find.call_count != 2:
+        raise AssertionError(f"Expected one query per list, got {mock_database.category.find.call_count}")
+
+    test_client.post("/categories", headers=auth_headers, json={"name": "Travel"})
+    names = [category["name"] for category in test_client.get("/categories", headers=auth_headers).json()]
+    if names != ["Pets", "Travel"]:
+        raise AssertionError(f"Expected the new category after invalidation, got {names}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_rename_category_claims_the_category_and_retags_expenses(
+    test_client: TestClient,
+    mock_database: MagicMock,
+    mock_auth_service: AsyncMock,
+    auth_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr("app.categories.CATEGORY_RENAME_TRANSACTIONS", False)
+    user_id = ObjectId(USER_ID)
+    expense = {"_id": ObjectId(), "userId": user_id, "amount": 4.0, "date": "2025-03-01", "category": "Food"}
+    remaining = [expense]
+    mock_database.expense.count_documents = AsyncMock(return_value=1)
+    mock_database.expense.find = MagicMock(side_effect=lambda *_: AsyncCursor(list(remaining)))
+    mock_database.expense.find_one_and_update = AsyncMock(side_effect=lambda *_, **__: remaining.pop())
+    mock_database.category.update_one = AsyncMock(return_value=MagicMock(matched_count=1))
+    mock_database["category_job"].insert_one = AsyncMock()
+    mock_database["category_job"].update_one = AsyncMock()
+
+    response = test_client.put("/categories/Food", headers=auth_headers, json={"name": "Meals"})
+    if response.status_code != 200 or response.json() != {"name": "Meals"}:
+        raise AssertionError(f"Unexpected rename response: {response.status_code} {response.json()}")
+    claim_filter, claim_update = mock_database.category.update_one.call_args_list[0].args
+    if claim_filter.get("renameJob") != {"$exists": False} or claim_update["$set"]["name"] != "Meals":
+        raise AssertionError(f"Expected a conditional claim, got {claim_filter} {claim_update}")
+    bucket = {"userId": user_id, "month": "2025-03", "type": "", "currency": "USD"}
+    expected = [
+        UpdateOne({**bucket, "category": "Food"}, {"$inc": {"total": -4.0, "count": -1}}, upsert=True),
+        UpdateOne({**bucket, "category": "Meals"}, {"$inc": {"total": 4.0, "count": 1}}, upsert=True),
+    ]
+    updates = mock_database["expense_rollup"].bulk_write.call_args.args[0]
+    if updates != expected:
+        raise AssertionError(f"Expected the expense to move between rollup buckets, got {updates}")
+
+    # A second rename while the category is still claimed by a running job.
+    mock_database.expense.count_documents = AsyncMock(return_value=5000)
+    mock_database.category.update_one = AsyncMock(return_value=MagicMock(matched_count=0))
+    mock_database.category.find_one = AsyncMock(return_value={"_id": ObjectId()})
+    response = test_client.put("/categories/Meals", headers=auth_headers, json={"name": "Dining"})
+    if response.status_code != 409:
+        raise AssertionError(f"Expected 409 for a concurrent rename, got {response.status_code}")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_interrupted_inline_rename_fails_and_is_queued_for_retry(
+    test_client: TestClient,
+    mock_database: MagicMock,
+    mock_auth_service: AsyncMock,
+    auth_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr("app.categories.CATEGORY_RENAME_TRANSACTIONS", False)
+    mock_database.expense.count_documents = AsyncMock(return_value=1)
+    mock_database.expense.find = MagicMock(side_effect=AutoReconnect("connection lost"))
+    mock_database.category.update_one = AsyncMock(return_value=MagicMock(matched_count=1))
+    mock_database["category_job"].insert_one = AsyncMock()
+    mock_database["category_job"].update_one = AsyncMock()
+
+    response = test_client.put("/categories/Food", headers=auth_headers, json={"name": "Meals"})
+    if response.status_code != 503:
+        raise AssertionError(f"Expected 503 for an interrupted rename, got {response.status_code}")
+    [update] = [
+        call.args[1]
+        for call in mock_database["category_job"].update_one.call_args_list
+        if "attempts" in call.args[1].get("$set", {})
+    ]
+    if update["$set"]["attempts"] != 1 or update["$set"]["leaseUntil"] > time.time() + CATEGORY_JOB_RETRY_SECONDS:
+        raise AssertionError(f"Expected the job to be queued for a retry, got {update}")
+    # The category stays claimed by the job until a retry finishes it.
+    if any("$unset" in call.args[1] for call in mock_database.category.update_one.call_args_list):
+        raise AssertionError("The category claim should be kept while the job can still be retried")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_rename_category_to_its_own_name_is_rejected(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.expense.count_documents = AsyncMock(return_value=1)
+    mock_database.category.update_one = AsyncMock(return_value=MagicMock(matched_count=1))
+
+    response = test_client.put("/categories/Food", headers=auth_headers, json={"name": "Food"})
+    if response.status_code != 400:
+        raise AssertionError(f"Expected 400 for a rename to the same name, got {response.status_code}")
+    if mock_database.category.update_one.called or mock_database.expense.count_documents.called:
+        raise AssertionError("A rename to the same name must not touch the category or its expenses")
+
+    user_id = ObjectId(USER_ID)
+    mock_database["expense_rollup"].find = MagicMock(return_value=AsyncCursor([{"userId": user_id}]))
+    await rename_rollup_category(mock_database, user_id, "Food", "Food")
+    if mock_database["expense_rollup"].bulk_write.called:
+        raise AssertionError("Folding a rollup category into itself must be a no-op")
+
+
+# pylint: disable=redefined-outer-name
+@pytest.mark.asyncio
+async def test_create_category_duplicate(
+    test_client: TestClient, mock_database: MagicMock, mock_auth_service: AsyncMock, auth_headers: dict[str, str]
+) -> None:
+    mock_database.category.insert_one = AsyncMock(side_effect=DuplicateKeyError("E11000 duplicate key"))
+
+    response = test_client.post("/categories", headers=auth_headers, json={"name": "Groceries"})
+    if response.status_code != 400:
+        raise AssertionError(f"Expected status code 400, but got {response.status_code}")
+    if response.json()["detail"] != "Category already exists for this user":
+        raise AssertionError(f"Unexpected detail: {response.json()['detail']}")
+
+
+def test_mongo_client_is_shared_per_process() -> None:
+    client = connect_db()
+    try:
+        if connect_db() is not client:
+            raise AssertionError("Expected connect_db to reuse the process-wide client")
+        if get_db().client is not client:
+            raise AssertionError("Expected get_db to use the shared client")
+    finally:
+        close_db()
+
+
+@pytest.mark.asyncio
+async def test_metrics_report_requests_by_route(test_client: TestClient) -> None:
+    test_client.get("/health")
+    response = test_client.get("/metrics")
+    if response.status_code != 200:
+        raise AssertionError(f"Expected status code 200, but got {response.status_code}")
+    expected = 'http_request_duration_seconds_count{method="GET",route="/health",status="200"}'
+    if expected not in response.text or 'cache_hits_total{cache="auth_user_status"}' not in response.text:
+        raise AssertionError(f"Missing request or cache metrics in {response.text}")
+
+
+def test_admin_can_profile_a_request(
+    test_client: TestClient,
+    mock_auth_service: AsyncMock,
+    auth_headers: dict[str, str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+) -> None:
+    monkeypatch.setattr("app.profiling.PROFILE_DIR", tmp_path)
+    monkeypatch.setattr("app.profiling.PROFILE_MAX_FILES", 0)
+    # Files the middleware did not write survive pruning, as do subdirectories.
+    (tmp_path / "notes.html").write_text("keep", encoding="utf-8")
+    (tmp_path / "20250101T000000-000-GET-cache.prof").mkdir()
+    admin_token = jwt.encode(
+        {"sub": "admin@example.com", "userId": USER_ID, "role": "admin"}, SECRET_KEY, algorithm=ALGORITHM
+    )
+    admin_headers = {"Authorization": f"Bearer {admin_token}"}
+
+    response = test_client.get("/health", headers={**auth_headers, "X-Profile": "1"})
+    if "X-Profile-Id" in response.headers:
+        raise AssertionError("Only admins may request a profile")
+    response = test_client.get("/health", headers={**admin_headers, "X-Profile": "1"})
+    name = response.headers.get("X-Profile-Id", "")
+    if not name.endswith("-GET-health.prof"):
+        raise AssertionError(f"Expected a profile id, got {response.headers}")
+    if sorted(path.name for path in tmp_path.iterdir()) != ["20250101T000000-000-GET-cache.prof", "notes.html"]:
+        raise AssertionError(f"Pruning should only remove profiles, left {list(tmp_path.iterdir())}")
+    monkeypatch.setattr("app.profiling.PROFILE_MAX_FILES", 50)
+    response = test_client.get("/health", headers={**admin_headers, "X-Profile": "1"})
+    name = response.headers.get("X-Profile-Id", "")
+
+    profiles = test_client.get("/admin/profiles", headers=admin_headers).json()
+    if [profile["name"] for profile in profiles] != [name]:
+        raise AssertionError(f"Expected the stored profile to be listed, got {profiles}")
+    if test_client.get("/admin/profiles", headers=auth_headers).status_code != 403:
+        raise AssertionError("Expected non-admins to be refused")
+    if test_client.get("/admin/profiles/../secret.prof", headers=admin_headers).status_code != 404:
+        raise AssertionError("Expected unknown profiles to be refused")
+
+
+def test_request_id_is_echoed_and_logged(test_client: TestClient) -> None:
+    response = test_client.get("/health", headers={"X-Request-ID": "req-123"})
+    if response.headers.get("X-Request-ID") != "req-123":
+        raise AssertionError(f"Expected the request id to be echoed, got {response.headers}")
+    if len(test_client.get("/health").headers.get("X-Request-ID", "")) != 32:
+        raise AssertionError("Expected a generated request id")
+
+    token = request_id_var.set("req-456")
+    try:
+        record = logging.LogRecord("app.main", logging.INFO, __file__, 1, "Saved %s", ("expense",), None)
+        ContextFilter().filter(record)
+        record.userId = USER_ID
+        entry = json.loads(JsonFormatter().format(record))
+    finally:
+        request_id_var.reset(token)
+    if (entry["msg"], entry["requestId"], entry["userId"]) != ("Saved expense", "req-456", USER_ID):
+        raise AssertionError(f"Unexpected log entry: {entry}")
 
 
 @pytest.mark.asyncio
@@ -1,5 +1,5 @@
 import { useState, useEffect } from "react";
-import axios from "axios";
+import { fetchAllExpenses } from "../expenses";
 import {
   Box,
   Card,
@@ -42,15 +42,10 @@ function Calendar({ token }) {
           0
         ).getDate()}`;
 
-        const response = await axios.get("http://127.0.0.1:8001/expense", {
-          headers: { Authorization: `Bearer ${token}` },
-          params: {
-            date_gte: startDate,
-            date_lte: endDate,
-          },
+        const data = await fetchAllExpenses(token, {
+          date_gte: startDate,
+          date_lte: endDate,
         });
-
-        const data = response.data || [];
         const expenseMap = {};
 
         data.forEach((item) => {
@@ -20,6 +20,7 @@ import {
   useTheme,
 } from "@mui/material";
 import axios from "axios";
+import { fetchAllExpenses } from "../expenses";
 import {
   Chart as ChartJS,
   ArcElement,
@@ -66,13 +67,7 @@ function Dashboard({ token, refreshKey }) {
       setIsLoading(true);
       setError("");
       try {
-        const expensesResponse = await axios.get(
-          "http://127.0.0.1:8001/expense",
-          {
-            headers: { Authorization: `Bearer ${token}` },
-          }
-        );
-        setExpenses(expensesResponse.data || []);
+        setExpenses(await fetchAllExpenses(token));
 
         const categoriesResponse = await axios.get(
           "http://127.0.0.1:8001/categories",
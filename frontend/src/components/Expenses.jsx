@@ -1,5 +1,6 @@
 import { useState, useEffect, useMemo } from "react";
 import axios from "axios";
+import { fetchAllExpenses } from "../expenses";
 import {
   Card,
   CardContent,
@@ -198,14 +199,8 @@ function Expenses({ token }) {
         if (filters.type) params.type = filters.type;
         console.log("Fetch Expenses Params:", params);
 
-        const response = await axios.get("http://127.0.0.1:8001/expense", {
-          headers: { Authorization: `Bearer ${token}` },
-          params,
-        });
-        console.log("Expenses API Response:", response.data);
-        const fetchedExpenses = Array.isArray(response.data)
-          ? response.data
-          : [];
+        const fetchedExpenses = await fetchAllExpenses(token, params);
+        console.log("Expenses API Response:", fetchedExpenses);
         setExpenses(fetchedExpenses);
         setSelectedExpenses([]);
       } catch (err) {
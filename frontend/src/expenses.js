@@ -0,0 +1,20 @@
+import axios from "axios";
+
+const EXPENSE_URL = "http://127.0.0.1:8001/expense";
+// The largest page GET /expense serves (EXPENSE_PAGE_SIZE_MAX).
+const PAGE_SIZE = 1000;
+
+// GET /expense is paged: keep following X-Next-Cursor until every matching expense is loaded.
+export const fetchAllExpenses = async (token, params = {}) => {
+  const expenses = [];
+  let cursor;
+  do {
+    const response = await axios.get(EXPENSE_URL, {
+      headers: { Authorization: `Bearer ${token}` },
+      params: { ...params, limit: PAGE_SIZE, ...(cursor ? { cursor } : {}) },
+    });
+    if (Array.isArray(response.data)) expenses.push(...response.data);
+    cursor = response.headers["x-next-cursor"];
+  } while (cursor);
+  return expenses;
+};